@@ -0,0 +1,118 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import runner
+import fileio
+import utils as utils
+import yamlio
+import constants as const
+
+index_lock = threading.Lock()
+
+
+def bundle_key(repo: str, version: str, image: str) -> str:
+    # One rendered bundle per operator repository, version and controller image
+    return hashlib.sha256(json.dumps([repo, version, image]).encode()).hexdigest()
+
+
+def index_file() -> str:
+    return os.path.join(const.OPERATOR_BUNDLES_DIR, 'index.json')
+
+
+def object_file(digest: str) -> str:
+    return os.path.join(const.OPERATOR_BUNDLES_DIR, 'objects', f"{digest}.yaml")
+
+
+def read_index() -> dict:
+    try:
+        with open(index_file(), 'r') as index:
+            return json.load(index)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def lookup(repo: str, version: str, image: str):
+    # The cached bundle of an operator, None if it was never rendered (or its object file is gone)
+    entry = read_index().get(bundle_key(repo, version, image))
+    if entry is None or not os.path.exists(object_file(entry['digest'])):
+        return None
+    return object_file(entry['digest'])
+
+
+def store(repo: str, version: str, image: str, content: str) -> str:
+    # Objects are named after the hash of their content, bundles that render the same manifests share one file
+    digest = hashlib.sha256(content.encode()).hexdigest()
+    path = object_file(digest)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if not os.path.exists(path):
+        fileio.atomic_write(path, content)
+    with index_lock, fileio.locked(index_file()):
+        index = read_index()
+        index[bundle_key(repo, version, image)] = {'repo': repo, 'version': version, 'image': image, 'digest': digest}
+        fileio.atomic_write(index_file(), json.dumps(index, indent=2, sort_keys=True))
+    return path
+
+
+def checkout(repo: str, version: str, repo_dir: str) -> bool:
+    # The operator sources at the version tag, cloned the first time
+    log_file = utils.provider_log_file()
+    if not os.path.exists(repo_dir):
+        result = runner.run(['git', 'clone', repo, repo_dir, '--branch', f'v{version}'], log_file, timeout=const.CLI_TIMEOUT)
+        return result.ok
+    return runner.run(['git', 'checkout', f'v{version}'], log_file, cwd=repo_dir, timeout=const.CLI_TIMEOUT).ok
+
+
+def set_image(manifests: list, image: str) -> list:
+    # What make deploy IMG=... does with kustomize edit: the manager container runs the requested controller image
+    for manifest in manifests:
+        if manifest.get('kind') != 'Deployment':
+            continue
+        for container in manifest.get('spec', {}).get('template', {}).get('spec', {}).get('containers', []):
+            if container.get('name') == const.OPERATOR_MANAGER_CONTAINER:
+                container['image'] = image
+    return manifests
+
+
+def render(repo: str, version: str, image: str, repo_dir: str):
+    """
+    Renders the manifests that make deploy would apply, with kustomize built into kubectl (or kustomize itself).
+
+    :param repo: the git repository of the operator
+    :param version: the operator version, checked out from the v<version> tag
+    :param image: the controller image
+    :param repo_dir: where the operator sources are checked out
+    :return: the manifests as a multi-document YAML, None if the sources or the rendering failed
+    """
+    if not checkout(repo, version, repo_dir):
+        utils.log(f"Could not check out version {version} of {repo}.")
+        return None
+    config_dir = os.path.join(repo_dir, const.OPERATOR_KUSTOMIZE_DIR)
+    command = ['kubectl', 'kustomize', config_dir] if shutil.which('kubectl') else ['kustomize', 'build', config_dir]
+    result = runner.run(command, utils.provider_log_file(), timeout=const.CLI_TIMEOUT)
+    if not result.ok:
+        utils.log(f"Could not render the manifests of {repo} {version} ({result.reason}). {result.stderr.strip()}")
+        return None
+    manifests = set_image(yamlio.loads_all(result.stdout), image)
+    return '---\n'.join(yamlio.dumps(manifest, sort_keys=False) for manifest in manifests)
+
+
+def get_bundle(repo: str, version: str, image: str, repo_dir: str, refresh=False):
+    """
+    The manifests of an operator, rendered the first time and then applied from the cache under the catalog directory.
+
+    A cached bundle needs neither the network nor git, kustomize or make.
+
+    :param repo: the git repository of the operator
+    :param version: the operator version
+    :param image: the controller image
+    :param repo_dir: where the operator sources are checked out when the bundle has to be rendered
+    :param refresh: render the bundle again even if it is cached
+    :return: the path of the bundle, None if it is not cached and could not be rendered
+    """
+    path = None if refresh else lookup(repo, version, image)
+    if path is not None:
+        return path
+    content = render(repo, version, image, repo_dir)
+    return store(repo, version, image, content) if content is not None else None
@@ -0,0 +1,208 @@
+import os
+import re
+import threading
+import yamlio
+import fileio
+import constants as const
+
+# Older catalog files used different names for some fields
+LEGACY_FIELDS = {'installation_type': 'installed_type'}
+
+catalogs = {}
+catalogs_lock = threading.Lock()
+
+
+class Product:
+    # One entry of the catalog, the attributes are named after the catalog.yaml keys
+    __slots__ = (
+        'product',
+        'default_version',
+        'default_type',
+        'available_types',
+        'installed_version',
+        'installed_type',
+        'operatorRepo',
+        'operatorVersion',
+        'operatorImage',
+        'operatorDir',
+        'operatorNamespace',
+        'deploymentFile',
+        'imageVersion',
+        'extra',
+    )
+
+    def __init__(self, product: str, default_version=None, default_type=None, available_types=None, installed_version=None,
+                 installed_type=None, operatorRepo=None, operatorVersion=None, operatorImage=None, operatorDir=None,
+                 operatorNamespace=None, deploymentFile=None, imageVersion=None, extra=None):
+        self.product = product
+        self.default_version = default_version
+        self.default_type = default_type
+        self.available_types = list(available_types or [])
+        self.installed_version = installed_version
+        self.installed_type = installed_type
+        self.operatorRepo = operatorRepo
+        self.operatorVersion = operatorVersion
+        self.operatorImage = operatorImage
+        self.operatorDir = operatorDir
+        self.operatorNamespace = operatorNamespace
+        self.deploymentFile = deploymentFile
+        self.imageVersion = imageVersion
+        # Keys the model does not know about are kept so that they survive a rewrite of the catalog
+        self.extra = dict(extra or {})
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        fields = {}
+        extra = {}
+        for key, value in data.items():
+            key = LEGACY_FIELDS.get(key, key)
+            if key in cls.__slots__ and key != 'extra':
+                # Empty values (e.g. "installed_version:") are None, numbers are kept as the strings they stand for
+                fields[key] = value if value is None or isinstance(value, (str, list)) else str(value)
+            else:
+                extra[key] = value
+        return cls(extra=extra, **fields)
+
+    def to_dict(self) -> dict:
+        data = {slot: getattr(self, slot) for slot in self.__slots__ if slot != 'extra'}
+        data.update(self.extra)
+        return data
+
+    @property
+    def installed(self) -> bool:
+        return bool(self.installed_type)
+
+    @property
+    def depends_on(self) -> list:
+        # The products that have to be installed first (e.g. the one providing the CRDs), declared with depends_on
+        return list(self.extra.get('depends_on') or [])
+
+    def supports(self, install_type: str) -> bool:
+        return install_type in self.available_types
+
+    def __repr__(self) -> str:
+        return f"Product({self.product!r}, installed_type={self.installed_type!r}, installed_version={self.installed_version!r})"
+
+
+class Catalog:
+    """
+    The products that can be installed by the kubelab cli, indexed by name and installation type.
+
+    :param products: the catalog entries, in the order of the catalog file
+    """
+
+    def __init__(self, products: list):
+        self.products = products
+        self.by_name = {}
+        self.by_type = {}
+        for product in products:
+            self.by_name[product.product] = product
+            for install_type in product.available_types:
+                self.by_type.setdefault(install_type, []).append(product)
+
+    def get(self, name: str):
+        return self.by_name.get(name)
+
+    def with_type(self, install_type: str) -> list:
+        return self.by_type.get(install_type, [])
+
+    def installed(self) -> list:
+        return [product for product in self.products if product.installed]
+
+    def names(self) -> list:
+        return [product.product for product in self.products]
+
+    def dependencies(self) -> dict:
+        return {product.product: product.depends_on for product in self.products}
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.by_name
+
+    def __iter__(self):
+        return iter(self.products)
+
+    def __len__(self) -> int:
+        return len(self.products)
+
+
+def parse_catalog(data) -> Catalog:
+    return Catalog([Product.from_dict(entry) for entry in data or [] if isinstance(entry, dict) and entry.get('product')])
+
+
+def load_catalog(path=const.CATALOG_FILE) -> Catalog:
+    # Parsed once per process and reused as long as the catalog file does not change on disk
+    key = os.path.abspath(path)
+    try:
+        stat = os.stat(key)
+    except FileNotFoundError:
+        return Catalog([])
+    fingerprint = (stat.st_mtime_ns, stat.st_size)
+    with catalogs_lock:
+        cached = catalogs.get(key)
+        if cached is not None and cached[0] == fingerprint:
+            return cached[1]
+    loaded = parse_catalog(yamlio.load(key, default=[]))
+    with catalogs_lock:
+        catalogs[key] = (fingerprint, loaded)
+    return loaded
+
+
+def format_scalar(value) -> str:
+    if value is None or value == '':
+        return ''
+    return yamlio.dumps(value).splitlines()[0]
+
+
+def patch_product(text: str, name: str, fields: dict):
+    """
+    Rewrites only the given fields of one product block, the rest of the catalog is kept byte for byte.
+
+    :return: the patched catalog, None when the product block could not be found (e.g. flow style YAML)
+    """
+    lines = text.splitlines(keepends=True)
+    start = end = None
+    for i, line in enumerate(lines):
+        match = re.match(r'^(\s*)- product:\s*(.*?)\s*$', line)
+        if start is None:
+            if match and str(yamlio.loads(match.group(2))) == name:
+                start, item_indent = i, len(match.group(1))
+        elif line.strip() and len(line) - len(line.lstrip(' ')) <= item_indent:
+            end = i
+            break
+    if start is None:
+        return None
+    end = len(lines) if end is None else end
+    key_indent = ' ' * (item_indent + 2)
+    for field, value in fields.items():
+        keys = [field] + [legacy for legacy, current in LEGACY_FIELDS.items() if current == field]
+        new_line = f"{key_indent}{field}: {format_scalar(value)}".rstrip() + '\n'
+        for i in range(start + 1, end):
+            if re.match(rf'^{key_indent}({"|".join(keys)}):', lines[i]):
+                lines[i] = new_line
+                break
+        else:
+            lines.insert(start + 1, new_line)
+            end += 1
+    return ''.join(lines)
+
+
+def update_product(name: str, path=const.CATALOG_FILE, **fields) -> bool:
+    # Changes some fields of a single product under the catalog lock and replaces the file atomically
+    with fileio.locked(path):
+        with open(path, 'r') as catalog_file:
+            text = catalog_file.read()
+        patched = patch_product(text, name, fields)
+        if patched is None:
+            data = yamlio.loads(text) or []
+            entries = [entry for entry in data if isinstance(entry, dict) and entry.get('product') == name]
+            if not entries:
+                return False
+            entries[0].update(fields)
+            patched = yamlio.dumps(data, sort_keys=False)
+        fileio.atomic_write(path, patched)
+    return True
+
+
+def set_installed(name: str, version, install_type, path=const.CATALOG_FILE) -> bool:
+    # Records what is currently installed for a product, None clears it
+    return update_product(name, path, installed_version=version, installed_type=install_type)
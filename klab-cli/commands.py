@@ -0,0 +1,24 @@
+import importlib
+import click
+
+
+class LazyGroup(click.Group):
+    """
+    A click group whose commands live in other modules, each module is only imported when one of its commands is run.
+
+    The commands of the group itself (the ones added with @group.command) are loaded with it as usual.
+    lab --help and the completion of the command names import the command modules, they need their help texts.
+    """
+    def __init__(self, *args, lazy_commands=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Command name -> "module:attribute" of the click command
+        self.lazy_commands = lazy_commands or {}
+
+    def list_commands(self, ctx: click.Context) -> list:
+        return sorted({*super().list_commands(ctx), *self.lazy_commands})
+
+    def get_command(self, ctx: click.Context, name: str):
+        if name in self.lazy_commands and name not in self.commands:
+            module_name, attribute = self.lazy_commands[name].split(':')
+            self.add_command(getattr(importlib.import_module(module_name), attribute), name)
+        return super().get_command(ctx, name)
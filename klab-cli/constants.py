@@ -2,7 +2,26 @@
 CREDENTIALS_DIR = 'credentials'
 LOGS_DIR = 'logs'
 CLUSTERS_DIR = 'clusters'
+CLUSTER_FILE_SUFFIX = '_cluster.yaml'
+REGISTRY_FILE = '.registry.db'
+WORKSPACES_DIR = 'workspaces'
 GENERIC_LOG_FILE = 'kubelab.log'
+# Log files are JSON lines, rotated once they reach LOG_MAX_BYTES
+LOG_MAX_BYTES = 100 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+LOG_LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR')
+# lab logs: lines shown without --since, bytes read per step when reading a log backwards and seconds between two
+# checks of a followed log (the longest wait for a change when inotify is not available)
+LOG_TAIL_LINES = 10
+LOG_TAIL_BLOCK = 64 * 1024
+LOG_FOLLOW_INTERVAL = 1.0
+CATALOG_FILE = 'catalog/catalog.yaml'
+
+# Operator manifests rendered once per repository, version and image (content-addressed), and applied from there.
+# They are rendered from the kustomize directory of the operator sources, the manager container gets the image
+OPERATOR_BUNDLES_DIR = 'catalog/bundles'
+OPERATOR_KUSTOMIZE_DIR = 'config/default'
+OPERATOR_MANAGER_CONTAINER = 'manager'
 
 AWS_PROVIDER = 'AWS'
 AWS_PROFILE_FILE = '~/.aws/credentials'
@@ -19,5 +38,57 @@ GCP_PROFILE_FILE = '~/.config/gcloud/configurations/config_default'
 GCP_CONFIG_FILE = '~/.config/gcloud/configurations/config_default'
 GCP_LOG_FILE = 'kubelab-gcp.log'
 
+DEFAULT_DESTROY_WORKERS = 4
+
+# Waiter defaults (seconds) used while polling the cloud control planes
+WAIT_INITIAL_DELAY = 5
+WAIT_MAX_DELAY = 60
+WAIT_TIMEOUT = 45 * 60
+
+# Background jobs: their output goes to <logs>/jobs/<id>.log, lab jobs wait polls their status every JOB_POLL_INTERVAL seconds at first
+JOBS_LOGS_DIR = 'jobs'
+JOB_POLL_INTERVAL = 1
+JOB_MAX_POLL_INTERVAL = 10
+# Set by the supervisor in the environment of the job command, which then stops its running commands on SIGTERM
+JOB_ID_ENV = 'KLAB_JOB_ID'
+# Commands that exit with 1 when they fail
+EXIT_CODE_COMMANDS = ('create', 'destroy', 'jobs', 'apply', 'add', 'init')
+
+# Commands run by the runner: concurrent commands in run_many and timeouts (seconds) of cloud CLI calls and terraform
+RUNNER_MAX_WORKERS = 8
+CLI_TIMEOUT = 5 * 60
+TERRAFORM_TIMEOUT = 2 * 60 * 60
+# Saved terraform plans and their fingerprints, inside each provider module
+PLAN_CACHE_DIR = '.klab-plans'
+# Provider plugins downloaded once and shared by all the provider modules, and the terraform CLI config written by init --mirror
+TF_PLUGIN_CACHE_DIR = '~/.klab/terraform/plugin-cache'
+TF_CLI_CONFIG_FILE = '~/.klab/terraform/terraformrc'
+
+# Probes of the external tools (path, version, login), reused until the binary or its credentials change or the TTL
+# (seconds, overridden by TOOLCHAIN_TTL_ENV) expires
+TOOLCHAIN_CACHE_FILE = '~/.klab/toolchain.json'
+TOOLCHAIN_TTL = 24 * 60 * 60
+TOOLCHAIN_TTL_ENV = 'KLAB_TOOLCHAIN_TTL'
+
+# lab show cluster --live: what the cloud APIs listed, per provider and region (or project), is reused until it is
+# INVENTORY_TTL seconds old (overridden by INVENTORY_TTL_ENV). The AWS regions are the ones enabled for the account
+# unless INVENTORY_AWS_REGIONS_ENV lists them (comma separated)
+INVENTORY_CACHE_FILE = '~/.klab/inventory.json'
+INVENTORY_TTL = 5 * 60
+INVENTORY_TTL_ENV = 'KLAB_INVENTORY_TTL'
+INVENTORY_AWS_REGIONS_ENV = 'KLAB_AWS_REGIONS'
+INVENTORY_WORKERS = 24
+
+# Kubernetes API client used to apply the catalog manifests, setting KUBECTL_ENV to 1 forces kubectl instead
+KUBECONFIG_FILE = '~/.kube/config'
+KUBE_FIELD_MANAGER = 'klab'
+KUBE_CONNECTION_POOL_SIZE = 8
+KUBECTL_ENV = 'KLAB_KUBECTL'
+# Default of add/update --timeout (seconds)
+ROLLOUT_TIMEOUT = 10 * 60
+
 UNSUPPORTED_TYPE_MSG = "Unsupported type specified. Only 'cluster' is supported."
 UNSUPPORTED_PROVIDER_MSG = "Unsupported provider specified."
+
+# lab apply: number of product actions of a spec run at the same time
+APPLY_WORKERS = 4
@@ -1,6 +1,25 @@
 import os
-import subprocess
-import re
+import tempfile
+import bundles
+import catalog
+import kubeapply
+import yamlio
+
+
+def render_deployment(manifests: list, image: str, replicas=None, port=None) -> list:
+    # The containers of the deployments run the image, replicas and the service port come from a cluster spec and are kept when not set
+    for manifest in manifests:
+        spec = manifest.get('spec') or {}
+        if manifest.get('kind') == 'Deployment':
+            for container in spec.get('template', {}).get('spec', {}).get('containers', []):
+                container['image'] = image
+            if replicas is not None:
+                spec['replicas'] = replicas
+        elif manifest.get('kind') == 'Service' and port is not None:
+            # Only the port the service exposes, the containers keep listening where they do
+            for service_port in spec.get('ports', []):
+                service_port['port'] = port
+    return manifests
 
 
 class Deploy:
@@ -16,116 +35,52 @@ class Deploy:
         self.imageVersion = imageVersion
         pass
 
-    def deployment(self, productName, imageVersion):
+    def deployment(self, productName, imageVersion, replicas=None, port=None):
         # Deployment code here
-        with open(self.deployment_type, "r") as f:
-            yaml_content = f.read()
-
-        pattern = r"(image:\s*[\w/-]+:)(.*)"
-        yaml_content = re.sub(pattern, f"image: {productName}:{imageVersion}", yaml_content)
-
-        with open(self.deployment_type, "w") as f:
-            f.write(yaml_content)
-
-        process = subprocess.Popen(['kubectl', 'apply', '-f', self.deployment_type], stdout=subprocess.PIPE, universal_newlines=True)
-        print(f"Installing {productName} with deployment and {imageVersion} image version \n ")
-        exit_code = process.wait()
-        if exit_code == 0:
+        manifests = render_deployment(kubeapply.load_manifests(self.deployment_type), f"{productName}:{imageVersion}", replicas, port)
+        # The catalog manifest is tracked in git, the values of this install are applied from a copy
+        fd, rendered = tempfile.mkstemp(prefix=f'.{productName}-', suffix='.yaml')
+        try:
+            with os.fdopen(fd, 'w') as rendered_file:
+                rendered_file.write('---\n'.join(yamlio.dumps(manifest, sort_keys=False) for manifest in manifests))
+            print(f"Installing {productName} with deployment and {imageVersion} image version \n ")
+            applied = kubeapply.apply_manifest(rendered)
+        finally:
+            os.remove(rendered)
+        if applied:
             print(f"Successfully deployed {productName} with deployment version {imageVersion} \n ")
-        else:
-            print("Deployment failed")
-        data = [
-            {
-                # FIXME this is pure garbage, why we always rewrite everything instead of just editing the installed type and version?
-                'product': productName,
-                'default_version': 'latest',
-                'default_type': 'deployment',
-                'available_types': ['deployment', 'operator'],
-                'installed_version': self.imageVersion,
-                'installed_type': self.installed_type,
-                'operatorRepo': 'https://github.com/nginxinc/nginx-ingress-helm-operator/',
-                # FIXME this is hardcoded, we should get it from the catalog.yaml
-                'operatorVersion': self.op_version,
-                'operatorImage': self.operatorImage,
-                'operatorDir': self.operatorDir,
-                'deploymentFile': self.deployment_type,
-                'imageVersion': self.imageVersion
-            },
-        ]
-        with open('catalog/catalog.yaml', 'w') as file:
-            for item in data:
-                file.write("- product: {}\n".format(item['product']))
-                file.write("  default_version: {}\n".format(item['default_version']))
-                file.write("  default_type: {}\n".format(item['default_type']))
-                file.write("  available_types:\n")
-                for available_type in item['available_types']:
-                    file.write("    - {}\n".format(available_type))
-                file.write("  installed_version: {}\n".format(item['installed_version']))
-                file.write("  installed_type: {}\n".format(item['installed_type']))
-                file.write("  operatorRepo: {}\n".format(item['operatorRepo']))
-                file.write("  operatorVersion: {}\n".format(item['operatorVersion']))
-                file.write("  operatorImage: {}\n".format(item['operatorImage']))
-                file.write("  operatorDir: {}\n".format(item['operatorDir']))
-                file.write("  deploymentFile: {}\n".format(item['deploymentFile']))
-                file.write("  imageVersion: {}\n\n".format(item['imageVersion']))
+            # Only the installed fields of this product change, the rest of the catalog is left untouched
+            catalog.set_installed(productName, imageVersion, self.installed_type)
+            return True
+        print("Deployment failed")
+        return False
 
     def operator(self, productName, operatorRepo):
         # Operator code here
-        repo_dir = self.operatorDir
-        if not os.path.exists(repo_dir):
-            subprocess.run(['git', 'clone', operatorRepo, '--branch', f'v{self.op_version}'])
-        os.chdir(repo_dir)
         print(f'Adding {productName} operator with {self.op_version} version\n')
-        subprocess.run(['git', 'checkout', f'v{self.op_version}'])
-        # Deploy the Operator
-        img = f'{self.operatorImage}:{self.op_version}'
-        process = subprocess.Popen(['make', 'deploy', f'IMG={img}'], stdout=subprocess.PIPE, universal_newlines=True)
-        exit_code = process.wait()
-        if exit_code == 0:
+        # Rendered once per version and image, then applied from the bundle cache without git, kustomize or make
+        bundle = bundles.get_bundle(operatorRepo, self.op_version, f'{self.operatorImage}:{self.op_version}', self.operatorDir)
+        if bundle is not None and kubeapply.apply_manifest(bundle):
             print(f"Succesfully deployed {productName} with operator {self.op_version} version\n")
-        else:
-            print("Deployment failed")
-        data = [
-            {
-                'product': productName,
-                'default_version': self.op_version,
-                'default_type': 'deployment',
-                'available_types': ['deployment', 'operator'],
-                'installed_version': self.op_version,
-                'installed_type': self.installed_type,
-                'operatorRepo': operatorRepo,
-                'operatorVersion': self.op_version,
-                'operatorImage': self.operatorImage,
-                'operatorDir': self.operatorDir,
-                'deploymentFile': self.deployment_type,
-                'imageVersion': self.imageVersion
-            },
-        ]
-        with open('catalog/catalog.yaml', 'w') as file:
-            for item in data:
-                file.write("- product: {}\n".format(item['product']))
-                file.write("  default_version: {}\n".format(item['default_version']))
-                file.write("  default_type: {}\n".format(item['default_type']))
-                file.write("  available_types:\n")
-                for available_type in item['available_types']:
-                    file.write("    - {}\n".format(available_type))
-                file.write("  installed_version: {}\n".format(item['installed_version']))
-                file.write("  installed_type: {}\n".format(item['installed_type']))
-                file.write("  operatorRepo: {}\n".format(item['operatorRepo']))
-                file.write("  operatorVersion: {}\n".format(item['operatorVersion']))
-                file.write("  operatorImage: {}\n".format(item['operatorImage']))
-                file.write("  operatorDir: {}\n".format(item['operatorDir']))
-                file.write("  deploymentFile: {}\n".format(item['deploymentFile']))
-                file.write("  imageVersion: {}\n\n".format(item['imageVersion']))
-        pass
+            catalog.set_installed(productName, self.op_version, self.installed_type)
+            return True
+        print("Deployment failed")
+        return False
+
+    def undeploy_operator(self, productName):
+        # Deletes the objects of the operator bundle, what make undeploy did
+        bundle = bundles.get_bundle(self.operatorRepo, self.op_version, f'{self.operatorImage}:{self.op_version}', self.operatorDir)
+        if bundle is not None and kubeapply.delete_manifest(bundle):
+            print(f"Successfully deleted {productName} operator {self.op_version} version\n")
+            return True
+        print("Deployment failed")
+        return False
 
     def switch_operator(self, productName, autoApprove):
         deploy_repo = f"catalog/{productName}/deployment"
         if autoApprove.lower() == 'yes':
             print("Deleting the deployment and switching to operator \n")
-            process = subprocess.Popen(['kubectl', 'delete', '-f', f'{deploy_repo}/deployment.yaml'], stdout=subprocess.PIPE, universal_newlines=True)
-            exit_code = process.wait()
-            if exit_code == 0:
+            if kubeapply.delete_manifest(f'{deploy_repo}/deployment.yaml'):
                 print(f"Successfully deleted {productName} deployment \n")
             else:
                 print("Deployment failed")
@@ -133,9 +88,7 @@ class Deploy:
             answer = input(f"{productName} is already installed, do you want to switch from the current installation (deployment - latest) to an operator based one? (Y/N): ")
             if answer.lower() == 'yes':
                 print("Deleting the deployment and switching to operator \n")
-                process = subprocess.Popen(['kubectl', 'delete', '-f', f'{deploy_repo}/deployment.yaml'], stdout=subprocess.PIPE, universal_newlines=True)
-                exit_code = process.wait()
-                if exit_code == 0:
+                if kubeapply.delete_manifest(f'{deploy_repo}/deployment.yaml'):
                     print(f"Successfully deleted {productName} deployment \n")
                 else:
                     print("Deployment failed")
@@ -146,28 +99,12 @@ class Deploy:
     def switch_deployment(self, productName, autoApprove):
         if autoApprove.lower() == 'yes':
             print("Deleting operator and switching to deployment \n")
-            repo_dir = self.operatorDir
-            os.chdir(repo_dir)
-            # Delete the deployed operator
-            process = subprocess.Popen(['make', 'undeploy'], stdout=subprocess.PIPE, universal_newlines=True)
-            exit_code = process.wait()
-            if exit_code == 0:
-                print(f"Successfully deleted {productName} operator {self.op_version} version\n")
-            else:
-                print("Deployment failed")
+            self.undeploy_operator(productName)
         else:
             answer = input(f"{productName} is already installed, do you want to switch from the current installation (operator - {self.op_version}) to an deployment based one? (Y/N): ")
             if answer.lower() == 'yes':
                 print("Deleting operator and switching to deployment \n")
-                repo_dir = self.operatorDir
-                os.chdir(repo_dir)
-                # Delete the deployed operator
-                process = subprocess.Popen(['make', 'undeploy'], stdout=subprocess.PIPE, universal_newlines=True)
-                exit_code = process.wait()
-                if exit_code == 0:
-                    print(f"Successfully deleted {productName} operator {self.op_version} version\n")
-                else:
-                    print("Deployment failed")
+                self.undeploy_operator(productName)
             elif answer.lower() == 'no':
                 print("Keeping the deployment installed.")
                 exit()
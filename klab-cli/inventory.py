@@ -0,0 +1,271 @@
+import json
+import os
+import threading
+import time
+import runner
+import fileio
+import toolchain
+import constants as const
+
+# Status of a cluster in the live inventory
+MANAGED = 'managed'
+# Registered by lab use, created outside the kubelab cli
+IMPORTED = 'imported'
+# In the registry but not in the cloud anymore, e.g. deleted from the console
+ORPHANED = 'orphaned'
+# In the cloud but unknown to the kubelab cli
+UNMANAGED = 'unmanaged'
+# In the registry, but its provider or region could not be listed
+UNKNOWN = 'unknown'
+
+# The CLI of every provider, it has to be installed for the provider to be queried
+PROVIDER_TOOLS = {const.AWS_PROVIDER: 'aws', const.AZURE_PROVIDER: 'az', const.GCP_PROVIDER: 'gcloud'}
+# Azure lists the clusters of every region in one call
+ALL_REGIONS = '*'
+
+cache_lock = threading.Lock()
+
+
+def cache_file() -> str:
+    return os.path.expanduser(const.INVENTORY_CACHE_FILE)
+
+
+def cache_ttl() -> float:
+    try:
+        return float(os.environ.get(const.INVENTORY_TTL_ENV, const.INVENTORY_TTL))
+    except ValueError:
+        return const.INVENTORY_TTL
+
+
+def read_cache() -> dict:
+    try:
+        with open(cache_file(), 'r') as cached:
+            return json.load(cached)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def write_cache(fetched: dict):
+    path = cache_file()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with cache_lock, fileio.locked(path):
+        entries = read_cache()
+        entries.update(fetched)
+        fileio.atomic_write(path, json.dumps(entries, indent=2, sort_keys=True))
+
+
+def config_value(config_file: str, section: str, key: str):
+    # A value of a CLI config file (e.g. the default GCP project), None when it is not set
+    import configparser
+    config = configparser.ConfigParser()
+    try:
+        config.read(os.path.expanduser(config_file))
+    except configparser.Error:
+        return None
+    return config.get(section, key, fallback=None)
+
+
+def scope_key(provider: str, location: str) -> str:
+    # One cached listing: the clusters of a provider in a region (AWS), a project (GCP) or the subscription (Azure)
+    return f"{provider}/{location}"
+
+
+def query(provider: str, location: str) -> list:
+    if provider == const.AWS_PROVIDER:
+        return ['aws', 'eks', 'list-clusters', '--region', location, '--output', 'json']
+    if provider == const.AZURE_PROVIDER:
+        return ['az', 'aks', 'list', '--query', '[].{name:name, location:location, resourceGroup:resourceGroup}', '--output', 'json']
+    return ['gcloud', 'container', 'clusters', 'list', '--project', location, '--format', 'json(name,location)']
+
+
+def parse(provider: str, location: str, output: str) -> list:
+    # The clusters of one listing, with the fields of the cluster files
+    data = json.loads(output or 'null')
+    if provider == const.AWS_PROVIDER:
+        return [{'name': name, 'provider': provider, 'region': location} for name in (data or {}).get('clusters', [])]
+    if provider == const.AZURE_PROVIDER:
+        return [{'name': item['name'], 'provider': provider, 'region': item['location'], 'resource_group': item['resourceGroup']}
+                for item in data or []]
+    return [{'name': item['name'], 'provider': provider, 'region': item['location'], 'project': location} for item in data or []]
+
+
+def aws_regions(cache: dict, refresh=False) -> list:
+    # The regions enabled for the account, listed once per TTL like the clusters
+    if os.environ.get(const.INVENTORY_AWS_REGIONS_ENV):
+        return [region.strip() for region in os.environ[const.INVENTORY_AWS_REGIONS_ENV].split(',') if region.strip()]
+    entry = cache.get(scope_key(const.AWS_PROVIDER, 'regions'))
+    if not refresh and entry and time.time() - entry['fetched'] < cache_ttl():
+        return entry['regions']
+    result = runner.run(['aws', 'ec2', 'describe-regions', '--query', 'Regions[].RegionName', '--output', 'json'],
+                        timeout=const.CLI_TIMEOUT)
+    if not result.ok:
+        return []
+    regions = sorted(json.loads(result.stdout))
+    write_cache({scope_key(const.AWS_PROVIDER, 'regions'): {'fetched': time.time(), 'regions': regions}})
+    return regions
+
+
+def scopes(providers: list, managed: list, cache: dict, region=None, refresh=False) -> list:
+    """
+    Every listing needed to cover the providers.
+
+    :param providers: the providers to query, the ones whose CLI is not installed are left out
+    :param managed: the clusters of the registry, their regions and projects are always listed
+    :param cache: the inventory cache
+    :param region: only this AWS region
+    :param refresh: list the AWS regions again
+    :return: (provider, location) pairs
+    """
+    found = []
+    for provider in providers:
+        if not toolchain.probe(PROVIDER_TOOLS[provider]).installed:
+            continue
+        known = [cluster for cluster in managed if cluster.get('provider') == provider]
+        if provider == const.AWS_PROVIDER:
+            if region:
+                locations = [region]
+            else:
+                default = config_value(const.AWS_CONFIG_FILE, 'default', 'region')
+                locations = set(aws_regions(cache, refresh)) | {cluster.get('region') for cluster in known} | {default}
+        elif provider == const.AZURE_PROVIDER:
+            locations = [ALL_REGIONS]
+        else:
+            default = config_value(const.GCP_CONFIG_FILE, 'core', 'project')
+            locations = {cluster.get('project') for cluster in known} | {default}
+        found += [(provider, location) for location in sorted(location for location in locations if location)]
+    return found
+
+
+def fetch(wanted: list, cache: dict, refresh=False) -> tuple:
+    """
+    Lists the clusters of every scope, querying the clouds at the same time for the scopes that are not cached.
+
+    :param wanted: (provider, location) pairs, see scopes
+    :param cache: the inventory cache
+    :param refresh: query every scope even if it is cached
+    :return: the listings per scope key and the errors per scope key of the queries that failed
+    """
+    now = time.time()
+    listings = {}
+    stale = []
+    for provider, location in wanted:
+        entry = cache.get(scope_key(provider, location))
+        if not refresh and entry and now - entry['fetched'] < cache_ttl():
+            listings[scope_key(provider, location)] = entry['clusters']
+        else:
+            stale.append((provider, location))
+    errors = {}
+    fetched = {}
+    results = runner.run_many([query(provider, location) for provider, location in stale],
+                              max_workers=const.INVENTORY_WORKERS, timeout=const.CLI_TIMEOUT)
+    for (provider, location), result in zip(stale, results):
+        key = scope_key(provider, location)
+        try:
+            if not result.ok:
+                raise ValueError(next((line for line in result.stderr.splitlines() if line.strip()), result.reason))
+            listings[key] = parse(provider, location, result.stdout)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            errors[key] = str(e)
+            continue
+        fetched[key] = {'fetched': now, 'clusters': listings[key]}
+    # Failed queries are not cached, the next call tries again
+    if fetched:
+        write_cache(fetched)
+    return listings, errors
+
+
+def cluster_scope(cluster: dict) -> str:
+    provider = cluster.get('provider')
+    if provider == const.AZURE_PROVIDER:
+        return scope_key(provider, ALL_REGIONS)
+    if provider == const.GCP_PROVIDER:
+        return scope_key(provider, cluster.get('project'))
+    return scope_key(provider, cluster.get('region'))
+
+
+def merge(managed: list, listings: dict, states: dict) -> list:
+    """
+    Puts the registry and the live listings together.
+
+    :param managed: the clusters of the registry
+    :param listings: the live clusters per scope key
+    :param states: the registry state of the managed clusters, the ones created by the cli have a workspace
+    :return: the clusters with their status, sorted by provider and name
+    """
+    live = {(cluster['provider'], cluster['name']): cluster for clusters in listings.values() for cluster in clusters}
+    merged = []
+    for cluster in managed:
+        key = (cluster.get('provider'), cluster.get('name'))
+        if key in live:
+            status = MANAGED if states.get(cluster.get('name'), {}).get('workspace') else IMPORTED
+            merged.append({**live.pop(key), **cluster, 'status': status})
+        elif cluster_scope(cluster) in listings:
+            merged.append({**cluster, 'status': ORPHANED})
+        else:
+            merged.append({**cluster, 'status': UNKNOWN})
+    merged += [{**cluster, 'status': UNMANAGED} for cluster in live.values()]
+    return sorted(merged, key=lambda cluster: (cluster.get('provider') or '', cluster.get('name') or ''))
+
+
+def live_clusters(providers: list, managed: list, states: dict, region=None, refresh=False) -> tuple:
+    """
+    The clusters of the registry and of the clouds, each one marked managed, imported, orphaned, unmanaged or unknown.
+
+    :param providers: the providers to query
+    :param managed: the clusters of the registry
+    :param states: the registry state of the managed clusters
+    :param region: only the clusters of this region
+    :param refresh: query the clouds even if the cached listings are still valid
+    :return: the clusters and the errors of the queries that failed
+    """
+    cache = read_cache()
+    listings, errors = fetch(scopes(providers, managed, cache, region, refresh), cache, refresh)
+    clusters = merge(managed, listings, states)
+    if region:
+        clusters = [cluster for cluster in clusters if cluster.get('region') == region]
+    return clusters, errors
+
+
+def in_region(location: str, region: str) -> bool:
+    # A regional cluster lives in the region itself, a zonal one in <region>-a, <region>-b...
+    return region is None or location == region or location.rsplit('-', 1)[0] == region
+
+
+def probe_zones(name: str, project: str, region: str):
+    # Fallback when the project cannot be listed: describe the cluster in the region and in each of its zones at once
+    result = runner.run(['gcloud', 'compute', 'zones', 'list', '--project', project, '--filter', f'region:{region}',
+                         '--format', 'json(name)'], timeout=const.CLI_TIMEOUT)
+    try:
+        zones = [zone['name'] for zone in json.loads(result.stdout)] if result.ok else []
+    except (ValueError, KeyError, TypeError):
+        zones = []
+    locations = [region, *sorted(zones)]
+    results = runner.run_many([['gcloud', 'container', 'clusters', 'describe', name, '--location', location, '--project', project,
+                                '--format', 'value(location)'] for location in locations],
+                              max_workers=const.INVENTORY_WORKERS, timeout=const.CLI_TIMEOUT)
+    return next((location for location, result in zip(locations, results) if result.ok), None)
+
+
+def gke_location(name: str, project: str, region=None):
+    """
+    Finds where a GKE cluster lives: its region for a regional cluster, one of the zones for a zonal one.
+
+    The clusters of the project are listed with a single call, the same listing (and cache) as show cluster --live.
+    Only when the project cannot be listed the region and its zones are described, all at the same time.
+
+    :param name: the cluster
+    :param project: the GCP project of the cluster
+    :param region: the region of the cluster, a cluster of the same name elsewhere in the project is ignored
+    :return: the region or zone, None if the cluster was not found
+    """
+    key = scope_key(const.GCP_PROVIDER, project)
+    # A cached listing can predate the cluster, it is listed again before giving up
+    for refresh in (False, True):
+        listings, errors = fetch([(const.GCP_PROVIDER, project)], read_cache(), refresh)
+        location = next((cluster['region'] for cluster in listings.get(key, [])
+                         if cluster['name'] == name and in_region(cluster['region'], region)), None)
+        if location or key in errors:
+            break
+    if location is None and key in errors and region:
+        location = probe_zones(name, project, region)
+    return location
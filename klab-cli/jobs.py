@@ -0,0 +1,147 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+import registry
+import utils as utils
+import waiter
+import constants as const
+
+# The cli the jobs run, in a process of their own
+LAB_SCRIPT = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'lab2.py')
+
+# Status of a job, the last four are final
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+# The supervisor process went away without recording the exit code (e.g. the machine rebooted)
+LOST = 'lost'
+
+
+def job_log_file(job_id: int) -> str:
+    return os.path.join(utils.logs_dir, const.JOBS_LOGS_DIR, f"{job_id}.log")
+
+
+def submit(kind: str, cluster: str, argv: list) -> dict:
+    """
+    Starts a lab command in the background and records it as a job.
+
+    The command runs under a supervisor process (lab jobs supervise <id>, detached from the terminal in its own
+    session) that writes the output to the job log and records the exit code once the command is done.
+
+    :param kind: what the job does, e.g. create or destroy
+    :param cluster: the cluster the job works on
+    :param argv: the arguments of the lab command, e.g. ['create', 'cluster', '--name', 'eks', ...]
+    :return: the job
+    """
+    store = registry.get_registry()
+    job_id = store.add_job(kind, cluster, argv, RUNNING)
+    log_file = job_log_file(job_id)
+    os.makedirs(os.path.dirname(log_file), exist_ok=True)
+    store.update_job(job_id, log_file=log_file)
+    process = subprocess.Popen(
+        [sys.executable, LAB_SCRIPT, 'jobs', 'supervise', str(job_id)],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        # Own session: closing the terminal does not stop the job, and cancel stops the whole process group
+        start_new_session=os.name == 'posix',
+        creationflags=getattr(subprocess, 'CREATE_NEW_PROCESS_GROUP', 0)
+    )
+    store.update_job(job_id, pid=process.pid)
+    return store.get_job(job_id)
+
+
+def supervise(job_id: int) -> int:
+    # Runs the command of a job to completion and reaps its exit code, this is the process submit starts
+    store = registry.get_registry()
+    job = store.get_job(job_id)
+    store.update_job(job_id, pid=os.getpid())
+    with open(job['log_file'], 'ab') as log_file:
+        result = subprocess.run([sys.executable, LAB_SCRIPT, *job['argv']], stdin=subprocess.DEVNULL, stdout=log_file,
+                                stderr=subprocess.STDOUT, env={**os.environ, const.JOB_ID_ENV: str(job_id)})
+    status = SUCCEEDED if result.returncode == 0 else FAILED
+    store.update_job(job_id, only_if=RUNNING, status=status, exit_code=result.returncode, finished=time.time())
+    return result.returncode
+
+
+def alive(pid) -> bool:
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    # An exited process that its parent did not reap yet is a zombie, it is not running anymore (Linux only)
+    try:
+        with open(f'/proc/{pid}/stat') as stat:
+            return stat.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except (OSError, IndexError):
+        return True
+
+
+def refresh(job: dict) -> dict:
+    # A running job whose supervisor is gone will never record its exit code
+    if job['status'] == RUNNING and job['pid'] is not None and not alive(job['pid']):
+        store = registry.get_registry()
+        store.update_job(job['id'], only_if=RUNNING, status=LOST, finished=time.time())
+        job = store.get_job(job['id'])
+    return job
+
+
+def get(job_id: int):
+    job = registry.get_registry().get_job(job_id)
+    return refresh(job) if job is not None else None
+
+
+def list_jobs(status=None) -> list:
+    return [job for job in map(refresh, registry.get_registry().jobs()) if status is None or job['status'] == status]
+
+
+def cancel(job_id: int) -> bool:
+    """
+    Stops a running job: its supervisor and the lab command get SIGTERM. The lab command then kills the commands it
+    started (e.g. terraform, each one in a process group of its own) and exits.
+
+    :param job_id: the job
+    :return: True if the job was running and has been cancelled, False otherwise
+    """
+    job = get(job_id)
+    # Marked first, so the supervisor cannot record the command as failed in the meantime
+    if job is None:
+        return False
+    if not registry.get_registry().update_job(job_id, only_if=RUNNING, status=CANCELLED, exit_code=-signal.SIGTERM, finished=time.time()):
+        return False
+    try:
+        if os.name == 'posix':
+            os.killpg(job['pid'], signal.SIGTERM)
+        else:
+            os.kill(job['pid'], signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+    return True
+
+
+def wait(job_ids: list, timeout=None) -> list:
+    """
+    Waits until the jobs are done, polling their status with backoff.
+
+    :param job_ids: the jobs to wait for
+    :param timeout: seconds after which the wait gives up, None means no limit
+    :return: the jobs as they are when the wait ended
+    """
+    waiter.wait_all(
+        job_ids,
+        lambda pending: [job_id for job_id in pending if get(job_id)['status'] != RUNNING],
+        "job",
+        timeout=timeout,
+        initial_delay=const.JOB_POLL_INTERVAL,
+        max_delay=const.JOB_MAX_POLL_INTERVAL
+    )
+    return [get(job_id) for job_id in job_ids]
@@ -0,0 +1,153 @@
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import constants as const
+
+# Fields added to every record written by the current job, e.g. the provider and cluster of one destroy job
+context = contextvars.ContextVar('log_context', default={})
+
+logger = logging.getLogger('klab')
+logger.propagate = False
+logger.setLevel(logging.INFO)
+records = queue.Queue()
+listener = None
+listener_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    # One JSON object per line, the timestamp first so the lines can be filtered by their prefix
+    FIELDS = ('provider', 'cluster', 'command')
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+        }
+        for field in self.FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        entry['message'] = record.getMessage()
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class BufferedRotatingFileHandler(RotatingFileHandler):
+    # Rotating file whose writes stay in the file buffer until the whole batch is written
+    def flush(self):
+        # Called by emit after every record, the listener calls flush_batch once per batch instead
+        pass
+
+    def flush_batch(self):
+        with self.lock:
+            if self.stream:
+                self.stream.flush()
+
+
+class LogFilesHandler(logging.Handler):
+    # Sends every record to the file it belongs to (record.log_file), one rotating handler per file
+    def __init__(self):
+        super().__init__()
+        self.files = {}
+
+    def emit(self, record: logging.LogRecord):
+        path = record.log_file
+        handler = self.files.get(path)
+        if handler is None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            handler = BufferedRotatingFileHandler(path, maxBytes=const.LOG_MAX_BYTES, backupCount=const.LOG_BACKUP_COUNT, encoding='utf-8')
+            handler.setFormatter(JsonFormatter())
+            self.files[path] = handler
+        handler.handle(record)
+
+    def flush_batch(self):
+        for handler in list(self.files.values()):
+            handler.flush_batch()
+
+    def close(self):
+        for handler in self.files.values():
+            handler.close()
+        super().close()
+
+
+class BatchingQueueListener(QueueListener):
+    # Flushes the files only when the queue is drained: a burst of messages costs one write instead of one per message
+    def dequeue(self, block: bool):
+        if block and self.queue.empty():
+            for handler in self.handlers:
+                handler.flush_batch()
+        return self.queue.get(block)
+
+
+def start():
+    # The listener thread and the files are set up by the first record, importing the cli never touches the disk
+    global listener
+    with listener_lock:
+        if listener is None:
+            files = LogFilesHandler()
+            listener = BatchingQueueListener(records, files, respect_handler_level=False)
+            listener.start()
+            logger.addHandler(QueueHandler(records))
+            atexit.register(stop)
+
+
+def stop():
+    global listener
+    with listener_lock:
+        if listener is not None:
+            listener.stop()
+            for handler in listener.handlers:
+                handler.flush_batch()
+                handler.close()
+            logger.handlers.clear()
+            listener = None
+
+
+def flush():
+    # Blocks until every queued record is written to its file
+    if listener is not None:
+        records.join()
+        for handler in listener.handlers:
+            handler.flush_batch()
+
+
+def set_level(level: str):
+    logger.setLevel(getattr(logging, level.upper()))
+
+
+def enabled(level=logging.INFO) -> bool:
+    return logger.isEnabledFor(level)
+
+
+def write(log_file: str, message: str, level=logging.INFO, **fields):
+    """
+    Queues a record for a log file, the caller never waits for the disk.
+
+    :param log_file: the file of the record, e.g. utils.provider_log_file(provider)
+    :param message: the text of the record
+    :param level: logging level, records below the --log-level are dropped
+    :param fields: provider, cluster and command of the record, on top of the ones bound by the current job
+    """
+    if not logger.isEnabledFor(level):
+        return
+    start()
+    extra = dict(context.get())
+    extra.update((key, value) for key, value in fields.items() if value is not None)
+    extra['log_file'] = log_file
+    logger.log(level, message, extra=extra)
+
+
+@contextmanager
+def bind(**fields):
+    # Every record written inside the block (and by the commands it starts) gets these fields, e.g. bind(cluster='eks')
+    token = context.set({**context.get(), **{key: value for key, value in fields.items() if value is not None}})
+    try:
+        yield
+    finally:
+        context.reset(token)
@@ -0,0 +1,307 @@
+import os
+import subprocess
+import threading
+import time
+import yamlio
+import waiter
+import kubeconfig
+import constants as const
+
+# The kubernetes package takes longer to import than the rest of the cli, it is loaded by the first get_client
+kube_client = None
+kube_loaded = False
+
+# One API client per kubeconfig file and context, reused as long as the kubeconfig does not change
+clients = {}
+clients_lock = threading.Lock()
+
+
+class KubeClient:
+    # Dynamic client sharing one HTTP connection pool, its discovery (the REST mapping of kinds) is cached on disk by the client
+    def __init__(self, config_file: str, context=None):
+        configuration = kube_client.Configuration()
+        kube_config.load_kube_config(config_file=config_file, context=context, client_configuration=configuration, persist_config=False)
+        configuration.connection_pool_maxsize = const.KUBE_CONNECTION_POOL_SIZE
+        self.dynamic = DynamicClient(kube_client.ApiClient(configuration))
+        contexts, active_context = kube_config.list_kube_config_contexts(config_file=config_file)
+        if context is not None:
+            active_context = next((entry for entry in contexts if entry['name'] == context), active_context)
+        self.namespace = active_context.get('context', {}).get('namespace', 'default')
+
+    def resource(self, manifest: dict):
+        return self.dynamic.resources.get(api_version=manifest['apiVersion'], kind=manifest['kind'])
+
+    def namespace_of(self, resource, manifest: dict, namespace=None):
+        if not resource.namespaced:
+            return None
+        return manifest.get('metadata', {}).get('namespace') or namespace or self.namespace
+
+
+def load_kubernetes() -> bool:
+    global kube_loaded, kube_client, kube_config, DynamicClient, DynamicApiError, NotFoundError, ResourceNotFoundError, ApiException, HTTPError
+    with clients_lock:
+        if not kube_loaded:
+            try:
+                from kubernetes import client as kube_client, config as kube_config
+                from kubernetes.dynamic import DynamicClient
+                from kubernetes.dynamic.exceptions import DynamicApiError, NotFoundError, ResourceNotFoundError
+                from kubernetes.client.exceptions import ApiException
+                from urllib3.exceptions import HTTPError
+            except ImportError:
+                # Without the kubernetes package every manifest goes through kubectl
+                kube_client = None
+            kube_loaded = True
+    return kube_client is not None
+
+
+def kubeconfig_file() -> str:
+    return kubeconfig.default_path()
+
+
+def get_client(context=None):
+    # None when kubectl has to be used, i.e. no kubernetes package, KLAB_KUBECTL=1 or no usable kubeconfig
+    if os.environ.get(const.KUBECTL_ENV) == '1' or not load_kubernetes():
+        return None
+    config_file = kubeconfig_file()
+    try:
+        stat = os.stat(config_file)
+    except FileNotFoundError:
+        return None
+    key = (config_file, context)
+    with clients_lock:
+        cached = clients.get(key)
+        if cached is not None and cached[0] == (stat.st_mtime_ns, stat.st_size):
+            return cached[1]
+        try:
+            client = KubeClient(config_file, context)
+        except (kube_config.ConfigException, DynamicApiError, HTTPError) as e:
+            # Building the client already reads the server version, kubectl reports the error in its usual way
+            print(f"Could not connect with the Kubernetes API client, falling back to kubectl: {e}")
+            return None
+        clients[key] = ((stat.st_mtime_ns, stat.st_size), client)
+        return client
+
+
+def load_manifests(path: str) -> list:
+    # The objects of a manifest file, "kind: List" documents are flattened
+    with open(path, 'r') as manifest_file:
+        documents = yamlio.loads_all(manifest_file.read())
+    manifests = []
+    for document in documents:
+        if document.get('kind', '').endswith('List') and 'items' in document:
+            manifests.extend(document['items'] or [])
+        else:
+            manifests.append(document)
+    return manifests
+
+
+def describe(resource, manifest: dict) -> str:
+    # Same naming as the kubectl output, e.g. deployment.apps/nginx
+    group = f".{resource.group}" if resource.group else ''
+    return f"{resource.kind.lower()}{group}/{manifest['metadata']['name']}"
+
+
+def kubectl(action: str, path: str, namespace=None) -> bool:
+    command = ['kubectl', action, '-f', path]
+    if namespace is not None:
+        command += ['--namespace', namespace]
+    return subprocess.run(command).returncode == 0
+
+
+def apply_manifest(path: str, namespace=None, context=None) -> bool:
+    """
+    Applies every object of a manifest file with server-side apply, in-process and over a single connection pool.
+
+    :param path: the manifest file, it can contain several YAML documents
+    :param namespace: namespace of the namespaced objects that do not set one, defaults to the one of the context
+    :param context: kubeconfig context to be used, defaults to the current one
+    :return: True when every object was applied
+    """
+    client = get_client(context)
+    if client is None:
+        return kubectl('apply', path, namespace)
+    for manifest in load_manifests(path):
+        try:
+            resource = client.resource(manifest)
+            client.dynamic.server_side_apply(
+                resource,
+                body=manifest,
+                namespace=client.namespace_of(resource, manifest, namespace),
+                field_manager=const.KUBE_FIELD_MANAGER,
+                force_conflicts=True
+            )
+        except ResourceNotFoundError:
+            print(f"Unknown kind {manifest.get('kind')} in {manifest.get('apiVersion')}")
+            return False
+        except DynamicApiError as e:
+            print(f"Failed to apply {manifest.get('kind')} {manifest.get('metadata', {}).get('name')}: {e.summary()}")
+            return False
+        print(f"{describe(resource, manifest)} serverside-applied")
+    return True
+
+
+def delete_manifest(path: str, namespace=None, context=None) -> bool:
+    # Deletes the objects of a manifest file in reverse order, objects that are already gone are not an error
+    client = get_client(context)
+    if client is None:
+        return kubectl('delete', path, namespace)
+    ok = True
+    for manifest in reversed(load_manifests(path)):
+        try:
+            resource = client.resource(manifest)
+            client.dynamic.delete(
+                resource,
+                name=manifest['metadata']['name'],
+                namespace=client.namespace_of(resource, manifest, namespace),
+                propagation_policy='Background'
+            )
+            print(f"{describe(resource, manifest)} deleted")
+        except NotFoundError:
+            print(f"{describe(resource, manifest)} not found")
+        except ResourceNotFoundError:
+            print(f"Unknown kind {manifest.get('kind')} in {manifest.get('apiVersion')}")
+            ok = False
+        except DynamicApiError as e:
+            print(f"Failed to delete {manifest.get('kind')} {manifest.get('metadata', {}).get('name')}: {e.summary()}")
+            ok = False
+    return ok
+
+
+def deployment_ready(manifest: dict) -> bool:
+    # Same rule as kubectl rollout status: the new generation is observed and every replica is updated and available
+    spec_replicas = manifest.get('spec', {}).get('replicas', 1)
+    status = manifest.get('status') or {}
+    if status.get('observedGeneration', 0) < manifest['metadata'].get('generation', 0):
+        return False
+    return all(status.get(field, 0) == spec_replicas for field in ('updatedReplicas', 'replicas', 'availableReplicas'))
+
+
+def service_ready(manifest: dict) -> bool:
+    # Only LoadBalancer services have to wait, for the cloud load balancer to get an address
+    if manifest.get('spec', {}).get('type') != 'LoadBalancer':
+        return True
+    return bool(((manifest.get('status') or {}).get('loadBalancer') or {}).get('ingress'))
+
+
+READY_CHECKS = {
+    'Deployment': deployment_ready,
+    'Service': service_ready,
+}
+
+
+def list_objects(client, resource, namespace, field_selector) -> tuple:
+    # The watched objects by name and the resourceVersion of the list, the watch starts from it
+    listing = client.dynamic.get(resource, namespace=namespace, field_selector=field_selector).to_dict()
+    return {item['metadata']['name']: item for item in listing['items']}, listing['metadata']['resourceVersion']
+
+
+def stream_changes(client, resource, namespace, field_selector, objects: dict, resource_version: str, timeout: int, is_ready) -> tuple:
+    """
+    Applies the events of one watch stream to objects, until they are all ready or the server closes the stream.
+
+    :return: the number of events received and the last resourceVersion seen, None when it expired (410 Gone)
+    """
+    events = 0
+    try:
+        # The server closes the stream at the deadline, nothing is polled in between
+        for event in client.dynamic.watch(resource, namespace=namespace, field_selector=field_selector,
+                                          resource_version=resource_version, timeout=timeout):
+            events += 1
+            item = event['raw_object']
+            resource_version = item['metadata']['resourceVersion']
+            if event['type'] == 'DELETED':
+                objects.pop(item['metadata']['name'], None)
+            elif event['type'] in ('ADDED', 'MODIFIED'):
+                objects[item['metadata']['name']] = item
+            if objects and all(is_ready(entry) for entry in objects.values()):
+                break
+    except (ApiException, DynamicApiError) as e:
+        if e.status != 410:
+            raise
+        return events, None
+    return events, resource_version
+
+
+def watch_ready(client, resource, namespace, description: str, deadline: float, name=None) -> waiter.WaitResult:
+    """
+    Waits until the watched objects are ready, with a watch stream instead of polling.
+
+    The objects are listed once, then watched from the resourceVersion of the list. When the stream is closed
+    the watch resumes from the last resourceVersion seen, when that version expired (410 Gone) it lists again.
+
+    :param name: the object to be watched, every object of the kind in the namespace when None
+    :param deadline: time.monotonic() value at which the wait gives up
+    :return: the WaitResult, its polls are the number of watch events received
+    """
+    start = time.monotonic()
+    is_ready = READY_CHECKS[resource.kind]
+    field_selector = f"metadata.name={name}" if name is not None else None
+    objects = {}
+    resource_version = None
+    events = 0
+    while True:
+        if resource_version is None:
+            objects, resource_version = list_objects(client, resource, namespace, field_selector)
+        if objects and all(is_ready(item) for item in objects.values()):
+            return waiter.WaitResult(description, True, objects, events, time.monotonic() - start, 'done')
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return waiter.WaitResult(description, False, objects, events, time.monotonic() - start, 'timeout')
+        streamed, resource_version = stream_changes(client, resource, namespace, field_selector, objects, resource_version,
+                                                    max(1, int(remaining)), is_ready)
+        events += streamed
+        if not streamed and resource_version is not None:
+            # A stream closed early without any event (e.g. by a proxy), do not reconnect in a tight loop
+            time.sleep(min(1, max(0, deadline - time.monotonic())))
+
+
+def kubectl_rollout_status(manifest: dict, namespace, timeout: int) -> bool:
+    command = ['kubectl', 'rollout', 'status', f"deployment/{manifest['metadata']['name']}", f'--timeout={timeout}s']
+    namespace = manifest['metadata'].get('namespace') or namespace
+    if namespace is not None:
+        command += ['--namespace', namespace]
+    return subprocess.run(command).returncode == 0
+
+
+def wait_manifest(path: str, timeout: int, namespace=None, context=None) -> bool:
+    """
+    Waits for the objects of a manifest file to be ready, i.e. Deployments rolled out and LoadBalancer Services with an address.
+
+    :param path: the manifest file that was applied
+    :param timeout: seconds to wait for all the objects together
+    :return: True as soon as every object is ready, False on timeout
+    """
+    deadline = time.monotonic() + timeout
+    manifests = [manifest for manifest in load_manifests(path) if manifest.get('kind') in READY_CHECKS]
+    client = get_client(context)
+    for manifest in manifests:
+        if client is None:
+            # kubectl can only follow the rollouts, there is no portable way to wait for a load balancer address
+            if manifest['kind'] == 'Deployment' and not kubectl_rollout_status(manifest, namespace, max(1, int(deadline - time.monotonic()))):
+                return False
+            continue
+        resource = client.resource(manifest)
+        description = describe(resource, manifest)
+        result = watch_ready(client, resource, client.namespace_of(resource, manifest, namespace), description, deadline,
+                             name=manifest['metadata']['name'])
+        if not result:
+            print(f"{description} not ready after {result.elapsed:.0f}s")
+            return False
+        print(f"{description} ready after {result.elapsed:.1f}s")
+    return True
+
+
+def wait_rollout(namespace: str, timeout: int, context=None) -> bool:
+    # Waits for every Deployment of a namespace, e.g. the one of an operator installed with make deploy
+    client = get_client(context)
+    if client is None:
+        command = ['kubectl', 'wait', 'deployment', '--all', '--for=condition=Available', f'--timeout={timeout}s', '--namespace', namespace]
+        return subprocess.run(command).returncode == 0
+    resource = client.dynamic.resources.get(api_version='apps/v1', kind='Deployment')
+    description = f"deployments in {namespace}"
+    result = watch_ready(client, resource, namespace, description, time.monotonic() + timeout)
+    if not result:
+        print(f"{description} not ready after {result.elapsed:.0f}s")
+        return False
+    print(f"{description} ready after {result.elapsed:.1f}s")
+    return True
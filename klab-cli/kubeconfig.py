@@ -0,0 +1,89 @@
+import os
+import yamlio
+import fileio
+import constants as const
+
+# Sections of a kubeconfig file, each one a list of {'name': ..., <section singular>: {...}}
+SECTIONS = (('clusters', 'cluster'), ('users', 'user'), ('contexts', 'context'))
+
+
+def default_path() -> str:
+    # Like kubectl: the first file of KUBECONFIG, ~/.kube/config otherwise
+    return os.path.expanduser(os.environ.get('KUBECONFIG', const.KUBECONFIG_FILE).split(os.pathsep)[0])
+
+
+def load(path=None) -> dict:
+    config = yamlio.load(path or default_path(), default=None)
+    return config if isinstance(config, dict) else {'apiVersion': 'v1', 'kind': 'Config'}
+
+
+def named(config: dict, section: str, name: str):
+    return next((item for item in config.get(section) or [] if item.get('name') == name), None)
+
+
+def extract(config: dict, context_name=None):
+    """
+    The entries a context needs to work on its own: the context, its cluster and its user.
+
+    :param config: a loaded kubeconfig
+    :param context_name: the context, the current one by default
+    :return: {'context': ..., 'cluster': ..., 'user': ...}, None when the context is not in the file
+    """
+    context = named(config, 'contexts', context_name or config.get('current-context'))
+    if context is None:
+        return None
+    details = context.get('context') or {}
+    return {
+        'context': context,
+        'cluster': named(config, 'clusters', details.get('cluster')),
+        'user': named(config, 'users', details.get('user')),
+    }
+
+
+def without_credentials(entry):
+    # The part of an entry that can be cached outside of the kubeconfig: the user stanza holds tokens and client keys
+    return {key: value for key, value in entry.items() if key != 'user'} if entry else entry
+
+
+def merge(config: dict, entry: dict) -> dict:
+    # Adds the context, cluster and user of an extracted entry that are missing
+    # The ones already in the file are kept: they are newer than the cached entry (a rotated CA, an update-kubeconfig)
+    for section, key in SECTIONS:
+        item = entry.get(key)
+        if item is None:
+            continue
+        items = config.get(section) or []
+        if named(config, section, item['name']) is None:
+            items.append(item)
+        config[section] = items
+    return config
+
+
+def use_context(entry: dict, path=None) -> bool:
+    """
+    Makes a context the current one, in process and without any cloud call.
+
+    The missing entries are added first, so a kubeconfig that lost the cluster (e.g. a fresh machine) gets it back,
+    the ones still in the file are left as they are.
+    An entry without its user (see without_credentials) only works while the kubeconfig still has that user.
+    The file is rewritten atomically under a lock, concurrent kubectl calls see the old or the new file.
+
+    :param entry: the context, cluster and (optionally) user as returned by extract
+    :param path: the kubeconfig file, the one kubectl uses by default
+    :return: True if the context is now the current one, False if its user is missing and nothing was written
+    """
+    path = path or default_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Not <path>.lock: kubectl and client-go create that one exclusively and fail while it exists
+    with fileio.locked(f"{path}.klab"):
+        config = merge(load(path), entry)
+        user = (entry['context'].get('context') or {}).get('user')
+        if user and named(config, 'users', user) is None:
+            return False
+        config['current-context'] = entry['context']['name']
+        if not os.path.exists(path):
+            # Credentials inside, only readable by the user like the files written by the cloud CLIs
+            with open(path, 'w'):
+                os.chmod(path, 0o600)
+        fileio.atomic_write(path, yamlio.dumps(config, default_flow_style=False, sort_keys=False))
+    return True
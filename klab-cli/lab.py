@@ -4,13 +4,25 @@ import click
 import os
 import subprocess
 import json
-from deploy import Deploy
 import shutil
 import fnmatch
-import yaml
+import yamlio
+import waiter
+import terraform
+import toolchain
+import kubeconfig
+import inventory
+from commands import LazyGroup
 from datetime import datetime
 
-@click.group()
+# The product commands are imported only when they are run, the cluster commands do not load the catalog and deploy
+LAZY_COMMANDS = {
+    'add': 'lab_products:add',
+    'update': 'lab_products:update',
+    'remove': 'lab_products:remove',
+}
+
+@click.group(cls=LazyGroup, lazy_commands=LAZY_COMMANDS)
 def cli():
     pass
 
@@ -21,13 +33,18 @@ def log_message(log_file, message):
         log_file.write(log_entry)
 
 @cli.command()
-def init():
+@click.option('--mirror', type=click.Path(exists=True, file_okay=False), help='Install the terraform providers only from this filesystem mirror (works offline)', metavar='<dir>')
+def init(mirror):
     """
     Initializes the credentials needed for the supported cloud providers and Terraform.
     It saves the credentials in the 'credentials' directory and the logs in the 'logs' directory.
-    Usage: lab init
+    The provider plugins are downloaded once in a cache shared by all the providers.
+    Usage: lab init [--mirror <dir>]
     """
     script_dir = os.path.dirname(os.path.realpath(__file__))
+    providers_dir = os.path.join(script_dir, '..', 'providers')
+    if mirror:
+        click.echo(f"Terraform providers will be installed from {mirror} ({terraform.write_mirror_config(mirror)})\n")
     credentials_dir = os.path.join(script_dir, 'credentials')
     os.makedirs(credentials_dir, exist_ok=True)
 
@@ -37,16 +54,14 @@ def init():
 
     # AWS
     aws_credentials_file = os.path.expanduser('~/.aws/credentials')
-    try:
-        process = subprocess.Popen(['aws', '--version'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-        stdout_output, stderr_output = process.communicate()
-        exit_code = process.wait()
-    except FileNotFoundError:
+    # aws --version only runs when the binary changed since its cached probe
+    aws_tool = toolchain.probe('aws')
+    if aws_tool.path is None:
         click.echo('AWS CLI is not installed or configured. Please install and configure it before proceeding.\n')
         aws_logs_file = os.path.join(logs_dir, 'aws_terraform_init.log')
         log_message(aws_logs_file, "AWS CLI is not installed or configured.")
     else:
-        if exit_code == 0:
+        if aws_tool.installed:
             if os.path.isfile(aws_credentials_file):
                 aws_kube_credentials_file = os.path.join(credentials_dir, 'aws_kube_credential')
                 shutil.copy(aws_credentials_file, aws_kube_credentials_file)
@@ -54,11 +69,9 @@ def init():
                 aws_logs_file = os.path.join(logs_dir, 'aws_terraform_init.log')
                 log_message(aws_logs_file, "AWS credentials saved.")
                 print("Initializing Terraform for AWS...\n")
-                os.chdir('../providers/AWS')
-                process = subprocess.Popen(['terraform', 'init'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-                stderr_output = process.communicate()
-                exit_code = process.wait()
-                if exit_code == 0:
+                result = terraform.init(os.path.join(providers_dir, 'AWS'), aws_logs_file, mirror=mirror)
+                stderr_output = result.stderr
+                if result.ok:
                     log_message(aws_logs_file, "Terraform for AWS is successfully initialized.")
                     print("Terraform for AWS is successfully initialized.\n")
                 else:
@@ -91,11 +104,9 @@ def init():
             azure_logs_file = os.path.join(logs_dir, 'azure_terraform_init.log')
             log_message(azure_logs_file, "Azure credentials saved.")
             print("Initializing Terraform for Azure...")
-            os.chdir('../providers/Azure')
-            process = subprocess.Popen(['terraform', 'init'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-            stdout_output, stderr_output = process.communicate()
-            exit_code = process.wait()
-            if exit_code == 0:
+            result = terraform.init(os.path.join(providers_dir, 'Azure'), azure_logs_file, mirror=mirror)
+            stderr_output = result.stderr
+            if result.ok:
                 log_message(azure_logs_file, "Terraform for Azure is successfully initialized.")
                 print("Terraform for Azure is successfully initialized.\n")
             else:
@@ -116,11 +127,9 @@ def init():
         gcp_logs_file = os.path.join(logs_dir, 'gcp_terraform_init.log')
         log_message(gcp_logs_file, "Gcloud credentials saved.")
         print("Initializing Terraform for Google Cloud...")
-        os.chdir('../providers/GCP')
-        process = subprocess.Popen(['terraform', 'init'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-        stderr_output = process.communicate()
-        exit_code = process.wait()
-        if exit_code == 0:
+        result = terraform.init(os.path.join(providers_dir, 'GCP'), gcp_logs_file, mirror=mirror)
+        stderr_output = result.stderr
+        if result.ok:
             log_message(gcp_logs_file, "Terraform for Google Cloud is successfully initialized.")
             print("Terraform for Google Cloud is successfully initialized.\n")
         else:
@@ -133,20 +142,25 @@ def init():
         log_message(gcp_logs_file, "gcloud CLI is not installed or configured.")
 
 
-def wait_for_exe(command, log_file_path, wait_for_completion=True):
-    with open(log_file_path, 'w') as log_file:
-        process = subprocess.Popen(
-            command,
-            shell=True,
-            text=True,
-            stdout=log_file,
-            stderr=subprocess.STDOUT
-        )
+def apply_cluster(cluster_name, variables, log_file_path, replan=False):
+    # Plans and applies the provider module in the current directory, nothing runs if nothing changed since the last apply
+    click.echo("Running terraform plan to check the input parameters and Terraform configuration.")
+    outcome = terraform.plan_and_apply('.', cluster_name, variables, log_file=log_file_path, force=replan)
+    if outcome == terraform.UNCHANGED:
+        click.echo(f"Terraform configuration and inputs of {cluster_name} did not change since the last apply, nothing to do.")
+    elif outcome == terraform.NO_CHANGES:
+        click.echo(f"Terraform plan of {cluster_name} has no changes, nothing to apply.")
+    elif outcome == terraform.APPLIED:
+        click.echo(f"Cluster {cluster_name} has been created, for logs check {os.path.abspath(log_file_path)} file")
+    else:
+        click.echo(f"Terraform failed for {cluster_name}, please check {os.path.abspath(log_file_path)} file")
+        return False
+    return True
 
-        if wait_for_completion:
-            process.wait()
-        else:
-            click.echo("Running the command in the background.")
+
+def forget_cluster_plan(module_dir, cluster_name):
+    # The cluster is gone, creating it again with the same name has to plan and apply instead of finding nothing to do
+    terraform.PlanCache(module_dir, cluster_name).clear()
 
 
 def create_log_directory_and_file(log_file_path):
@@ -167,7 +181,8 @@ def create_log_directory_and_file(log_file_path):
 @click.option('--region', '-r', type=str, help='Cluster region (required for AWS and GCP)', metavar='<region>')
 @click.option('--resource-group', '-rg', type=str, help='Resource group name (required for Azure)', metavar='<resource_group>')
 @click.option('--project', '-p', type=str, help='GCP project ID (required for GCP)', metavar='<project_id>')
-def create(type, cluster_name, provider, region, resource_group, project):
+@click.option('--replan', is_flag=True, default=False, help='Plan again even if the configuration and inputs did not change since the last apply')
+def create(type, cluster_name, provider, region, resource_group, project, replan):
     """
     Creates a k8s cluster in the specified cloud provider.
 
@@ -177,6 +192,7 @@ def create(type, cluster_name, provider, region, resource_group, project):
     :param region: the region where the resource will be created
     :param resource_group: the resource group where the resource will be created (optional)
     :param project: the GCP project ID where the resource will be created (optional)
+    :param replan: flag to run terraform plan even if nothing changed since the last apply
     """
     if type != 'cluster':
         click.echo("Invalid type specified. Only 'cluster' is supported.")
@@ -199,21 +215,8 @@ def create(type, cluster_name, provider, region, resource_group, project):
 
             create_log_directory_and_file(log_file_path)
 
-            click.echo("Running terraform plan to check the input parameters and Terraform configuration.")
-            wait_for_exe(
-                f'terraform plan -var="cluster_name={cluster_name}" -var="region={region}"',
-                log_file_path
-            )
-
-            click.echo("Terraform plan was completed successfully!")
-
-            wait_for_exe(
-                f'terraform apply -auto-approve -var="cluster_name={cluster_name}" -var="region={region}"',
-                log_file_path,
-                wait_for_completion=False
-            )
-
-            click.echo("Cluster will be created in 15 minutes and for logs check log/kubelab.log file")
+            if not apply_cluster(cluster_name, {'cluster_name': cluster_name, 'region': region}, log_file_path, replan):
+                return
 
         elif provider == "Azure":
             if not cluster_name:
@@ -234,21 +237,9 @@ def create(type, cluster_name, provider, region, resource_group, project):
 
             create_log_directory_and_file(log_file_path)
 
-            click.echo("Running terraform plan to check the input parameters and Terraform configuration.")
-            wait_for_exe(
-                f'terraform plan -var="cluster_name={cluster_name}" -var="resource_group={resource_group}" -var="location={region}"',
-                log_file_path
-            )
-
-            click.echo("Terraform plan was completed successfully!")
-
-            wait_for_exe(
-                f'terraform apply -auto-approve -var="cluster_name={cluster_name}" -var="resource_group={resource_group}" -var="location={region}"',
-                log_file_path,
-                wait_for_completion=False
-            )
-
-            click.echo("Cluster will be created in 15 minutes and for logs check log/kubelab.log file")
+            variables = {'cluster_name': cluster_name, 'resource_group': resource_group, 'location': region}
+            if not apply_cluster(cluster_name, variables, log_file_path, replan):
+                return
 
         elif provider == "GCP":
             if not cluster_name:
@@ -270,24 +261,9 @@ def create(type, cluster_name, provider, region, resource_group, project):
 
             create_log_directory_and_file(log_file_path)
 
-            click.echo("Running terraform plan to check the input parameters and Terraform configuration.")
-            wait_for_exe(
-                f'terraform plan -var="cluster_name={cluster_name}" -var="region={region}" -var="project={project}"',
-                log_file_path
-            )
-
-            if not os.path.exists('log'):
-                os.makedirs('log')
-
-            click.echo("Terraform plan was completed successfully!")
-
-            wait_for_exe(
-                f'terraform apply -auto-approve -var="cluster_name={cluster_name}" -var="region={region}" -var="project={project}"',
-                log_file_path,
-                wait_for_completion=False
-            )
-
-            click.echo("Cluster will be created in 15 minutes and for logs check log/kubelab.log file")
+            variables = {'cluster_name': cluster_name, 'region': region, 'project': project}
+            if not apply_cluster(cluster_name, variables, log_file_path, replan):
+                return
 
         else:
             click.echo("Invalid cloud provider specified!")
@@ -337,9 +313,7 @@ def create(type, cluster_name, provider, region, resource_group, project):
         yaml_file_path = os.path.join(credentials_dir, 'clusters.yaml')
         existing_clusters = []
         if os.path.exists(yaml_file_path):
-            with open(yaml_file_path, 'r') as yaml_file:
-                existing_clusters = yaml.safe_load(yaml_file)
-                existing_clusters = existing_clusters if existing_clusters is not None else []
+            existing_clusters = yamlio.load(yaml_file_path, default=[])
 
         existing_clusters_set = {(cluster['cluster_name'], cluster['cluster_provider'], cluster.get('cluster_region', '')) for cluster in existing_clusters}
 
@@ -347,10 +321,9 @@ def create(type, cluster_name, provider, region, resource_group, project):
             print(f"The cluster with name '{cluster_name}', provider '{provider}', and region '{region}' already exists in clusters.yaml. Skipping append.")
         else:
             existing_clusters.append(cluster_info)
-            with open(yaml_file_path, 'w') as yaml_file:
-                yaml.dump(existing_clusters, yaml_file)
+            yamlio.dump(existing_clusters, yaml_file_path)
 
-            print(f"Cluster '{cluster_name}' with provider '{provider}' and region '{region}' is being deployed..")
+            print(f"Cluster '{cluster_name}' with provider '{provider}' and region '{region}' is deployed.")
 
     except (subprocess.CalledProcessError, KeyError) as e:
         print(f"Error: Failed to retrieve cluster name. {e}")
@@ -376,8 +349,7 @@ def list(type, provider, name):
             click.echo("No clusters.yaml file found.")
             return
 
-        with open(yaml_file_path, 'r') as yaml_file:
-            clusters = yaml.safe_load(yaml_file)
+        clusters = yamlio.load(yaml_file_path)
 
         if not clusters:
             click.echo("No clusters found.")
@@ -410,6 +382,29 @@ def list(type, provider, name):
         print("You have selected a wrong type, run 'lab list --help' for more information.")
 
 
+def aws_remaining_node_groups(cluster_name, region, pending):
+    check_command = f"aws eks list-nodegroups --cluster-name {cluster_name} --region {region}"
+    result = subprocess.run(check_command, shell=True, capture_output=True, text=True)
+    if result.returncode != 0:
+        print("An error occurred while executing the command.")
+        # Nothing can be considered deleted when the listing failed
+        return pending
+    # Parse the JSON output
+    output = json.loads(result.stdout)
+    return output.get("nodegroups", [])
+
+
+def aws_cluster_deleted(cluster_name, region):
+    check_cluster_command = f"aws eks describe-cluster --name {cluster_name} --region {region}"
+    try:
+        subprocess.check_output(check_cluster_command, stderr=subprocess.STDOUT, shell=True)
+    except subprocess.CalledProcessError as e:
+        if "ResourceNotFoundException" in e.output.decode():
+            return True
+        raise
+    return False
+
+
 @cli.command()
 @click.argument('type', type=click.Choice(['cluster']))
 @click.option('--name', type=click.STRING, help='What is the cluster named as?')
@@ -433,8 +428,7 @@ def destroy(type, name, region, yes):
             print("Please provide the cluster region.")
         else:
             # Load cluster credentials from YAML file
-            with open('cluster_credentials/clusters.yaml', 'r') as file:
-                data = yaml.safe_load(file)
+            data = yamlio.load('cluster_credentials/clusters.yaml', default=[])
 
             # Find the matching cluster based on name and region
             matching_clusters = [cluster for cluster in data if cluster.get('cluster_name') == name and cluster.get('cluster_region') == region]
@@ -476,42 +470,46 @@ def destroy(type, name, region, yes):
                         if check_output:
                             node_groups = json.loads(check_output)['nodegroups']
                             if node_groups:
+                                # Fire all the deletions at once, then track them together
+                                deletions = []
                                 for node_group in node_groups:
-                                    check_command = f"aws eks list-nodegroups --cluster-name {aws_cluster_name} --region {aws_cluster_region}"
                                     delete_node_group_command = f"aws eks delete-nodegroup --cluster-name {aws_cluster_name} --nodegroup-name {node_group} --region {aws_cluster_region}"
                                     print(f"Node group {node_group} is being destroyed..")
-                                    subprocess.Popen(delete_node_group_command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, shell=True).communicate()
-
-                                    while True:
-                                        # Run the AWS CLI command to list node groups
-                                        check_command = f"aws eks list-nodegroups --cluster-name {aws_cluster_name} --region {aws_cluster_region}"
-                                        result = subprocess.run(check_command, shell=True, capture_output=True, text=True)
-                                        if result.returncode == 0:
-                                            # Parse the JSON output
-                                            output = json.loads(result.stdout)
-                                            if "nodegroups" in output and len(output["nodegroups"]) == 0:
-                                                print(f"The Node Groups of the {aws_cluster_name} cluster have been destroyed.")
-                                                break
-                                        else:
-                                            print("An error occurred while executing the command.")
+                                    deletions.append(subprocess.Popen(delete_node_group_command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, shell=True))
+                                for deletion in deletions:
+                                    deletion.communicate()
+
+                                # One list-nodegroups call per poll covers every group, with a backoff between polls
+                                node_group_waits = waiter.wait_all(
+                                    node_groups,
+                                    lambda pending: pending - set(aws_remaining_node_groups(aws_cluster_name, aws_cluster_region, pending)),
+                                    "node group"
+                                )
+                                for node_group, node_group_wait in node_group_waits.items():
+                                    if not node_group_wait:
+                                        print(f"Node group {node_group} is still being destroyed after {node_group_wait.elapsed:.0f}s, aborting.")
+                                        return
+                                    print(f"Node group {node_group} destroyed in {node_group_wait.elapsed:.0f}s.")
+                                print(f"The Node Groups of the {aws_cluster_name} cluster have been destroyed.")
                         delete_command = f"aws eks delete-cluster --name {aws_cluster_name} --region {aws_cluster_region}"
                         print(f"The EKS cluster {aws_cluster_name} in region {aws_cluster_region} is being destroyed..")
                         subprocess.check_call(delete_command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, shell=True)
 
-                        while True:
-                            check_cluster_command = f"aws eks describe-cluster --name {aws_cluster_name} --region {aws_cluster_region}"
-                            try:
-                                check_output = subprocess.check_output(check_cluster_command, stderr=subprocess.STDOUT, shell=True)
-                            except subprocess.CalledProcessError as e:
-                                if "ResourceNotFoundException" in e.output.decode():
-                                    print(f"The EKS cluster named {aws_cluster_name} in region {aws_cluster_region} has been destroyed.")
-                                    break
-                                else:
-                                    print("Error occurred during describe-cluster command. Please check the command and try again.")
-                                    return
+                        try:
+                            cluster_wait = waiter.wait_until(
+                                lambda: aws_cluster_deleted(aws_cluster_name, aws_cluster_region),
+                                f"EKS cluster {aws_cluster_name} to be deleted"
+                            )
+                        except subprocess.CalledProcessError:
+                            print("Error occurred during describe-cluster command. Please check the command and try again.")
+                            return
+                        if not cluster_wait:
+                            print(f"The EKS cluster {aws_cluster_name} is still being destroyed after {cluster_wait.elapsed:.0f}s, aborting.")
+                            return
+                        print(f"The EKS cluster named {aws_cluster_name} in region {aws_cluster_region} has been destroyed ({cluster_wait.polls} checks in {cluster_wait.elapsed:.0f}s).")
                         data.remove(cluster)
-                        with open('cluster_credentials/clusters.yaml', 'w') as file:
-                            yaml.dump(data, file)
+                        yamlio.dump(data, 'cluster_credentials/clusters.yaml')
+                        forget_cluster_plan('../providers/AWS', aws_cluster_name)
                         if yes:
                             destroy_all = 'yes'
                         else:
@@ -522,6 +520,7 @@ def destroy(type, name, region, yes):
                             process = subprocess.Popen(destroy_all_command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, shell=True, universal_newlines=True)
                             print("The rest of the resources are being destroyed... ")
                             exit_code = process.wait()
+                            forget_cluster_plan('.', aws_cluster_name)
                             if exit_code == 0:
                                 print("The rest of the resources are destroyed.")
                             else:
@@ -557,8 +556,8 @@ def destroy(type, name, region, yes):
                                     subprocess.check_output(delete_command, stderr=subprocess.STDOUT, shell=True)
                                     print(f"The AKS cluster named {azure_cluster_name} in resource group {azure_resource_group} has been deleted successfully.")
                                     data.remove(cluster)
-                                    with open('cluster_credentials/clusters.yaml', 'w') as file:
-                                        yaml.dump(data, file)
+                                    yamlio.dump(data, 'cluster_credentials/clusters.yaml')
+                                    forget_cluster_plan('../providers/Azure', azure_cluster_name)
                                     if yes:
                                         destroy_all = 'yes'
                                     else:
@@ -568,6 +567,7 @@ def destroy(type, name, region, yes):
                                         process = subprocess.Popen(f'terraform destroy -auto-approve -var="cluster_name={azure_cluster_name}" -var="location={azure_cluster_region}" -var="resource_group={azure_resource_group}" ', shell=True, stdout=subprocess.PIPE, universal_newlines=True)
                                         print("The rest of the resources are being destroyed... ")
                                         exit_code = process.wait()
+                                        forget_cluster_plan('.', azure_cluster_name)
                                         if exit_code == 0:
                                             print("The rest of the resources are destroyed ")
                                         else:
@@ -604,38 +604,21 @@ def destroy(type, name, region, yes):
                         else:
                             confirmation = input("Are you sure that you want to destroy this cluster? (yes/no): ").lower()
                         if confirmation == 'yes':
-                            # Retrieve the available zones for the specified region using the Google Cloud API
-                            zone_command = f"gcloud compute zones list --filter='{gcp_cluster_region}' --format='value(name)'"
+                            # The location (the region, or a zone of it) is found with one list call and kept in clusters.yaml
+                            location = cluster.get('cluster_location') or inventory.gke_location(gcp_cluster_name, gcp_cluster_project, gcp_cluster_region)
                             try:
-                                zones_output = subprocess.check_output(zone_command, shell=True).decode().strip()
-                                zones = zones_output.splitlines()
-
-                                if not zones:
-                                    print(f"No zones found for region {gcp_cluster_region}.")
-                                    return
-
-                                cluster_deleted = False
-
-                                for zone in zones:
-                                    describe_command = f"gcloud container clusters describe {gcp_cluster_name} --zone {zone} --format='value(zone)'"
-                                    try:
-                                        subprocess.check_output(describe_command, stderr=subprocess.STDOUT, shell=True)
-                                    except subprocess.CalledProcessError as e:
-                                        continue  # Cluster not found in this zone, move on to the next zone
-
-                                    # Cluster found in this zone, delete it
+                                if location:
+                                    cluster['cluster_location'] = location
+                                    yamlio.dump(data, 'cluster_credentials/clusters.yaml')
                                     print('Deleting the cluster that has been found.')
-                                    delete_command = f"gcloud container clusters delete {gcp_cluster_name} --zone {zone} --quiet"
-                                    subprocess.check_output(delete_command, stderr=subprocess.STDOUT, shell=True)
-                                    cluster_deleted = True
-
-                                if cluster_deleted:
-                                    print(f"The GKE cluster named {gcp_cluster_name} in region {gcp_cluster_region} has been deleted successfully.")
+                                    subprocess.check_output(['gcloud', 'container', 'clusters', 'delete', gcp_cluster_name, '--location', location,
+                                                             '--project', gcp_cluster_project, '--quiet'], stderr=subprocess.STDOUT)
+                                    print(f"The GKE cluster named {gcp_cluster_name} in {location} has been deleted successfully.")
                                 else:
                                     print(f"No GKE cluster named {gcp_cluster_name} found in any zone of region {gcp_cluster_region}.")
                                 data.remove(cluster)
-                                with open('cluster_credentials/clusters.yaml', 'w') as file:
-                                    yaml.dump(data, file)
+                                yamlio.dump(data, 'cluster_credentials/clusters.yaml')
+                                forget_cluster_plan('../providers/GCP', gcp_cluster_name)
                                 if yes:
                                     destroy_all = 'yes'
                                 else:
@@ -645,6 +628,7 @@ def destroy(type, name, region, yes):
                                     process = subprocess.Popen(f'terraform destroy -auto-approve -var="project={gcp_cluster_project}"', shell=True, stdout=subprocess.PIPE, universal_newlines=True)
                                     print("The rest of the resources are being destroyed...")
                                     exit_code = process.wait()
+                                    forget_cluster_plan('.', gcp_cluster_name)
                                     if exit_code == 0:
                                         print("The rest of the resources are destroyed ")
                                     else:
@@ -653,7 +637,7 @@ def destroy(type, name, region, yes):
                                     print("You choose not to destroy other resources")
                                     exit()
                             except subprocess.CalledProcessError as e:
-                                print("An error occurred while retrieving the available zones. Please check the command and try again.")
+                                print("An error occurred while deleting the GKE cluster. Please check the command and try again.")
 
                         elif confirmation == 'no':
                             print("The destruction of the cluster has been canceled.")
@@ -664,253 +648,6 @@ def destroy(type, name, region, yes):
                         print(f"The GKE cluster named {gcp_cluster_name} in region {gcp_cluster_region} does not exist.")
 
 
-@cli.command()
-@click.option('--type', type=click.Choice(['operator', 'deployment']), required=False, default="deployment", help='Type of how to deploy operator')
-@click.argument('product', type=click.Choice(['nginx', 'istio', 'karpenter']))
-@click.option('--version', type=click.STRING, help="product version", required=False)
-@click.option('--yes', '-y', is_flag=True, help='Automatically answer "yes" to all prompts and proceed.')
-def add(type, product, version, yes):
-    """
-    Adds a product in the current cluster.
-
-    :param type: the installation type of the product to be added
-    :param product: the cloud native product to be added
-    :param version: the desired version of the product to be added
-    :param yes: flag to automatically answer "yes" to all prompts and proceed
-    """
-    product_cat = dict()
-    installation_type = dict()
-    deploymentFile = dict()
-    operatorRepo = dict()
-    operatorDir = dict()
-    operatorImage = dict()
-    imageVersion = dict()  # FIXME this shouldn't be here, use default version instead
-    operatorVersion = dict()
-    with open("catalog/catalog.yaml", 'r') as f:
-        lines = f.readlines()
-        for line in lines:
-            line = line.strip()
-            if line.startswith('- product'):
-                product_cat['product'] = line.split(':')[1].strip()
-            elif line.startswith('installation_type'):
-                installation_type['installation_type'] = line.split(':')[1].strip()
-            elif line.startswith('deploymentFile'):
-                deploymentFile['deploymentFile'] = line.split(':')[1].strip()
-            elif line.startswith('operatorDir'):
-                operatorDir['operatorDir'] = line.split(':')[1].strip()
-            elif line.startswith('operatorRepo'):
-                operatorRepo['operatorRepo'] = line.split(': ')[1].strip()
-            elif line.startswith('operatorImage'):
-                operatorImage['operatorImage'] = line.split(': ')[1].strip()
-            elif line.startswith('imageVersion'):
-                imageVersion['imageVersion'] = line.split(': ')[1].strip()
-            elif line.startswith('operatorVersion'):
-                operatorVersion['operatorVersion'] = line.split(': ')[1].strip()
-    if installation_type['installation_type'] == "deployment":
-        type = 'operator'
-        deploy = Deploy(op_version=operatorVersion['operatorVersion'], productName=product)
-        if yes:
-            deploy.switch_operator(productName=product, autoApprove='yes')
-        else:
-            deploy.switch_operator(productName=product, autoApprove='no')
-    if installation_type['installation_type'] == "operator":
-        type = 'deployment'
-        deploy = Deploy(op_version=operatorVersion['operatorVersion'], productName=product, operatorDir=operatorDir['operatorDir'])
-        if yes:
-            deploy.switch_deployment(productName=product, autoApprove='yes')
-        else:
-            deploy.switch_deployment(productName=product, autoApprove='no')
-    if type == 'operator' and product == 'nginx':
-        deploy = Deploy(op_version=operatorVersion['operatorVersion'], deployment_type=deploymentFile['deploymentFile'], imageVersion=imageVersion['imageVersion'], operatorImage=operatorImage['operatorImage'], operatorRepo=operatorRepo['operatorRepo'], operatorDir=operatorDir['operatorDir'], productName=product, installation_type=type)
-        deploy.operator(productName=product, operatorRepo=operatorRepo['operatorRepo'])
-    if type == 'deployment' and product == 'nginx':
-        deploy = Deploy(deployment_type=deploymentFile['deploymentFile'], imageVersion=imageVersion['imageVersion'], operatorDir=operatorDir['operatorDir'], operatorImage=operatorImage['operatorImage'], productName=product, installation_type=type, op_version=operatorVersion['operatorVersion'])
-        deploy.deployment(productName=product, operatorRepo=operatorRepo['operatorRepo'])
-
-
-@cli.command()
-@click.option('--type', type=click.Choice(['operator', 'deployment']), help='Type of how to deploy operator')
-@click.argument('product', type=click.Choice(['nginx', 'istio', 'karpenter']))
-@click.option('--version', type=click.STRING, default='1.4.1', help="Operator version", required=False)
-def update(type, product, version):
-    """
-    Updates a product in the current cluster.
-
-    :param type: the installation type of the product to be updated
-    :param product: the cloud native product to be updated
-    :param version: the new desired version of the product to be updated
-    """
-    if type == 'operator':
-        print(f'Upadating {product} with latest version ({version})')
-        repo_dir = f'catalog/{product}/operator'
-        if not os.path.exists(repo_dir):
-            # FIXME get operator repo from catalog and use Deploy object
-            subprocess.run(['git', 'clone', 'https://github.com/nginxinc/nginx-ingress-helm-operator/',
-                            '--branch', f'v{version}'])
-        os.chdir(repo_dir)
-        subprocess.run(['git', 'checkout', f'v{version}'])
-        # Update the Operator
-        img = f'nginx/nginx-ingress-operator:{version}'
-        subprocess.run(['make', 'deploy', f'IMG={img}'])
-        subprocess.run(['kubectl', 'get', 'deployments', '-n', 'nginx-ingress-operator-system'])
-
-        print(f'Nginx operator updated successfully with {version} version')
-    elif type == 'deployment':
-        # FIXME delete all of this and just use the catalog + new image version on Deploy
-        product_cat = dict()
-        installation_type = dict()
-        deploymentFile = dict()
-        operatorRepo = dict()
-        operatorDir = dict()
-        operatorImage = dict()
-        imageVersion = dict()
-        installed_version = dict()
-        with open("catalog/catalog.yaml", 'r') as f:
-            lines = f.readlines()
-            for line in lines:
-                line = line.strip()
-                if line.startswith('- product'):
-                    product_cat['product'] = line.split(':')[1].strip()
-                elif line.startswith('installation_type'):
-                    installation_type['installation_type'] = line.split(':')[1].strip()
-                elif line.startswith('deploymentFile'):
-                    deploymentFile['deploymentFile'] = line.split(':')[1].strip()
-                elif line.startswith('operatorDir'):
-                    operatorDir['operatorDir'] = line.split(':')[1].strip()
-                elif line.startswith('operatorRepo'):
-                    operatorRepo['operatorRepo'] = line.split(': ')[1].strip()
-                elif line.startswith('operatorImage'):
-                    operatorImage['operatorImage'] = line.split(': ')[1].strip()
-                elif line.startswith('imageVersion'):
-                    imageVersion['imageVersion'] = line.split(': ')[1].strip()
-                elif line.startswith('installed_version'):
-                    installed_version['installed_version'] = line.split(': ')[1].strip()
-        if installation_type is None and installed_version is None:
-            print("Deployment is not installed")
-        print(f"Updating the deployment to version: {version}")
-        deploy = Deploy(deployment_type=deploymentFile['deploymentFile'], imageVersion=version, operatorDir=operatorDir['operatorDir'], operatorImage=operatorImage['operatorImage'], productName=product, installation_type=type, op_version=version)
-        deploy.deployment(productName=product, operatorRepo=operatorRepo['operatorRepo'])
-
-        print(f"Deployment is updated to {imageVersion['imageVersion']}")
-
-    else:
-        print('Invalid configuration.')
-
-
-@cli.command()
-@click.option('--type', install_type=click.Choice(['operator', 'deployment']), help='Installation type of the product')
-@click.argument('product', type=click.Choice(['nginx', 'istio', 'karpenter']))
-def remove(install_type, product):
-    """
-    Deletes a product in the current cluster.
-
-    :param install_type: the installation type of the product to be deleted
-    :param product: the product to be deleted
-    """
-    installation_type = dict()
-    operatorRepo = dict()
-    operatorVersion = dict()
-    operatorImage = dict()
-    operatorDir = dict()
-    deploymentFile = dict()
-    imageVersion = dict()
-    with open("catalog/catalog.yaml", 'r') as f:
-        lines = f.readlines()
-        for line in lines:
-            line = line.strip()
-            if line.startswith('installation_type'):
-                installation_type['installation_type'] = line.split(':')[1].strip()
-            elif line.startswith('operatorRepo'):
-                operatorRepo['operatorRepo'] = line.split(': ')[1].strip()
-            elif line.startswith('operatorVersion'):
-                operatorVersion['operatorVersion'] = line.split(': ')[1].strip()
-            elif line.startswith('operatorImage'):
-                operatorImage['operatorImage'] = line.split(': ')[1].strip()
-            elif line.startswith('operatorDir'):
-                operatorDir['operatorDir'] = line.split(':')[1].strip()
-            elif line.startswith('deploymentFile'):
-                deploymentFile['deploymentFile'] = line.split(':')[1].strip()
-            elif line.startswith('imageVersion'):
-                imageVersion['imageVersion'] = line.split(': ')[1].strip()
-    if install_type == 'operator':
-        print(f'Deleting {product} with {imageVersion["imageVersion"]} version')
-        os.chdir(operatorDir['operatorDir'])
-        # Delete the deployed operator
-        subprocess.run(['make', 'undeploy'])
-        data = [
-            {
-                'product': f'{product}',
-                'default_version': 'latest',
-                'default_type': 'deployment',
-                'available_types': ['deployment', 'operator'],
-                'installed_version': '',
-                'installation_type': '',
-                'operatorRepo': operatorRepo['operatorRepo'],
-                'operatorVersion': '1.5.0',
-                'operatorImage': operatorImage['operatorImage'],
-                'operatorDir': operatorDir['operatorDir'],
-                'deploymentFile': deploymentFile['deploymentFile'],
-                'imageVersion': imageVersion['imageVersion']
-            },
-        ]
-        with open('catalog/catalog.yaml', 'w') as file:
-            for item in data:
-                file.write("- product: {}\n".format(item['product']))
-                file.write("  default_version: {}\n".format(item['default_version']))
-                file.write("  default_type: {}\n".format(item['default_type']))
-                file.write("  available_types:\n")
-                for available_type in item['available_types']:
-                    file.write("    - {}\n".format(available_type))
-                file.write("  installed_version: {}\n".format(item['installed_version']))
-                file.write("  installation_type: {}\n".format(item['installation_type']))
-                file.write("  operatorRepo: {}\n".format(item['operatorRepo']))
-                file.write("  operatorVersion: {}\n".format(item['operatorVersion']))
-                file.write("  operatorImage: {}\n".format(item['operatorImage']))
-                file.write("  operatorDir: {}\n".format(item['operatorDir']))
-                file.write("  deploymentFile: {}\n".format(item['deploymentFile']))
-                file.write("  imageVersion: {}\n\n".format(item['imageVersion']))
-        print(f'{product} operator deleted successfully with {imageVersion["imageVersion"]} version')
-    elif install_type == 'deployment':
-        deploy_file = deploymentFile['deploymentFile']
-        deploy_version = imageVersion['imageVersion']
-        print(f"Deleting {product} deployment with {deploy_version} image version")
-        subprocess.run(['kubectl', 'delete', '-f', f'{deploy_file}'])
-        data = [
-            {
-                'product': f'{product}',
-                'default_version': f'{imageVersion}',
-                'default_type': 'deployment',
-                'available_types': ['deployment', 'operator'],
-                'installed_version': '',
-                'installation_type': '',
-                'operatorRepo': operatorRepo['operatorRepo'],
-                'operatorVersion': operatorVersion['operatorVersion'],
-                'operatorImage': operatorImage['operatorImage'],
-                'operatorDir': operatorDir['operatorDir'],
-                'deploymentFile': deploymentFile['deploymentFile'],
-                'imageVersion': imageVersion['imageVersion']
-            },
-        ]
-        with open('catalog/catalog.yaml', 'w') as file:
-            for item in data:
-                file.write("- product: {}\n".format(item['product']))
-                file.write("  default_version: {}\n".format(item['default_version']))
-                file.write("  default_type: {}\n".format(item['default_type']))
-                file.write("  available_types:\n")
-                for available_type in item['available_types']:
-                    file.write("    - {}\n".format(available_type))
-                file.write("  installed_version: {}\n".format(item['installed_version']))
-                file.write("  installation_type: {}\n".format(item['installation_type']))
-                file.write("  operatorRepo: {}\n".format(item['operatorRepo']))
-                file.write("  operatorVersion: {}\n".format(item['operatorVersion']))
-                file.write("  operatorImage: {}\n".format(item['operatorImage']))
-                file.write("  operatorDir: {}\n".format(item['operatorDir']))
-                file.write("  deploymentFile: {}\n".format(item['deploymentFile']))
-                file.write("  imageVersion: {}\n\n".format(item['imageVersion']))
-    else:
-        print('Invalid configuration.')
-
-
 @cli.command()
 @click.argument('type', type=click.Choice(['cluster']))
 @click.argument('cluster', type=click.STRING)
@@ -918,7 +655,8 @@ def remove(install_type, product):
 @click.option('--region', '-r', type=click.STRING, default=None, help='Region of the cluster (AWS and GCP)')
 @click.option('--resource-group', '-rg', type=click.STRING, default=None, help='Resource group of the cluster (Azure)')
 @click.option('--project', '-p', type=click.STRING, default=None, help='GCP project of the cluster (GCP)')
-def use(type, cluster, provider, region, resource_group, project):
+@click.option('--refresh', is_flag=True, default=False, help='Fetch the cluster credentials again from the cloud provider')
+def use(type, cluster, provider, region, resource_group, project, refresh):
     """
     Select a cluster to switch to.
 
@@ -928,6 +666,7 @@ def use(type, cluster, provider, region, resource_group, project):
     :param region: the region of the cluster (AWS and GCP)
     :param resource_group: the resource group of the cluster (Azure)
     :param project: the GCP project of the cluster (GCP)
+    :param refresh: flag to fetch the credentials from the cloud provider even if they are cached
     """
     # FIXME it has just to read the clusters.yaml once they connect the first time it is referred by a unique name
     if type != 'cluster':
@@ -964,17 +703,11 @@ def use(type, cluster, provider, region, resource_group, project):
 
     cluster_file = os.path.join(cluster_dir, 'clusters.yaml')
 
-    if os.path.exists(cluster_file):
-        with open(cluster_file, 'r') as file:
-            try:
-                data = yaml.safe_load(file)
-                if not data:
-                    data = []
-            except yaml.YAMLError as e:
-                print("Error loading clusters.yaml:", str(e))
-                return
-    else:
-        data = []
+    try:
+        data = yamlio.load(cluster_file) or []
+    except yamlio.YAMLError as e:
+        print("Error loading clusters.yaml:", str(e))
+        return
 
     cluster_info = next((c for c in data if c.get('cluster_name') == cluster), None)
 
@@ -1015,6 +748,14 @@ def use(type, cluster, provider, region, resource_group, project):
         # Cluster managed by us
         cluster_info['managed_by'] = 'KUBELAB'
 
+    # The kubeconfig entry fetched the first time is kept in clusters.yaml, switching again only edits the current context
+    # Without its credentials in the kubeconfig (e.g. a fresh machine) the entry is fetched again
+    if cluster_info.get('kubeconfig') and not refresh and kubeconfig.use_context(cluster_info['kubeconfig']):
+        print(f"Switched to the {cluster_info['kubeconfig']['context']['name']} context.")
+        cluster_info['kubeconfig'] = kubeconfig.without_credentials(cluster_info['kubeconfig'])
+        yamlio.dump(data, cluster_file)
+        return
+
     # Update the Kubernetes configuration based on the cluster's cloud provider
     if provider == 'AWS':
         update_kubeconfig_cmd = ["aws", "eks", "update-kubeconfig", "--region", region, "--name", cluster]
@@ -1028,13 +769,15 @@ def use(type, cluster, provider, region, resource_group, project):
     if update_kubeconfig_process.returncode != 0:
         print(f"Failed to connect to the {provider.upper()} cluster. The clusters.yaml file will not be modified.")
         return
+    # The cloud CLIs leave the context of the cluster as the current one
+    # Tokens and client keys stay in the kubeconfig, clusters.yaml only keeps the context and cluster
+    cluster_info['kubeconfig'] = kubeconfig.without_credentials(kubeconfig.extract(kubeconfig.load()))
 
-    with open(cluster_file, 'w') as file:
-        try:
-            yaml.safe_dump(data, file)
-        except yaml.YAMLError as e:
-            print("Error saving clusters.yaml:", str(e))
-            return
+    try:
+        yamlio.dump(data, cluster_file)
+    except yamlio.YAMLError as e:
+        print("Error saving clusters.yaml:", str(e))
+        return
 
 
 @cli.command()
@@ -1,21 +1,33 @@
 #!/usr/bin/env python3
 
 import click
+import fnmatch
 import os
 import subprocess
 import json
-from deploy import Deploy
+import logging
 import shutil
-import fnmatch
-import yaml
-import configparser
+import signal
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
 import utils as utils
+import waiter
+import registry
+import runner
+import terraform
+import toolchain
+import kubeconfig
+import jsonlog
+import inventory
+from commands import LazyGroup
 import constants as const
 
-# Get the script dir + create credentials and logs dirs + init files
+# Get the script dir, the credentials and logs dirs are created when they are first written
 script_dir = os.path.dirname(os.path.realpath(__file__))
 
-credentials_dir = os.makedirs(os.path.join(script_dir, const.CREDENTIALS_DIR), exist_ok=True)
+credentials_dir = os.path.join(script_dir, const.CREDENTIALS_DIR)
 aws_credentials_file = os.path.join(const.CREDENTIALS_DIR, f"{const.AWS_PROVIDER}_kube_credential")
 azure_credentials_file = os.path.join(const.CREDENTIALS_DIR, f"{const.AZURE_PROVIDER}_kube_credential")
 gcp_credentials_file = os.path.join(const.CREDENTIALS_DIR, f"{const.GCP_PROVIDER}_kube_credential")
@@ -24,111 +36,236 @@ aws_config_file = os.path.expanduser(const.AWS_CONFIG_FILE)
 azure_config_file = os.path.expanduser(const.AZURE_CONFIG_FILE)
 gcp_config_file = os.path.expanduser(const.GCP_CONFIG_FILE)
 
-logs_dir = os.makedirs(os.path.join(script_dir, const.LOGS_DIR), exist_ok=True)
-aws_logs_file = os.path.join(logs_dir, const.AWS_LOG_FILE)
-azure_logs_file = os.path.join(logs_dir, const.AZURE_LOG_FILE)
-gcp_logs_file = os.path.join(logs_dir, const.GCP_LOG_FILE)
-generic_logs_file = os.path.join(logs_dir, const.GENERIC_LOG_FILE)
+# Set to abort every pending wait, e.g. when a bulk destroy is interrupted
+cancel_event = threading.Event()
+
+# Commands living in their own module, imported only when they are run: lab create does not load the catalog or the jobs
+LAZY_COMMANDS = {
+    'logs': 'lab2_logs:logs',
+    'jobs': 'lab2_jobs:jobs',
+    'apply': 'lab2_products:apply',
+    'add': 'lab2_products:add',
+}
 
-@click.group()
+@click.group(cls=LazyGroup, lazy_commands=LAZY_COMMANDS)
 @click.version_option()
-def cli():
-    pass
+@click.option('--log-level', type=click.Choice(const.LOG_LEVELS, case_sensitive=False), default='INFO', show_default=True,
+              help='Messages below this level are neither shown nor written to the logs')
+def cli(log_level: str):
+    jsonlog.set_level(log_level)
+    if os.environ.get(const.JOB_ID_ENV):
+        # lab jobs cancel sends SIGTERM: the running commands are killed through cancel_event and the command unwinds
+        signal.signal(signal.SIGTERM, lambda signum, frame: cancel_event.set())
+
+
+@cli.result_callback()
+def exit_code(result, **kwargs):
+    # Commands return False when they failed, scripts and background jobs wait on these ones and read their exit code
+    ctx = click.get_current_context()
+    if result is False and ctx.invoked_subcommand in const.EXIT_CODE_COMMANDS:
+        ctx.exit(1)
+
+
+def command_argv(ctx: click.Context, **overrides) -> list:
+    # The arguments that run the current command again with the same parameters, e.g. in a background job
+    argv = [f"--log-level={ctx.parent.params['log_level']}", ctx.info_name]
+    params = {**ctx.params, **overrides}
+    for param in ctx.command.params:
+        value = params.get(param.name)
+        if isinstance(param, click.Argument):
+            argv.append(str(value))
+        elif param.is_flag:
+            if value:
+                argv.append(param.opts[0])
+        elif value is not None:
+            argv += [param.opts[0], str(value)]
+    return argv
+
+
+def start_job(kind: str, cluster_name: str, provider=None, **overrides) -> bool:
+    # Runs the current command as a background job, overrides are the parameters that change (e.g. no prompts)
+    import jobs as background_jobs
+    job = background_jobs.submit(kind, cluster_name, command_argv(click.get_current_context(), background=False, **overrides))
+    utils.log(f"Job {job['id']} started in the background ({kind} {cluster_name}, pid {job['pid']}), its output goes to {job['log_file']}. "
+              f"Wait for it with: lab jobs wait {job['id']}", provider)
+    return True
+
+def provider_dir(provider: str) -> str:
+    return os.path.join(script_dir, '..', 'providers', provider)
+
+
+def run_steps(steps: list, provider: str, cwd: str) -> bool:
+    # Runs the commands one after the other in the provider log, stopping at the first one that fails
+    for argv in steps:
+        result = runner.run(argv, utils.provider_log_file(provider), cwd=cwd, timeout=const.TERRAFORM_TIMEOUT, cancel_event=cancel_event)
+        if not result.ok:
+            utils.log(f"{result.command} failed ({result.reason}, exit code {result.returncode}) after {result.elapsed:.0f}s.", provider)
+            return False
+    return True
 
-def terraform_init(provider: str, credentials_file: str) -> bool:
+
+def record(steps, name: str, result):
+    # Keeps the duration of an init step (a command or a toolchain probe) for the summary table
+    if steps is not None:
+        steps.append((f"{name} (cached)" if getattr(result, 'cached', False) else name, result.elapsed, result.ok))
+    return result
+
+
+def terraform_init(provider: str, credentials_file: str, mirror=None, steps=None) -> bool:
     global credentials_dir
     # Check if the credentials file exists
     if os.path.isfile(credentials_file):
         kube_credentials_file = os.path.join(credentials_dir, f'{provider}_kube_credential')
         # Copy credentials to kube_credentials_file_path
+        os.makedirs(credentials_dir, exist_ok=True)
         shutil.copy(credentials_file, kube_credentials_file)
-        utils.log(f'{provider} credentials saved to {kube_credentials_file}\n')
-        utils.log(f"Initializing Terraform for {provider}...\n")
+        utils.log(f'{provider} credentials saved to {kube_credentials_file}\n', provider)
+        utils.log(f"Initializing Terraform for {provider}...\n", provider)
 
-        try:
-            os.chdir(script_dir)
-            os.chdir(f'../providers/{provider}')
-            # Initialize Terraform
-            subprocess.check_call(['terraform', 'init'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        # Initialize Terraform, the provider plugins come from the shared cache or the mirror
+        result = record(steps, 'terraform init', terraform.init(provider_dir(provider), utils.provider_log_file(provider), mirror=mirror,
+                                                                cancel_event=cancel_event))
+        if result.ok:
             utils.log(f"Terraform for {provider} is successfully initialized.", provider)
-            os.chdir(script_dir)
             return True
-        except subprocess.CalledProcessError as e:
-            # Log failure and display error message
-            utils.log(f"Terraform for {provider} failed to initialize. {e}", provider)
-            utils.log(e.output, provider)
-            os.chdir(script_dir)
-            return False
+        # Log failure and display error message
+        utils.log(f"Terraform for {provider} failed to initialize ({result.reason}, exit code {result.returncode}).", provider)
+        utils.log(result.stderr, provider)
+        return False
     else:
         utils.log(f"{provider} credentials file not found. Please configure {provider} CLI before proceeding.", provider)
         return False
 
 
-def aws_init() -> bool:
+def aws_init(mirror=None, steps=None) -> bool:
     credentials_file = os.path.expanduser(const.AWS_PROFILE_FILE)
 
-    try:
-        # Checking if AWS CLI is installed
-        subprocess.check_output(['aws', '--version'], stderr=subprocess.STDOUT, universal_newlines=True)
-    except subprocess.CalledProcessError as e:
-        utils.log(f"AWS CLI is not installed or configured. Please install and configure it before proceeding. {e}", const.AWS_PROVIDER)
-        utils.log(e.output, const.AWS_PROVIDER)
+    # Checking if AWS CLI is installed
+    tool = record(steps, 'aws probe', toolchain.probe('aws'))
+    if not tool.ok:
+        utils.log("AWS CLI is not installed or configured. Please install and configure it before proceeding.", const.AWS_PROVIDER)
         return False
-    else:
-        return terraform_init(const.AWS_PROVIDER, credentials_file)
+    return terraform_init(const.AWS_PROVIDER, credentials_file, mirror, steps)
 
 
-def azure_init() -> bool:
+def azure_init(mirror=None, steps=None) -> bool:
     credentials_file = os.path.expanduser(const.AZURE_PROFILE_FILE)
 
-    try:
-        # Check if Azure CLI is installed
-        subprocess.check_output(['az', '--version'], stderr=subprocess.STDOUT, universal_newlines=True)
-    except subprocess.CalledProcessError as e:
+    # Check if Azure CLI is installed and logged in
+    tool = record(steps, 'az probe', toolchain.probe('az'))
+    if not tool.ok:
         utils.log("Azure CLI is not installed or configured. Please install and configure it before proceeding.", const.AZURE_PROVIDER)
-        utils.log(e.output, const.AZURE_PROVIDER)
         return False
-    else:
-        try:
-            # Check if Azure CLI is logged in
-            subprocess.check_output(['az', 'account', 'show'], stderr=subprocess.STDOUT, universal_newlines=True)
-        except subprocess.CalledProcessError as e:
-            utils.log(f"Azure CLI is not logged in. Please log in before proceeding. {e}", const.AZURE_PROVIDER)
-            return False
-        else:
-            return terraform_init(const.AZURE_PROVIDER, credentials_file)
+    if not tool.authenticated:
+        utils.log("Azure CLI is not logged in. Please log in before proceeding (az login).", const.AZURE_PROVIDER)
+        return False
+    return terraform_init(const.AZURE_PROVIDER, credentials_file, mirror, steps)
 
 
-def gcp_init() -> bool:
+def gcp_init(mirror=None, steps=None) -> bool:
     credentials_file = os.path.expanduser(const.GCP_PROFILE_FILE)
 
-    try:
-        # Check if GCP CLI is installed
-        subprocess.check_output(['gcloud', '--version'], stderr=subprocess.STDOUT, universal_newlines=True)
-    except subprocess.CalledProcessError as e:
-        utils.log(f"Google Cloud CLI is not installed or configured. Please install and configure it before proceeding. {e}", const.GCP_PROVIDER)
-        utils.log(e.output, const.GCP_PROVIDER)
+    # Check if GCP CLI is installed
+    tool = record(steps, 'gcloud probe', toolchain.probe('gcloud'))
+    if not tool.ok:
+        utils.log("Google Cloud CLI is not installed or configured. Please install and configure it before proceeding.", const.GCP_PROVIDER)
         return False
-    else:
-        return terraform_init(const.GCP_PROVIDER, credentials_file)
+    return terraform_init(const.GCP_PROVIDER, credentials_file, mirror, steps)
+
+
+PROVIDER_INITS = {
+    const.AWS_PROVIDER: aws_init,
+    const.AZURE_PROVIDER: azure_init,
+    const.GCP_PROVIDER: gcp_init,
+}
+
+
+def init_job(provider: str, mirror) -> tuple:
+    # Initializes one provider inside a worker, its steps and their durations are reported back for the summary
+    steps = []
+    start = time.monotonic()
+    try:
+        with jsonlog.bind(provider=provider):
+            result = PROVIDER_INITS[provider](mirror, steps)
+    except Exception as e:
+        utils.log(f"Initializing {provider} failed. {e}", provider)
+        result = False
+    return provider, bool(result), steps, time.monotonic() - start
+
+
+def init_summary(results: list) -> str:
+    # One row per step and a total row per provider, durations in seconds
+    rows = [('PROVIDER', 'STEP', 'SECONDS', 'RESULT')]
+    for provider, result, steps, elapsed in results:
+        for name, seconds, ok in steps:
+            rows.append((provider, name, f"{seconds:.2f}", 'ok' if ok else 'failed'))
+        rows.append((provider, 'total', f"{elapsed:.2f}", 'ok' if result else 'FAILED'))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return '\n'.join('  '.join(cell.rjust(width) if i == 2 else cell.ljust(width) for i, (cell, width) in enumerate(zip(row, widths))).rstrip()
+                     for row in rows)
+
+
+def timings_summary() -> str:
+    # The commands run so far with how often and how long they ran, the slowest in total first
+    rows = [('COMMAND', 'RUNS', 'TOTAL', 'SLOWEST')]
+    for name, (count, total, slowest) in sorted(runner.timings().items(), key=lambda item: -item[1][1]):
+        rows.append((name, str(count), f"{total:.2f}", f"{slowest:.2f}"))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return '\n'.join('  '.join(cell.rjust(width) if i else cell.ljust(width) for i, (cell, width) in enumerate(zip(row, widths))).rstrip()
+                     for row in rows)
 
 
 @cli.command()
 @click.argument('providers', nargs=-1, type=click.Choice([const.AWS_PROVIDER, const.AZURE_PROVIDER, const.GCP_PROVIDER]), required=False)
-def init(providers) -> bool:
+@click.option('--mirror', type=click.Path(exists=True, file_okay=False), help='Install the terraform providers only from this filesystem mirror (works offline)', metavar='<dir>')
+def init(providers, mirror) -> bool:
     """
     Initializes the credentials needed for the supported cloud providers and Terraform.
     It saves the credentials in the 'credentials' directory and init logs in the 'logs' directory.
+    The providers are initialized at the same time, each one logging to its own file.
+    The provider plugins are downloaded once in a cache shared by all the providers.
+
+    :param providers: the providers to initialize, all of them by default
+    :param mirror: directory created by terraform providers mirror, used instead of the registry from now on
     """
 
+    if mirror:
+        config_file = terraform.write_mirror_config(mirror)
+        utils.log(f"Terraform providers will be installed from {mirror} ({config_file})")
     # Init cloud providers
-    if not providers or const.AWS_PROVIDER in providers:
-        result = aws_init()
-    if not providers or const.AZURE_PROVIDER in providers:
-        result = azure_init()
-    if not providers or const.GCP_PROVIDER in providers:
-        result = gcp_init()
-    return result
+    selected = [provider for provider in PROVIDER_INITS if not providers or provider in providers]
+    with ThreadPoolExecutor(max_workers=len(selected)) as executor:
+        jobs = [executor.submit(init_job, provider, mirror) for provider in selected]
+        try:
+            results = [job.result() for job in jobs]
+        except KeyboardInterrupt:
+            cancel_event.set()
+            raise
+    print(init_summary(results))
+    if runner.timings():
+        print(f"\n{timings_summary()}")
+    return all(result for _, result, _, _ in results)
+
+
+@cli.command()
+@click.option('--refresh', is_flag=True, default=False, help='Probe the tools again even if the cached results are still valid')
+def doctor(refresh: bool) -> bool:
+    """
+    Checks the tools the kubelab cli depends on: where they are, their version and if you are logged in.
+    The results are cached until a tool or its credentials change (or KLAB_TOOLCHAIN_TTL seconds pass).
+
+    :param refresh: flag to ignore the cache and run every probe again
+    :return: True if every tool is installed, False otherwise
+    """
+    probes = toolchain.probe_all(refresh=refresh)
+    rows = [('TOOL', 'VERSION', 'LOGGED IN', 'PATH', 'SOURCE')]
+    for tool in probes:
+        logged_in = '-' if tool.authenticated is None else 'yes' if tool.authenticated else 'no'
+        source = 'cache' if tool.cached else f"probed in {tool.elapsed:.2f}s" if tool.installed else '-'
+        rows.append((tool.tool, tool.version or 'not installed', logged_in, tool.path or '-', source))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    print('\n'.join('  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() for row in rows))
+    return all(tool.installed for tool in probes)
 
 
 def extract_default_value(config_file: str, section: str, key: str) -> str:
@@ -138,6 +275,7 @@ def extract_default_value(config_file: str, section: str, key: str) -> str:
         print(f"The configuration file ({config_file}) does not exist.")
         return
 
+    import configparser
     config = configparser.ConfigParser()
     config.read(config_file)
 
@@ -153,7 +291,104 @@ def extract_default_value(config_file: str, section: str, key: str) -> str:
         return
 
 
-def create_eks(cluster_name: str, region: str, wait: bool) -> bool:
+def cloud_query(command: list, not_found_markers: tuple):
+    # Runs a read-only cloud CLI query and returns its output, or None when the resource does not exist (anymore)
+    result = runner.run(command, timeout=const.CLI_TIMEOUT, cancel_event=cancel_event)
+    if result.ok:
+        return result.stdout.strip()
+    if any(marker in result.stderr for marker in not_found_markers):
+        return None
+    raise subprocess.CalledProcessError(result.returncode, command, result.stdout, result.stderr)
+
+
+def eks_cluster_status(name: str, region: str) -> str:
+    return cloud_query(['aws', 'eks', 'describe-cluster', '--name', name, '--region', region, '--query', 'cluster.status', '--output', 'text'],
+                       ('ResourceNotFoundException',))
+
+
+def eks_nodegroups(name: str, region: str) -> list:
+    output = cloud_query(['aws', 'eks', 'list-nodegroups', '--cluster-name', name, '--region', region, '--query', 'nodegroups', '--output', 'json'],
+                         ('ResourceNotFoundException',))
+    return json.loads(output) if output else []
+
+
+def aks_nodepools(name: str, resource_group: str) -> list:
+    # Only user pools can be deleted one by one, the system ones go away with the cluster itself
+    output = cloud_query(['az', 'aks', 'nodepool', 'list', '--cluster-name', name, '-g', resource_group, '--query', "[?mode=='User'].name", '--output', 'tsv'],
+                         ('ResourceNotFound', 'could not be found'))
+    return output.split() if output else []
+
+
+def aks_cluster_state(name: str, resource_group: str) -> str:
+    return cloud_query(['az', 'aks', 'show', '-n', name, '-g', resource_group, '--query', 'provisioningState', '--output', 'tsv'],
+                       ('ResourceNotFound', 'could not be found'))
+
+
+def gke_node_pools(name: str, location: str, project: str) -> list:
+    output = cloud_query(['gcloud', 'container', 'node-pools', 'list', '--cluster', name, '--location', location, '--project', project, '--format', 'json(name)'],
+                         ('NOT_FOUND', 'code=404'))
+    return [node_pool['name'] for node_pool in json.loads(output)] if output else []
+
+
+def gke_cluster_status(name: str, location: str, project: str) -> str:
+    return cloud_query(['gcloud', 'container', 'clusters', 'describe', name, '--location', location, '--project', project, '--format', 'value(status)'],
+                       ('NOT_FOUND', 'code=404'))
+
+
+def gke_location(name: str, region: str, project: str) -> str:
+    # Where the GKE cluster lives (its region, or a zone of it), resolved once and then kept in the registry
+    location = registry.get_registry().get_state(name).get('location')
+    if location:
+        return location
+    location = inventory.gke_location(name, project, region)
+    if location is None:
+        utils.log(f"GKE cluster {name} was not found in project {project}, assuming it is a regional cluster of {region}.", const.GCP_PROVIDER)
+        return region
+    registry.get_registry().update_state(name, location=location)
+    return location
+
+
+def wait_for(predicate, description: str, provider: str) -> bool:
+    # Polls the cloud with backoff instead of spinning, transient CLI failures just count as a "not yet"
+    result = waiter.wait_until(predicate, description, cancel_event=cancel_event, retry_on=(subprocess.CalledProcessError,))
+    if result:
+        utils.log(f"Done waiting for {description}: {result.polls} polls in {result.elapsed:.0f}s.", provider)
+    else:
+        utils.log(f"Stopped waiting for {description} ({result.reason}) after {result.polls} polls in {result.elapsed:.0f}s.", provider)
+    return result.done
+
+
+def wait_for_all(groups: list, list_groups, description: str, provider: str) -> bool:
+    # Tracks the deletion of many node groups with one listing per poll, so the total wait is the one of the slowest group
+    results = waiter.wait_all(
+        groups,
+        lambda pending: pending - set(list_groups()),
+        description,
+        cancel_event=cancel_event,
+        retry_on=(subprocess.CalledProcessError,)
+    )
+    for group, result in sorted(results.items(), key=lambda item: item[1].elapsed):
+        status = "deleted" if result else f"still present ({result.reason})"
+        utils.log(f"Node group {group} {status} after {result.elapsed:.0f}s.", provider)
+    return all(results.values())
+
+
+def apply_stack(provider: str, cluster_name: str, variables: dict, backend_config: dict, replan: bool) -> bool:
+    # Plans and applies the provider module for a cluster, skipping terraform entirely when nothing changed since the last apply
+    outcome = terraform.plan_and_apply(job_workdir(provider, cluster_name), cluster_name, variables, backend_config,
+                                       utils.provider_log_file(provider), force=replan, cancel_event=cancel_event)
+    match outcome:
+        case terraform.UNCHANGED:
+            utils.log(f"Terraform configuration and inputs of {cluster_name} did not change since the last apply, skipping plan and apply.", provider)
+        case terraform.NO_CHANGES:
+            utils.log(f"Terraform plan of {cluster_name} has no changes.", provider)
+        case terraform.FAILED:
+            utils.log(f"Terraform failed for {cluster_name}. Please check the log with: lab logs --cluster {cluster_name}", provider)
+            return False
+    return True
+
+
+def create_eks(cluster_name: str, region: str, wait: bool, replan=False) -> bool:
 
     # Extracting the default region from the AWS config file in case it is not set
     if not region:
@@ -161,18 +396,18 @@ def create_eks(cluster_name: str, region: str, wait: bool) -> bool:
         region = extract_default_value(aws_config_file, 'default', 'region')
 
     # Initializing, planning and applying the Terraform configuration for EKS
-    os.chdir(script_dir)
-    os.chdir(f'../providers/{const.AWS_PROVIDER}')
     # FIXME backend-config checks
-    utils.execute_command(f'terraform init -backend-config="bucket={cluster_name}-terraform-state" -backend-config="key=terraform.tfstate" -backend-config="region={region}"', aws_logs_file, wait)
-    utils.execute_command(f'terraform plan -var="cluster_name={cluster_name}" -var="region={region}"', aws_logs_file, wait)
-    utils.execute_command('terraform apply -auto-approve', aws_logs_file, wait)
-    os.chdir(script_dir)
+    variables = {'cluster_name': cluster_name, 'region': region}
+    backend_config = {'bucket': f'{cluster_name}-terraform-state', 'key': 'terraform.tfstate', 'region': region}
+    if not apply_stack(const.AWS_PROVIDER, cluster_name, variables, backend_config, replan):
+        return False
+    if wait and not wait_for(lambda: eks_cluster_status(cluster_name, region) == 'ACTIVE', f"EKS cluster {cluster_name} to be active", const.AWS_PROVIDER):
+        return False
     utils.log(f"EKS Cluster {cluster_name} has been successfully created in {region}.", const.AWS_PROVIDER)
     return True
 
 
-def create_aks(cluster_name: str, region: str, resource_group: str, wait: bool) -> bool:
+def create_aks(cluster_name: str, region: str, resource_group: str, wait: bool, replan=False) -> bool:
 
     # Extracting the default region and resource group from the Azure config file in case they are not set
     if not region:
@@ -183,18 +418,18 @@ def create_aks(cluster_name: str, region: str, resource_group: str, wait: bool)
         resource_group = extract_default_value(azure_config_file, 'defaults', 'group')
 
     # Initializing, planning and applying the Terraform configuration for AKS
-    os.chdir(script_dir)
-    os.chdir(f'../providers/{const.AZURE_PROVIDER}')
     # FIXME backend-config checks blob?
-    utils.execute_command(f'terraform init -backend-config="blob={cluster_name}-terraform-state" -backend-config="key=terraform.tfstate" -backend-config="region={region}"', azure_logs_file, wait)
-    utils.execute_command(f'terraform plan -var="cluster_name={cluster_name}" -var="region={region}" -var="resource_group={resource_group}"', azure_logs_file, wait)
-    utils.execute_command('terraform apply -auto-approve', azure_logs_file, wait)
-    os.chdir(script_dir)
+    variables = {'cluster_name': cluster_name, 'region': region, 'resource_group': resource_group}
+    backend_config = {'blob': f'{cluster_name}-terraform-state', 'key': 'terraform.tfstate', 'region': region}
+    if not apply_stack(const.AZURE_PROVIDER, cluster_name, variables, backend_config, replan):
+        return False
+    if wait and not wait_for(lambda: aks_cluster_state(cluster_name, resource_group) == 'Succeeded', f"AKS cluster {cluster_name} to be provisioned", const.AZURE_PROVIDER):
+        return False
     utils.log(f"AKS Cluster {cluster_name} has been successfully created in {region}.", const.AZURE_PROVIDER)
     return True
 
 
-def create_gke(cluster_name: str, region: str, project: str, wait: bool) -> bool:
+def create_gke(cluster_name: str, region: str, project: str, wait: bool, replan=False) -> bool:
 
     # Extracting the default region and project from the GCP config file in case they are not set
     if not region:
@@ -205,27 +440,22 @@ def create_gke(cluster_name: str, region: str, project: str, wait: bool) -> bool
         project = extract_default_value(gcp_config_file, 'core', 'project')
 
     # Initializing, planning and applying the Terraform configuration for GKE
-    os.chdir(script_dir)
-    os.chdir(f'../providers/{const.GCP_PROVIDER}')
     # FIXME backend-config checks bucket?
-    utils.execute_command(f'terraform init -backend-config="bucket={cluster_name}-terraform-state" -backend-config="prefix=terraform.tfstate" -backend-config="region={region}"', gcp_logs_file, wait)
-    utils.execute_command(f'terraform plan -var="cluster_name={cluster_name}" -var="region={region}" -var="project={project}"', gcp_logs_file, wait)
-    utils.execute_command('terraform apply -auto-approve', gcp_logs_file, wait)
-    os.chdir(script_dir)
+    variables = {'cluster_name': cluster_name, 'region': region, 'project': project}
+    backend_config = {'bucket': f'{cluster_name}-terraform-state', 'prefix': 'terraform.tfstate', 'region': region}
+    if not apply_stack(const.GCP_PROVIDER, cluster_name, variables, backend_config, replan):
+        return False
+    if wait and not wait_for(lambda: gke_cluster_status(cluster_name, region, project) == 'RUNNING', f"GKE cluster {cluster_name} to be running", const.GCP_PROVIDER):
+        return False
     utils.log(f"GKE Cluster {cluster_name} has been successfully created in {region}.", const.GCP_PROVIDER)
     return True
 
 
 def get_cluster_info(cluster_name: str) -> str:
-    # Getting cluster info from the YAML file if exists
-    cluster_file_path = f'{const.CLUSTERS_DIR}/{cluster_name}_cluster.yaml'
-    if not os.path.isfile(cluster_file_path):
-        utils.log(f"Cluster configuration file for {cluster_name} not found. Assuming the cluster does not exist or it is not imported yet.")
-        return None
-    with open(cluster_file_path, 'r') as file:
-        cluster_info = yaml.safe_load(file)
+    # Getting cluster info from the registry if it exists
+    cluster_info = registry.get_registry().get(cluster_name)
     if not cluster_info:
-        utils.log(f"Cluster configuration file for {cluster_name} is empty. Please check the file.")
+        utils.log(f"Cluster configuration for {cluster_name} not found. Assuming the cluster does not exist or it is not imported yet.")
         return None
     return cluster_info
 
@@ -257,25 +487,48 @@ def save_cluster_info(cluster_name: str, provider: str, region: str, resource_gr
             "products": products
         }
 
-    # Define the file name based on the cluster name
-    file_name = f"{const.CLUSTERS_DIR}/{cluster_name}_cluster.yaml"
+    # Save the cluster information to its YAML file and index it
+    file_name = registry.get_registry().save(cluster_info)
+    utils.log(f"Cluster information saved to {file_name}.")
 
-    # Save the cluster information to the YAML file
-    with open(file_name, "w") as yaml_file:
-        yaml.dump(cluster_info, yaml_file, default_flow_style=False)
 
-    utils.log(f"Cluster information saved to {file_name}.")
+def create_cluster(cluster_name: str, provider: str, region: str, resource_group: str, project: str, wait: bool, replan=False) -> bool:
+    # Creates the cluster with the terraform module of its provider (or brings it up to date) and records it in the registry
+    with jsonlog.bind(cluster=cluster_name, provider=provider):
+        if provider == const.AWS_PROVIDER:
+            result = create_eks(cluster_name, region, wait, replan)
+        elif provider == const.AZURE_PROVIDER:
+            utils.check_parameters(resource_group=resource_group)
+            result = create_aks(cluster_name, region, resource_group, wait, replan)
+        elif provider == const.GCP_PROVIDER:
+            utils.check_parameters(project=project)
+            result = create_gke(cluster_name, region, project, wait, replan)
+        else:
+            utils.log(const.UNSUPPORTED_PROVIDER_MSG)
+            return False
+        if not result:
+            # Nothing is recorded, the next create (or apply) tries again
+            utils.log(f"Could not create cluster {cluster_name}.", provider)
+            return False
+        # Save cluster info
+        save_cluster_info(cluster_name, provider, region, resource_group, project, f"{provider}_kube_credential")
+        # The terraform state of the cluster lives in its workspace
+        registry.get_registry().update_state(cluster_name, workspace=os.path.join(const.WORKSPACES_DIR, cluster_name))
+        utils.log(f"Cluster {cluster_name} has been successfully created.", provider)
+        return True
 
 
 @cli.command()
 @click.argument('type', type=click.Choice(['cluster']))
-@click.option('--name', '-n', required=True, help='Name of the resource to be created', metavar='<resource_name>')
+@click.option('--name', '-n', 'cluster_name', required=True, help='Name of the resource to be created', metavar='<resource_name>')
 @click.option('--provider', '-p', required=True, type=click.Choice([const.AWS_PROVIDER, const.AZURE_PROVIDER, const.GCP_PROVIDER]), help='Provider of choice', metavar='<provider>')
 @click.option('--region', '-r', required=True, type=click.STRING, help='Resource region', metavar='<region>')
 @click.option('--resource-group', '-g', type=click.STRING, help='Resource group name (required for Azure)', metavar='<resource_group>')
-@click.option('--project', '-p', type=click.STRING, help='Project ID (required for GCP)', metavar='<project_id>')
-@click.option('--wait', '-w', is_flag=True, default=False, showDefault=True, help='wait for commands completion or not')
-def create(type: str, cluster_name: str, provider: str, region: str, resource_group: str, project: str, wait: bool) -> bool:
+@click.option('--project', type=click.STRING, help='Project ID (required for GCP)', metavar='<project_id>')
+@click.option('--wait', '-w', is_flag=True, default=False, show_default=True, help='wait for commands completion or not')
+@click.option('--replan', is_flag=True, default=False, help='Plan again even if the configuration and inputs did not change since the last apply')
+@click.option('--background', '-b', is_flag=True, default=False, help='Run as a background job that ends when the cluster is ready, see lab jobs')
+def create(type: str, cluster_name: str, provider: str, region: str, resource_group: str, project: str, wait: bool, replan: bool, background: bool) -> bool:
     """
     Creates a k8s cluster in the specified cloud provider.
 
@@ -285,67 +538,62 @@ def create(type: str, cluster_name: str, provider: str, region: str, resource_gr
     :param region: the region where the resource will be created
     :param resource_group: the resource group where the resource will be created (optional)
     :param project: the GCP project ID where the resource will be created (optional)
+    :param wait: flag to wait for the cluster to be ready
+    :param replan: flag to run terraform plan even if nothing changed since the last apply
+    :param background: flag to run the creation as a background job, waiting for the cluster to be ready
     """
 
     match type:
         case 'cluster':
             utils.check_parameters(name=cluster_name, provider=provider, region=region)
-            # Check if the cluster already exists
-            if len(search_clusters(cluster_name, provider)) > 0:
-                utils.log(f"Cluster {cluster_name} already exists, name must be unique. Please use a different name.")
-                return False
-            # Creating clusters
-            if provider == const.AWS_PROVIDER:
-                result = create_eks(cluster_name, region, wait)
-            if provider == const.AZURE_PROVIDER:
-                utils.check_parameters(resource_group=resource_group)
-                result = create_aks(cluster_name, region, resource_group, wait)
-            if provider == const.GCP_PROVIDER:
-                utils.check_parameters(project=project)
-                result = create_gke(cluster_name, region, project, wait)
-            else:
-                utils.log(const.UNSUPPORTED_PROVIDER_MSG)
-                return False
-            # Save cluster info
-            save_cluster_info(cluster_name, provider, region, resource_group, project, f"{provider}_kube_credential")
-            utils.log(f"Cluster {cluster_name} has been successfully created.", provider)
-            return result
+            # Names must be unique, creating the same cluster again only brings it up to date
+            existing = registry.get_registry().get(cluster_name)
+            if existing:
+                if (existing.get('provider'), existing.get('region')) != (provider, region):
+                    utils.log(f"Cluster {cluster_name} already exists in {existing.get('provider')} {existing.get('region')}, name must be unique. Please use a different name.")
+                    return False
+                utils.log(f"Cluster {cluster_name} already exists, bringing it up to date.", provider)
+            if background:
+                # The job is done once the cluster is usable, not when terraform returns
+                return start_job('create', cluster_name, provider, wait=True)
+            return create_cluster(cluster_name, provider, region, resource_group, project, wait, replan)
         # Default case
         case _:
             utils.log(const.UNSUPPORTED_TYPE_MSG)
             return False
 
 
-def search_clusters(name: str, provider: str) -> list:
-    # Search for clusters based on the name and provider
-    clusters = []
-    for file in os.listdir(const.CLUSTERS_DIR):
-        # Name is optional so if it is not set, all clusters will be considered
-        if name is None or fnmatch.fnmatch(file, f'{name}_cluster.yaml'):
-            with open(os.path.join(const.CLUSTERS_DIR, file), 'r') as cluster_file:
-                cluster_info = yaml.safe_load(cluster_file)
-                # Cluster provider is optional, so if it is not set, all providers will be considered
-                if provider is None or provider == cluster_info['provider']:
-                    clusters.append(cluster_info)
-    return clusters
+def search_clusters(name: str, provider: str, region=None) -> list:
+    # Search for clusters based on the name (glob pattern), provider and region, every filter is optional
+    return registry.get_registry().search(name, provider, region)
 
 
 @cli.command()
 @click.argument('type', type=click.Choice(['cluster']))
 @click.option('--provider', '-p', required=False, type=click.Choice([const.AWS_PROVIDER, const.AZURE_PROVIDER, const.GCP_PROVIDER]), help='Provider filter', metavar='<provider>')
 @click.option('--name', '-n', type=click.STRING, required=False, help='Name filter for resource', metavar='<name>')
-def show(type: str, provider: str, name: str) -> list:
+@click.option('--region', '-r', type=click.STRING, required=False, help='Region filter', metavar='<region>')
+@click.option('--live', is_flag=True, default=False, help='Also list the clusters in the clouds and compare them with the managed ones')
+@click.option('--refresh', is_flag=True, default=False, help='With --live, query the clouds even if the cached inventory is still valid')
+def show(type: str, provider: str, name: str, region: str, live: bool, refresh: bool) -> list:
     """
     Shows resources available and connected to the kubelab cli.
+    With --live every provider and region is queried at the same time, the listings are cached for KLAB_INVENTORY_TTL
+    seconds (5 minutes by default).
 
     :param type: the resource type to be listed
     :param provider: the cloud provider to be used for filtering (optional)
     :param name: the name pattern to be used for filtering (optional)
+    :param region: the region to be used for filtering (optional)
+    :param live: flag to list the clusters in the clouds and mark them managed, imported, orphaned or unmanaged
+    :param refresh: flag to ignore the cached inventory
     """
 
     match type:
         case 'cluster':
-            clusters = search_clusters(name, provider)
+            if live:
+                return show_live(provider, name, region, refresh)
+            clusters = search_clusters(name, provider, region)
             if len(clusters) == 0:
                 utils.log("No clusters found.")
             else:
@@ -355,22 +603,56 @@ def show(type: str, provider: str, name: str) -> list:
             utils.log(const.UNSUPPORTED_TYPE_MSG)
             return None
 
-def switch_to_cluster(name: str, provider: str, region: str, resource_group: str, project: str) -> bool:
+def show_live(provider: str, name: str, region: str, refresh: bool) -> list:
+    # The registry merged with what the cloud APIs list, as a table
+    managed = search_clusters(None, provider)
+    states = {cluster['name']: registry.get_registry().get_state(cluster['name']) for cluster in managed}
+    providers = [provider] if provider else [const.AWS_PROVIDER, const.AZURE_PROVIDER, const.GCP_PROVIDER]
+    clusters, errors = inventory.live_clusters(providers, managed, states, region, refresh)
+    if name:
+        clusters = [cluster for cluster in clusters if fnmatch.fnmatchcase(cluster['name'], name)]
+    for scope, error in sorted(errors.items()):
+        utils.log(f"Could not list the clusters of {scope}: {error}", level=logging.WARNING)
+    if not clusters:
+        print("No clusters found.")
+        return clusters
+    rows = [('NAME', 'PROVIDER', 'REGION', 'STATUS')]
+    rows += [(cluster['name'], cluster['provider'], cluster.get('region') or '-', cluster['status']) for cluster in clusters]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    print('\n'.join('  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() for row in rows))
+    return clusters
+
+
+def switch_to_cluster(name: str, provider: str, region: str, resource_group: str, project: str, refresh=False) -> bool:
     utils.check_parameters(name=name, provider=provider)
+    # The kubeconfig entry fetched the first time is kept in the registry, switching again only edits the current context
+    cached = registry.get_registry().get_state(name).get('kubeconfig')
+    # Without its credentials in the kubeconfig (e.g. a fresh machine) the entry is fetched again
+    if cached and not refresh and kubeconfig.use_context(cached):
+        if 'user' in cached:
+            # Recorded before the credentials were left out of the registry
+            registry.get_registry().update_state(name, kubeconfig=kubeconfig.without_credentials(cached))
+        utils.log(f"Switched to the {cached['context']['name']} context of {name} cluster.", provider)
+        return True
     # Update the Kubernetes configuration based on the cluster's cloud provider
     if provider == const.AWS_PROVIDER:
         utils.check_parameters(region=region)
-        update_kubeconfig_cmd = f"aws eks update-kubeconfig --region {region} --name {name}"
-    if provider == const.AZURE_PROVIDER:
+        update_kubeconfig_cmd = ['aws', 'eks', 'update-kubeconfig', '--region', region, '--name', name]
+    elif provider == const.AZURE_PROVIDER:
         utils.check_parameters(resource_group=resource_group)
-        update_kubeconfig_cmd = f"az aks get-credentials --resource-group {resource_group} --name {name} --overwrite-existing"
-    if provider == const.GCP_PROVIDER:
+        update_kubeconfig_cmd = ['az', 'aks', 'get-credentials', '--resource-group', resource_group, '--name', name, '--overwrite-existing']
+    elif provider == const.GCP_PROVIDER:
         utils.check_parameters(region=region, project=project)
-        update_kubeconfig_cmd = f"gcloud container clusters get-credentials {name} --region {region} --project {project}"
+        update_kubeconfig_cmd = ['gcloud', 'container', 'clusters', 'get-credentials', name, '--location', gke_location(name, region, project), '--project', project]
     else:
         utils.log(const.UNSUPPORTED_PROVIDER_MSG)
         return False
-    utils.execute_command(update_kubeconfig_cmd, generic_logs_file, wait=True)
+    result = runner.run(update_kubeconfig_cmd, utils.provider_log_file(), timeout=const.CLI_TIMEOUT)
+    if not result.ok:
+        utils.log(f"Kubernetes configuration could not be updated for {name} cluster. {result.stderr}", provider)
+        return False
+    # The cloud CLIs leave the context of the cluster as the current one
+    registry.get_registry().update_state(name, kubeconfig=kubeconfig.without_credentials(kubeconfig.extract(kubeconfig.load())))
     utils.log(f"Kubernetes configuration updated for {name} cluster.", provider)
     return True
 
@@ -380,8 +662,9 @@ def switch_to_cluster(name: str, provider: str, region: str, resource_group: str
 @click.option('--provider', '-p', required=False, type=click.Choice([const.AWS_PROVIDER, const.AZURE_PROVIDER, const.GCP_PROVIDER]), help='Provider of choice', metavar='<provider>')
 @click.option('--region', '-r', required=False, type=click.STRING, help='Resource region', metavar='<region>')
 @click.option('--resource-group', '-g', required=False, type=click.STRING, help='Resource group name', metavar='<resource_group>')
-@click.option('--project', '-p', required=False, type=click.STRING, help='Project ID', metavar='<project_id>')
-def use(type: str, name: str, provider: str, region: str, resource_group: str, project: str) -> bool:
+@click.option('--project', required=False, type=click.STRING, help='Project ID', metavar='<project_id>')
+@click.option('--refresh', is_flag=True, default=False, help='Fetch the cluster credentials again from the cloud provider')
+def use(type: str, name: str, provider: str, region: str, resource_group: str, project: str, refresh: bool) -> bool:
     """
     Select a resource to switch to, it can be pre-existing or created with the kubelab cli.
 
@@ -391,6 +674,7 @@ def use(type: str, name: str, provider: str, region: str, resource_group: str, p
     :param region: the region of the resource
     :param resource_group: the resource group of the cluster (Azure)
     :param project: the GCP project of the cluster (GCP)
+    :param refresh: flag to fetch the credentials from the cloud provider even if they are cached
     :return: True if the resource was switched to successfully, False otherwise
     """
     match type:
@@ -399,10 +683,9 @@ def use(type: str, name: str, provider: str, region: str, resource_group: str, p
             cluster_info = get_cluster_info(name)
             if not cluster_info:
                 utils.log(f"Cluster {name} is not managed by the kubelab-cli. Trying to use it via provided parameters...")
-                result = switch_to_cluster(name, provider, region, resource_group, project)
                 # Save cluster info since it is not managed by the kubelab-cli, next time it will be used via the saved info
                 save_cluster_info(name, provider, region, resource_group, project, f"{provider}_kube_credential")
-                return result
+                return switch_to_cluster(name, provider, region, resource_group, project, refresh)
             # Extract cluster information from file in case it exists
             cluster_name = cluster_info.get('name')
             cluster_provider = cluster_info.get('provider')
@@ -410,115 +693,228 @@ def use(type: str, name: str, provider: str, region: str, resource_group: str, p
             cluster_resource_group = cluster_info.get('resource_group')
             cluster_project = cluster_info.get('project')
             # Switches to cluster
-            result = switch_to_cluster(cluster_name, cluster_provider, cluster_region, cluster_resource_group, cluster_project)
+            result = switch_to_cluster(cluster_name, cluster_provider, cluster_region, cluster_resource_group, cluster_project, refresh)
             return result
         case _:
             utils.log(const.UNSUPPORTED_TYPE_MSG)
             return False
 
 
+def job_workdir(provider: str, cluster_name: str) -> str:
+    # Every cluster gets its own workspace stamped from the provider module, so creates and destroys of different clusters
+    # never share the .terraform dir, the state or the cwd and can run at the same time
+    # The workspace sits next to providers/ on purpose: the relative credential paths used in the modules keep resolving
+    workdir = os.path.abspath(os.path.join(script_dir, '..', const.WORKSPACES_DIR, cluster_name))
+    return terraform.stamp_workspace(provider_dir(provider), workdir)
+
+
+def delete_all(commands: list, provider: str) -> bool:
+    # Issues independent delete requests at the same time, e.g. one per node group
+    results = runner.run_many(commands, utils.provider_log_file(provider), timeout=const.CLI_TIMEOUT, cancel_event=cancel_event)
+    for result in results:
+        if not result.ok:
+            utils.log(f"{result.command} failed ({result.reason}, exit code {result.returncode}). {result.stderr}", provider)
+    return all(results)
+
+
 def destroy_eks(name: str, region: str) -> bool:
     utils.log(f"You have selected to destroy cluster: {name} that is located in: {region}", const.AWS_PROVIDER)
-    utils.execute_command(f"aws eks describe-cluster --name {name} --region {region}", aws_logs_file, wait=True)
-    # Deleting nodegroups via aws cli
-    check_output = utils.execute_command(f"aws eks list-nodegroups --cluster-name {name} --region {region}", aws_logs_file, wait=True)
-    node_groups = json.loads(check_output)['nodegroups']
+    runner.run(['aws', 'eks', 'describe-cluster', '--name', name, '--region', region], utils.provider_log_file(const.AWS_PROVIDER), timeout=const.CLI_TIMEOUT)
+    # Deleting all the nodegroups at once via aws cli
+    node_groups = eks_nodegroups(name, region)
     if node_groups:
         for node_group in node_groups:
             utils.log(f"Node group {node_group} is being destroyed...", const.AWS_PROVIDER)
-            utils.execute_command(
-                f"aws eks delete-nodegroup --cluster-name {name} --nodegroup-name {node_group} --region {region}",
-                aws_logs_file,
-                wait=False
-            )
+        delete_all([['aws', 'eks', 'delete-nodegroup', '--cluster-name', name, '--nodegroup-name', node_group, '--region', region]
+                    for node_group in node_groups], const.AWS_PROVIDER)
+        # EKS refuses to delete a cluster that still has node groups
+        if not wait_for_all(node_groups, lambda: eks_nodegroups(name, region), f"node groups of {name}", const.AWS_PROVIDER):
+            return False
     # Deleting cluster
     utils.log(f"The EKS cluster {name} in region {region} is being destroyed...", const.AWS_PROVIDER)
-    utils.execute_command(f"aws eks delete-cluster --name {name} --region {region}", aws_logs_file, wait=True)
+    if not delete_all([['aws', 'eks', 'delete-cluster', '--name', name, '--region', region]], const.AWS_PROVIDER):
+        return False
+    if not wait_for(lambda: eks_cluster_status(name, region) is None, f"EKS cluster {name} to be deleted", const.AWS_PROVIDER):
+        return False
     # Deleting connected resources
-    os.chdir(script_dir)
-    os.chdir(f'../providers/${const.AWS_PROVIDER}')
-    utils.execute_command(f'terraform destroy -auto-approve -var="cluster_name={name}" -var="region={region}"', aws_logs_file, wait=True)
+    workdir = job_workdir(const.AWS_PROVIDER, name)
+    if not run_steps([
+        ['terraform', 'init', '-input=false'],
+        ['terraform', 'destroy', '-input=false', '-auto-approve', f'-var=cluster_name={name}', f'-var=region={region}'],
+    ], const.AWS_PROVIDER, workdir):
+        return False
     utils.log("The rest of the resources were also destroyed...", const.AWS_PROVIDER)
-    os.chdir(script_dir)
+    shutil.rmtree(workdir, ignore_errors=True)
     return True
 
 def destroy_aks(name: str, region: str, resource_group: str) -> bool:
     utils.log(f"You have selected to destroy cluster: {resource_group}.{name} that is located in: {region}", const.AZURE_PROVIDER)
-    utils.execute_command(f"az aks show -n {name} -g {resource_group} --query provisioningState --output tsv", azure_logs_file, wait=True)
-    # Deleting nodepools via az
-    nodepool_output = utils.execute_command(
-        f"az aks nodepool list --cluster-name {name} -g {resource_group} --query [].name --output tsv",
-        azure_logs_file,
-        wait=True
-    )
-    nodepools = nodepool_output.decode().strip().split()
+    runner.run(['az', 'aks', 'show', '-n', name, '-g', resource_group, '--query', 'provisioningState', '--output', 'tsv'], utils.provider_log_file(const.AZURE_PROVIDER), timeout=const.CLI_TIMEOUT)
+    # Deleting all the nodepools at once via az
+    nodepools = aks_nodepools(name, resource_group)
     if nodepools:
         for nodepool in nodepools:
             utils.log(f"Nodepool {nodepool} is being destroyed...", const.AZURE_PROVIDER)
-            utils.execute_command(
-                f"az aks nodepool delete --cluster-name {name} -g {resource_group} -n {nodepool} --no-wait",
-                azure_logs_file,
-                wait=False
-            )
+        delete_all([['az', 'aks', 'nodepool', 'delete', '--cluster-name', name, '-g', resource_group, '-n', nodepool, '--no-wait']
+                    for nodepool in nodepools], const.AZURE_PROVIDER)
+        if not wait_for_all(nodepools, lambda: aks_nodepools(name, resource_group), f"nodepools of {name}", const.AZURE_PROVIDER):
+            return False
     # Deleting cluster via az
     utils.log(f"The AKS cluster {resource_group}.{name} in region {region} is being destroyed...", const.AZURE_PROVIDER)
-    utils.execute_command(f"az aks delete --name {name} --g {resource_group} --yes --no-wait", azure_logs_file, wait=False)
+    if not delete_all([['az', 'aks', 'delete', '--name', name, '-g', resource_group, '--yes', '--no-wait']], const.AZURE_PROVIDER):
+        return False
+    if not wait_for(lambda: aks_cluster_state(name, resource_group) is None, f"AKS cluster {name} to be deleted", const.AZURE_PROVIDER):
+        return False
     # Deleting connected resources via Terraform
-    os.chdir(script_dir)
-    os.chdir(f'../providers/${const.AZURE_PROVIDER}')
-    utils.execute_command(
-        f'terraform destroy -auto-approve -var="cluster_name={name}" -var="location={region}" -var="resource_group={resource_group}"',
-        azure_logs_file,
-        wait=True
-    )
+    workdir = job_workdir(const.AZURE_PROVIDER, name)
+    if not run_steps([
+        ['terraform', 'init', '-input=false'],
+        ['terraform', 'destroy', '-input=false', '-auto-approve', f'-var=cluster_name={name}', f'-var=location={region}', f'-var=resource_group={resource_group}'],
+    ], const.AZURE_PROVIDER, workdir):
+        return False
     utils.log("The rest of the resources were also destroyed...", const.AZURE_PROVIDER)
-    os.chdir(script_dir)
+    shutil.rmtree(workdir, ignore_errors=True)
     return True
 
 def destroy_gke(name: str, region: str, project: str) -> bool:
-    utils.log(f"You have selected to destroy cluster: {project}.{name} that is located in: {region}", const.GCP_PROVIDER)
-    utils.execute_command(f"gcloud container clusters describe {name} --region {region} --project {project}", gcp_logs_file, wait=True)
-    # Deleting nodes via gcloud
-    node_output = utils.execute_command(f'gcloud container node-pools list --cluster {name}', gcp_logs_file, wait=True)
-    nodes = node_output.decode().strip().split()
-    if nodes:
-        for node in nodes:
-            utils.log(f"Node {node} is being destroyed...", const.GCP_PROVIDER)
-            utils.execute_command(f"gcloud container node-pools delete {node} --cluster {name} -q", gcp_logs_file, wait=False)
+    # The zone of a zonal cluster is resolved once, every later call goes straight to it
+    location = gke_location(name, region, project)
+    utils.log(f"You have selected to destroy cluster: {project}.{name} that is located in: {location}", const.GCP_PROVIDER)
+    # Deleting all the node pools at once via gcloud
+    node_pools = gke_node_pools(name, location, project)
+    if node_pools:
+        for node_pool in node_pools:
+            utils.log(f"Node pool {node_pool} is being destroyed...", const.GCP_PROVIDER)
+        delete_all([['gcloud', 'container', 'node-pools', 'delete', node_pool, '--cluster', name, '--location', location, '--project', project, '--async', '-q']
+                    for node_pool in node_pools], const.GCP_PROVIDER)
+        if not wait_for_all(node_pools, lambda: gke_node_pools(name, location, project), f"node pools of {name}", const.GCP_PROVIDER):
+            return False
     # Deleting cluster via gcloud
-    utils.log(f"The GKE cluster {project}.{name} in region {region} is being destroyed...", const.GCP_PROVIDER)
-    utils.execute_command(f"gcloud container clusters delete {name} --region {region} --project {project} --async", gcp_logs_file, wait=False)
+    utils.log(f"The GKE cluster {project}.{name} in {location} is being destroyed...", const.GCP_PROVIDER)
+    if not delete_all([['gcloud', 'container', 'clusters', 'delete', name, '--location', location, '--project', project, '--async', '-q']], const.GCP_PROVIDER):
+        return False
+    if not wait_for(lambda: gke_cluster_status(name, location, project) is None, f"GKE cluster {name} to be deleted", const.GCP_PROVIDER):
+        return False
     # Deleting connected resources via Terraform
-    os.chdir(script_dir)
-    os.chdir(f'../providers/${const.GCP_PROVIDER}')
-    utils.execute_command(
-        f'terraform destroy -auto-approve -var="cluster_name={name}" -var="region={region}" -var="project={project}"',
-        gcp_logs_file,
-        wait=True
-    )
+    workdir = job_workdir(const.GCP_PROVIDER, name)
+    if not run_steps([
+        ['terraform', 'init', '-input=false'],
+        ['terraform', 'destroy', '-input=false', '-auto-approve', f'-var=cluster_name={name}', f'-var=region={region}', f'-var=project={project}'],
+    ], const.GCP_PROVIDER, workdir):
+        return False
     utils.log("The rest of the resources were also destroyed...", const.GCP_PROVIDER)
-    os.chdir(script_dir)
+    shutil.rmtree(workdir, ignore_errors=True)
     return True
 
 
+def destroy_cluster(cluster_info: dict) -> bool:
+    # Dispatches the destruction to the right provider and drops the cluster config file once it is gone
+    cluster_name = cluster_info.get('name')
+    provider = cluster_info.get('provider')
+    with jsonlog.bind(cluster=cluster_name, provider=provider):
+        if provider == const.AWS_PROVIDER:
+            result = destroy_eks(cluster_name, cluster_info.get('region'))
+        elif provider == const.AZURE_PROVIDER:
+            result = destroy_aks(cluster_name, cluster_info.get('region'), cluster_info.get('resource_group'))
+        elif provider == const.GCP_PROVIDER:
+            result = destroy_gke(cluster_name, cluster_info.get('region'), cluster_info.get('project'))
+        else:
+            utils.log(const.UNSUPPORTED_PROVIDER_MSG)
+            return False
+    if result:
+        registry.get_registry().remove(cluster_name)
+        utils.log(f"Cluster {cluster_name} has been successfully deleted along with its config file.", provider)
+    return result
+
+
+def destroy_job(cluster_info: dict) -> tuple:
+    # Runs one destruction inside a worker, failures are reported back instead of aborting the whole batch
+    start = time.monotonic()
+    try:
+        result = destroy_cluster(cluster_info)
+    except Exception as e:
+        utils.log(f"Destroying cluster {cluster_info.get('name')} failed. {e}", cluster_info.get('provider'))
+        result = False
+    return cluster_info.get('name'), result, time.monotonic() - start
+
+
+def destroy_clusters(clusters: list, workers: int) -> dict:
+    # Destroys several clusters at the same time on a bounded thread pool, streaming the outcome of each job as it completes
+    # The jobs mostly wait on the cloud CLIs and terraform, threads are enough and share the registry, the log queue and cancel_event
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        jobs = [executor.submit(destroy_job, cluster) for cluster in clusters]
+        try:
+            for done, job in enumerate(as_completed(jobs), start=1):
+                name, result, elapsed = job.result()
+                results[name] = result
+                status = "destroyed" if result else "FAILED"
+                utils.log(f"[{done}/{len(clusters)}] Cluster {name} {status} after {elapsed:.0f}s.")
+        except KeyboardInterrupt:
+            # Stop the pending waits of the running jobs and drop the ones not started yet
+            cancel_event.set()
+            for job in jobs:
+                job.cancel()
+            raise
+    return results
+
+
 @cli.command()
 @click.argument('type', type=click.Choice(['cluster']))
-@click.option('--name', '-n', required=True, type=click.STRING, help='Name of the resource to be destroyed', metavar='<resource_name>')
-@click.option('--region', required=True, type=click.STRING, help='Location of the resource', metavar='<region>')
+@click.option('--name', '-n', required=False, type=click.STRING, help='Name of the resource to be destroyed', metavar='<resource_name>')
+@click.option('--region', required=False, type=click.STRING, help='Location of the resource', metavar='<region>')
 @click.option('--interactive', '-i', is_flag=True, help='Shows a list of resources to choose from')
+@click.option('--all', 'all_clusters', is_flag=True, help='Destroy every cluster managed by the kubelab cli')
+@click.option('--match', '-m', 'pattern', required=False, type=click.STRING, help='Destroy every managed cluster whose name matches the pattern', metavar='<glob>')
+@click.option('--workers', type=click.IntRange(min=1), default=const.DEFAULT_DESTROY_WORKERS, show_default=True, help='Number of clusters destroyed at the same time')
 @click.option('--yes', '-y', is_flag=True, help='Skip all prompts and proceed with destruction in quiet mode.')
-def destroy(type: str, name: str, region: str, interactive: bool, yes: bool) -> bool:
+@click.option('--background', '-b', is_flag=True, default=False, help='Run as a background job, see lab jobs')
+def destroy(type: str, name: str, region: str, interactive: bool, all_clusters: bool, pattern: str, workers: int, yes: bool, background: bool) -> bool:
     """
     Destroys a resource in the specified cloud provider.
 
     :param type: the resource type to be destroyed
     :param name: the name of the resource to be destroyed
     :param region: the region where the resource will be destroyed
+    :param all_clusters: flag to destroy every cluster managed by the kubelab cli
+    :param pattern: glob pattern selecting the managed clusters to be destroyed
+    :param workers: the number of clusters destroyed at the same time with --all/--match
     :param yes: flag to automatically answer "yes" to all prompts and proceed with destruction
+    :param background: flag to run the destruction as a background job, the confirmation is asked before it starts
     :return: True if the resource was destroyed successfully, False otherwise
     """
     match type:
         case 'cluster':
+            if background:
+                if interactive:
+                    raise click.UsageError("--background cannot be used with --interactive.")
+                if not (all_clusters or pattern):
+                    utils.check_parameters(name=name, region=region)
+                target = 'every cluster' if all_clusters else f"the clusters matching {pattern}" if pattern else f"cluster {name}"
+                if not yes and not click.confirm(f"Are you sure you want to destroy {target} in the background? This operation will also destroy all the resources associated with it."):
+                    utils.log("Cluster destruction has been cancelled.")
+                    return False
+                # Nobody answers the prompts of a background job
+                return start_job('destroy', name or pattern or '*', yes=True)
+            if all_clusters or pattern:
+                clusters = search_clusters(None if all_clusters else pattern, None)
+                if not clusters:
+                    utils.log("No clusters found.")
+                    return False
+                print("The following clusters will be destroyed:")
+                for cluster in clusters:
+                    print(f"- {cluster['name']} [{cluster['provider']}, {cluster['region']}]")
+                if not yes:
+                    if not click.confirm(f"Are you sure you want to destroy {len(clusters)} clusters? This operation will also destroy all the resources associated with them."):
+                        utils.log("Cluster destruction has been cancelled.")
+                        return False
+                results = destroy_clusters(clusters, workers)
+                failed = [name for name, result in results.items() if not result]
+                if failed:
+                    utils.log(f"{len(failed)} of {len(results)} clusters could not be destroyed: {', '.join(failed)}. Please check the logs.")
+                    click.get_current_context().exit(1)
+                utils.log(f"All {len(results)} clusters have been successfully destroyed.")
+                return True
             if interactive:
                 # List available clusters
                 clusters = search_clusters(None, None)
@@ -534,7 +930,7 @@ def destroy(type: str, name: str, region: str, interactive: bool, yes: bool) ->
                     selected_index = int(input("Enter the number of the cluster to delete: ")) - 1
                     selected_cluster = clusters[selected_index]
                     cluster_name = selected_cluster['name']
-                    cluster_region = selected_cluster['region']
+                    region = selected_cluster['region']
                 except (ValueError, IndexError):
                     utils.log("Invalid selection. Aborting.")
                     return False
@@ -542,84 +938,26 @@ def destroy(type: str, name: str, region: str, interactive: bool, yes: bool) ->
                 utils.check_parameters(name=name, region=region)
                 # Use provided parameters
                 cluster_name = name
-                cluster_region = region
             if not yes:
                 # If not in quiet mode, ask for confirmation and in case of positive answer, proceed with destruction
                 if not click.confirm("Are you sure you want to destroy the cluster? This operation will also destroy all the resources associated with it. Type 'yes' or 'y' to confirm."):
                     utils.log("Cluster destruction has been cancelled.")
                     return False
             cluster_info = get_cluster_info(cluster_name)
-            # Extract cluster information
-            cluster_name = cluster_info.get('name')
-            provider = cluster_info.get('provider')
-            cluster_region = cluster_info.get('region')
-            resource_group = cluster_info.get('resource_group')
-            project = cluster_info.get('project')
+            if not cluster_info:
+                return False
             # Validate if the cluster information matches the provided parameters
+            cluster_region = cluster_info.get('region')
             if cluster_region != region:
-                utils.log(f"Cluster {name} is not in {region} but in {cluster_region} instead. Please specify the correct region.")
-                return
-            # Destroying clusters
-            if provider == const.AWS_PROVIDER:
-                result = destroy_eks(cluster_name, cluster_region)
-            if provider == const.AZURE_PROVIDER:
-                result = destroy_aks(cluster_name, cluster_region, resource_group)
-            if provider == const.GCP_PROVIDER:
-                result = destroy_gke(cluster_name, cluster_region, project)
-            else:
-                utils.log(const.UNSUPPORTED_PROVIDER_MSG)
+                utils.log(f"Cluster {cluster_name} is not in {region} but in {cluster_region} instead. Please specify the correct region.")
                 return False
-            # Deleting cluster info file
-            os.remove(f"{const.CLUSTERS_DIR}/{cluster_name}_cluster.yaml")
-            utils.log(f"Cluster {cluster_name} has been successfully deleted along with its config file.", provider)
-            return result
+            return destroy_cluster(cluster_info)
         # Default case
         case _:
             utils.log(const.UNSUPPORTED_TYPE_MSG)
             return False
 
 
-def search_products(cluster_name: str, product=None) -> list:
-    # Find the products based on cluster_name
-    products = get_cluster_info(cluster_name).get('products')
-
-    if product is None:
-        # If product is not specified, return all products as an array
-        return products
-    else:
-        # If product is specified, find the matching product and return it as a single object
-        for product in products:
-            if product.get("name"):
-                return product
-
-        # If no matching product is found, return None
-        return None
-
-@cli.command()
-@click.argument('product', type=click.Choice(['nginx', 'istio']))
-@click.option('--cluster', '-c', required=True, help='Name of the cluster to be used', metavar='<resource_name>')
-@click.option('--type', type=click.Choice(['operator', 'deployment']), required=False, default="deployment", help='Type of how to deploy operator')
-@click.option('--version', type=click.STRING, help="product version", required=False)
-@click.option('--yes', '-y', is_flag=True, help='Automatically answer "yes" to all prompts and proceed.')
-def add(cluster: str, type: str, product: str, version: str, yes: bool):
-    """
-    Adds a product in the current cluster.
-
-    :param type: the installation type of the product to be added
-    :param product: the cloud native product to be added
-    :param version: the desired version of the product to be added
-    :param yes: flag to automatically answer "yes" to all prompts and proceed
-    """
-    utils.check_parameters(product=product)
-    installed_products = search_products(cluster)
-    # Check if the product is already installed on the cluster
-    if installed_products.get(product):
-        utils.log(f"Product {product} is already installed. Please use update to manage it.")
-        return
-
-    return
-
-
 @cli.command()
 def info():
     """
@@ -630,4 +968,6 @@ def info():
 
 
 if __name__ == '__main__':
+    # The command modules import lab2, they must get this module and not a second copy with its own cancel_event
+    sys.modules.setdefault('lab2', sys.modules[__name__])
     cli()
@@ -0,0 +1,89 @@
+import time
+import click
+import utils as utils
+import jobs as background_jobs
+
+
+@click.group()
+def jobs():
+    """
+    Lists, waits for and cancels the background jobs started by create and destroy with --background.
+    """
+
+
+def job_rows(job_list: list) -> str:
+    rows = [('ID', 'KIND', 'CLUSTER', 'STATUS', 'EXIT', 'PID', 'STARTED', 'ELAPSED', 'LOG')]
+    for job in job_list:
+        elapsed = (job['finished'] or time.time()) - job['started']
+        rows.append((str(job['id']), job['kind'], job['cluster'] or '-', job['status'],
+                     '-' if job['exit_code'] is None else str(job['exit_code']), str(job['pid'] or '-'),
+                     time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(job['started'])), f"{elapsed:.0f}s", job['log_file'] or '-'))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return '\n'.join('  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() for row in rows)
+
+
+@jobs.command('list')
+@click.option('--status', '-s', required=False, type=click.Choice([background_jobs.RUNNING, background_jobs.SUCCEEDED, background_jobs.FAILED, background_jobs.CANCELLED, background_jobs.LOST]), help='Status filter', metavar='<status>')
+def list_jobs(status: str) -> bool:
+    """
+    Lists the background jobs with their status and exit code.
+
+    :param status: only the jobs with this status are listed
+    """
+    job_list = background_jobs.list_jobs(status)
+    if not job_list:
+        print("No jobs found.")
+        return True
+    print(job_rows(job_list))
+    return True
+
+
+@jobs.command('wait')
+@click.argument('job_ids', nargs=-1, type=click.INT)
+@click.option('--timeout', '-t', required=False, type=click.FloatRange(min=0), help='Seconds after which to stop waiting', metavar='<seconds>')
+def wait_jobs(job_ids: tuple, timeout: float) -> bool:
+    """
+    Waits until background jobs are done, every running job when no id is given.
+    It exits with 1 if any of them did not succeed or is still running after the timeout.
+
+    :param job_ids: the jobs to wait for
+    :param timeout: seconds after which the wait gives up
+    :return: True if every job succeeded, False otherwise
+    """
+    job_ids = list(job_ids) or [job['id'] for job in background_jobs.list_jobs(background_jobs.RUNNING)]
+    missing = [job_id for job_id in job_ids if background_jobs.get(job_id) is None]
+    if missing:
+        print(f"Job {', '.join(map(str, missing))} not found.")
+        return False
+    if not job_ids:
+        print("No running jobs.")
+        return True
+    job_list = background_jobs.wait(job_ids, timeout)
+    print(job_rows(job_list))
+    return all(job['status'] == background_jobs.SUCCEEDED for job in job_list)
+
+
+@jobs.command('cancel')
+@click.argument('job_ids', nargs=-1, required=True, type=click.INT)
+def cancel_jobs(job_ids: tuple) -> bool:
+    """
+    Cancels running background jobs, the commands they started (e.g. terraform) are stopped as well.
+
+    :param job_ids: the jobs to cancel
+    :return: True if every job was cancelled, False otherwise
+    """
+    result = True
+    for job_id in job_ids:
+        if background_jobs.cancel(job_id):
+            utils.log(f"Job {job_id} has been cancelled.")
+        else:
+            utils.log(f"Job {job_id} is not running.")
+            result = False
+    return result
+
+
+@jobs.command('supervise', hidden=True)
+@click.argument('job_id', type=click.INT)
+def supervise_job(job_id: int):
+    # The process started by a background job, it runs the command of the job and records its exit code
+    click.get_current_context().exit(background_jobs.supervise(job_id))
@@ -0,0 +1,74 @@
+import os
+import click
+import utils as utils
+import registry
+import logtail
+import constants as const
+
+
+@click.command()
+@click.option('--cluster', '-c', required=False, type=click.STRING, help='Only the lines of this cluster, in the log of its provider', metavar='<cluster_name>')
+@click.option('--provider', '-p', required=False, type=click.Choice([const.AWS_PROVIDER, const.AZURE_PROVIDER, const.GCP_PROVIDER]), help='Log of this provider, the generic log if not set', metavar='<provider>')
+@click.option('--follow', '-f', is_flag=True, default=False, help='Keep printing the new lines until interrupted')
+@click.option('--since', required=False, type=click.STRING, help='Only the lines written after a date and time (2024-05-01 10:00) or a duration ago (30s, 10m, 2h, 1d)', metavar='<time>')
+@click.option('--lines', '-n', type=click.IntRange(min=0), default=const.LOG_TAIL_LINES, show_default=True, help='Number of past lines to show when --since is not set')
+def logs(cluster: str, provider: str, follow: bool, since: str, lines: int) -> bool:
+    """
+    Shows the log of a provider or of a cluster, e.g. the terraform output of a cluster created without --wait.
+
+    :param cluster: the cluster whose lines are shown, its provider log is used
+    :param provider: the provider whose log is shown
+    :param follow: flag to keep printing the lines appended to the log
+    :param since: only the lines written after this time are shown
+    :param lines: how many past lines are shown when since is not set
+    :return: True if the log was shown, False otherwise
+    """
+    if cluster:
+        provider = provider or cluster_provider(cluster)
+        if not provider:
+            click.echo(f"Cluster {cluster} is not managed by the kubelab cli, please set its --provider.")
+            return False
+    try:
+        since = logtail.parse_since(since) if since else None
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--since')
+    keep = logtail.cluster_filter(cluster) if cluster else None
+    log_path = utils.provider_log_file(provider)
+    offset = None
+    if os.path.isfile(log_path):
+        with open(log_path, 'rb') as log_file:
+            past = past_lines(log_file, since, lines, keep)
+            offset = log_file.tell()
+        for line in past:
+            click.echo(logtail.format_line(line))
+    elif not follow:
+        click.echo(f"There is no log in {log_path} yet.")
+        return False
+    if follow:
+        follow_lines(log_path, offset, keep)
+    return True
+
+
+def cluster_provider(cluster: str):
+    # The provider recorded for a cluster, None when the cluster is not in the registry
+    cluster_info = registry.get_registry().get(cluster)
+    return cluster_info.get('provider') if cluster_info else None
+
+
+def past_lines(log_file, since, lines: int, keep) -> list:
+    # Both only read the end of the log, however big it is
+    if not since:
+        return logtail.last_lines(log_file, lines, keep)
+    logtail.seek_since(log_file, since)
+    past = (line.rstrip(b'\n').decode('utf-8', errors='replace') for line in log_file)
+    return [line for line in past if keep is None or keep(line)]
+
+
+def follow_lines(log_path: str, offset, keep):
+    # Prints the lines appended after offset until interrupted
+    try:
+        for line in logtail.follow(log_path, offset):
+            if keep is None or keep(line):
+                click.echo(logtail.format_line(line))
+    except KeyboardInterrupt:
+        pass
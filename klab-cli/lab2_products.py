@@ -0,0 +1,245 @@
+import functools
+import click
+import utils as utils
+import yamlio
+import registry
+import jsonlog
+import inventory
+import catalog
+import kubeapply
+import reconcile
+import scheduler
+from deploy import Deploy
+import constants as const
+import lab2
+
+
+def search_products(cluster_name: str, product=None) -> list:
+    # Find the products based on cluster_name
+    products = lab2.get_cluster_info(cluster_name).get('products') or []
+
+    if product is None:
+        # If product is not specified, return all products as an array
+        return products
+    else:
+        # If product is specified, find the matching product and return it as a single object
+        for entry in products:
+            if entry.get("name") == product:
+                return entry
+
+        # If no matching product is found, return None
+        return None
+
+
+def catalog_entry(name: str):
+    # The catalog entry of a product, logging the available ones when it is not there
+    products = catalog.load_catalog()
+    entry = products.get(name)
+    if entry is None:
+        utils.log(f"{name} is not in the catalog. Available products: {', '.join(products.names())}")
+    return entry
+
+
+def product_type(product: dict) -> str:
+    # The installation type of a spec product, the default one of the catalog when the spec does not set it
+    entry = catalog.load_catalog().get(product['name'])
+    return product.get('type') or (entry.default_type if entry else None)
+
+
+def product_deploy(entry: catalog.Product, product: dict) -> Deploy:
+    # The Deploy object of a spec product, its version is the image version of a deployment or the operator version
+    return Deploy(
+        productName=entry.product,
+        op_version=product.get('version') or entry.operatorVersion,
+        installed_type=product_type(product),
+        imageVersion=product.get('version') or entry.imageVersion,
+        deployment_type=entry.deploymentFile,
+        operatorImage=entry.operatorImage,
+        operatorRepo=entry.operatorRepo,
+        operatorDir=entry.operatorDir
+    )
+
+
+def install_product(product: dict) -> bool:
+    # Installs a product of a cluster spec in the current context, the spec type and version override the catalog defaults
+    entry = catalog_entry(product['name'])
+    if entry is None:
+        return False
+    install_type = product_type(product)
+    if not entry.supports(install_type):
+        utils.log(f"{entry.product} can not be installed as {install_type}. Available types: {', '.join(entry.available_types)}")
+        return False
+    deploy = product_deploy(entry, product)
+    if install_type == 'operator':
+        return deploy.operator(productName=entry.product, operatorRepo=entry.operatorRepo)
+    return deploy.deployment(entry.product, product.get('version') or entry.imageVersion, product.get('replicas'), product.get('port'))
+
+
+def uninstall_product(product: dict) -> bool:
+    # Removes a product from the current context the way it was installed
+    entry = catalog_entry(product['name'])
+    if entry is None:
+        return False
+    if product_type(product) == 'operator':
+        removed = product_deploy(entry, product).undeploy_operator(entry.product)
+    else:
+        removed = kubeapply.delete_manifest(entry.deploymentFile)
+    if removed:
+        catalog.set_installed(entry.product, None, None)
+    return removed
+
+
+def product_ready(product: dict) -> bool:
+    # Watches the objects of the product until they are ready, deployments by manifest and operators by namespace
+    entry = catalog.load_catalog().get(product['name'])
+    if product_type(product) == 'operator':
+        return kubeapply.wait_rollout(entry.operatorNamespace, const.ROLLOUT_TIMEOUT)
+    return kubeapply.wait_manifest(entry.deploymentFile, const.ROLLOUT_TIMEOUT)
+
+
+def apply_action(spec: dict, action: reconcile.Action, wait: bool) -> bool:
+    # Runs one action of a plan, the products are only touched once the cluster is ready
+    match action.kind:
+        case reconcile.CREATE:
+            return lab2.create_cluster(spec['name'], spec['provider'], spec['region'], spec['resource_group'], spec['project'], wait=True)
+        case reconcile.REMOVE:
+            return uninstall_product(action.product)
+        case reconcile.UPDATE if product_type(action.current) != product_type(action.product):
+            # Switching between deployment and operator, the old installation goes first
+            if not uninstall_product(action.current):
+                return False
+    installed = install_product(action.product)
+    return installed and (not wait or product_ready(action.product))
+
+
+def log_action_status(provider: str, action, status: str, elapsed: float):
+    # e.g. "Add nginx (operator 1.0.0): succeeded after 42s."
+    took = f" after {elapsed:.0f}s." if elapsed else "."
+    utils.log(f"{action.describe().capitalize()}: {status}{took}", provider)
+
+
+def record_products(cluster_name: str, products: list):
+    # Products are recorded in the cluster file without the fields the spec does not set
+    lab2.save_cluster_info(cluster_name, None, None, None, None, None,
+                           [{field: value for field, value in product.items() if value is not None} for product in products])
+
+
+def plan_spec(spec: dict, cluster_info, state: dict, refresh: bool) -> tuple:
+    """
+    Compares a spec with the recorded cluster, or with its cloud on refresh, and checks the products against the catalog.
+
+    :return: the actions to run, whether the cluster exists and the catalog dependencies of the products
+    :raises ValueError: when a product is not in the catalog, a dependency is missing or forms a cycle
+    """
+    exists = True
+    if refresh and cluster_info:
+        clusters, errors = inventory.live_clusters([spec['provider']], [cluster_info], {spec['name']: state}, refresh=True)
+        exists = any(cluster.get('name') == spec['name'] and cluster['status'] != inventory.ORPHANED for cluster in clusters)
+    products = catalog.load_catalog()
+    depends_on = products.dependencies()
+    reconcile.check_catalog(spec, products.names())
+    reconcile.check_dependencies(spec, depends_on)
+    actions = reconcile.plan(spec, cluster_info, exists)
+    # Cycles are found before anything runs
+    scheduler.order(reconcile.action_dependencies(actions, depends_on))
+    return actions, exists, depends_on
+
+
+@click.command()
+@click.option('--file', '-f', 'spec_file', required=True, type=click.Path(exists=True, dir_okay=False), help='Cluster spec, see clusters/cluster_sample.yaml', metavar='<file>')
+@click.option('--dry-run', is_flag=True, default=False, help='Only show the actions needed to reach the spec')
+@click.option('--refresh', is_flag=True, default=False, help='Compare with the clouds even if the spec was already applied, a cluster gone from its cloud is created again')
+@click.option('--wait', '-w', is_flag=True, default=False, help='Wait for every added or updated product to be ready')
+@click.option('--workers', type=click.IntRange(min=1), default=const.APPLY_WORKERS, show_default=True, help='Number of product actions run at the same time')
+def apply(spec_file: str, dry_run: bool, refresh: bool, wait: bool, workers: int) -> bool:
+    """
+    Brings a cluster to the state described by a spec file, creating it and adding, updating or removing its products.
+
+    Only the actions needed are run. The product ones run at the same time, each one once the products it depends on
+    (depends_on in the catalog) are in place, and the ones depending on a failed product are skipped.
+    Applying the same spec again does nothing.
+
+    :param spec_file: the cluster spec, with name, provider, region and the products
+    :param dry_run: flag to only show the plan
+    :param refresh: flag to check the cluster in its cloud instead of trusting the registry
+    :param wait: flag to wait for the products to be ready
+    :param workers: number of product actions run at the same time
+    :return: True if the cluster matches the spec, False otherwise
+    """
+    try:
+        spec = reconcile.load_spec(spec_file)
+    except (ValueError, yamlio.YAMLError) as e:
+        utils.log(f"Invalid cluster spec {spec_file}. {e}")
+        return False
+    cluster_name = spec['name']
+    provider = spec['provider']
+    store = registry.get_registry()
+    with jsonlog.bind(cluster=cluster_name, provider=provider):
+        # A spec that was already applied costs this single read
+        state = store.get_state(cluster_name)
+        if not refresh and reconcile.up_to_date(spec, state):
+            utils.log(f"Cluster {cluster_name} already matches {spec_file}, nothing to do.", provider)
+            return True
+        cluster_info = store.get(cluster_name)
+        try:
+            actions, exists, depends_on = plan_spec(spec, cluster_info, state, refresh)
+        except ValueError as e:
+            utils.log(str(e), provider)
+            return False
+        for action in actions:
+            utils.log(f"Plan: {action.describe()}", provider)
+        if dry_run:
+            return True
+        results = reconcile.execute(
+            actions,
+            lambda action: apply_action(spec, action, wait),
+            workers,
+            ready=lambda: lab2.switch_to_cluster(cluster_name, provider, spec['region'], spec['resource_group'], spec['project']),
+            on_status=functools.partial(log_action_status, provider),
+            depends_on=depends_on
+        )
+        if store.get(cluster_name) and any(action.kind != reconcile.CREATE for action in actions):
+            record_products(cluster_name, reconcile.applied_products(spec, cluster_info if exists else None, actions, results))
+        if len(results) < len(actions) or not all(results.values()):
+            utils.log(f"Cluster {cluster_name} does not match {spec_file} yet, apply it again once the failed actions are fixed.", provider)
+            return False
+        store.update_state(cluster_name, spec=reconcile.fingerprint(spec))
+        utils.log(f"Cluster {cluster_name} matches {spec_file}.", provider)
+        return True
+
+
+@click.command()
+@click.argument('product', type=click.Choice(['nginx', 'istio']))
+@click.option('--cluster', '-c', required=True, help='Name of the cluster to be used', metavar='<resource_name>')
+@click.option('--type', type=click.Choice(['operator', 'deployment']), required=False, default="deployment", help='Type of how to deploy operator')
+@click.option('--version', type=click.STRING, help="product version", required=False)
+@click.option('--yes', '-y', is_flag=True, help='Automatically answer "yes" to all prompts and proceed.')
+def add(cluster: str, type: str, product: str, version: str, yes: bool) -> bool:
+    """
+    Adds a product in the current cluster.
+
+    :param type: the installation type of the product to be added
+    :param product: the cloud native product to be added
+    :param version: the desired version of the product to be added
+    :param yes: flag to automatically answer "yes" to all prompts and proceed
+    """
+    utils.check_parameters(product=product)
+    cluster_info = lab2.get_cluster_info(cluster)
+    if not cluster_info:
+        return False
+    # Check if the product is already installed on the cluster
+    if search_products(cluster, product):
+        utils.log(f"Product {product} is already installed. Please use update to manage it.")
+        return False
+    missing = [dependency for dependency in catalog.load_catalog().dependencies().get(product, []) if not search_products(cluster, dependency)]
+    if missing:
+        utils.log(f"Product {product} depends on {', '.join(missing)}. Please add them first, or list them all in a spec for lab apply.")
+        return False
+    wanted = reconcile.product_spec({'name': product, 'type': type, 'version': version})
+    if not lab2.switch_to_cluster(cluster, cluster_info.get('provider'), cluster_info.get('region'), cluster_info.get('resource_group'), cluster_info.get('project')):
+        return False
+    if not apply_action(cluster_info, reconcile.Action(reconcile.ADD, wanted), wait=False):
+        return False
+    record_products(cluster, search_products(cluster) + [wanted])
+    utils.log(f"Product {product} has been added to cluster {cluster}.", cluster_info.get('provider'))
+    return True
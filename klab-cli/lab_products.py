@@ -0,0 +1,159 @@
+import subprocess
+import click
+import catalog
+import kubeapply
+from deploy import Deploy
+import constants as const
+
+
+def catalog_product(product):
+    # Looks the product up in the catalog, printing the available ones when it is not there
+    products = catalog.load_catalog()
+    entry = products.get(product)
+    if entry is None:
+        print(f"{product} is not in the catalog. Available products: {', '.join(products.names())}")
+    return entry
+
+
+def product_deploy(entry, install_type, image_version=None, op_version=None):
+    # Builds the Deploy object of a catalog product, versions default to the catalog ones
+    return Deploy(
+        productName=entry.product,
+        op_version=op_version or entry.operatorVersion,
+        installed_type=install_type,
+        imageVersion=image_version or entry.imageVersion,
+        deployment_type=entry.deploymentFile,
+        operatorImage=entry.operatorImage,
+        operatorRepo=entry.operatorRepo,
+        operatorDir=entry.operatorDir
+    )
+
+
+def wait_ready(entry, install_type, timeout):
+    # Watches the objects of the product until they are ready, deployments by manifest and operators by namespace
+    print(f"Waiting up to {timeout}s for {entry.product} to be ready")
+    if install_type == 'operator':
+        return kubeapply.wait_rollout(entry.operatorNamespace, timeout)
+    return kubeapply.wait_manifest(entry.deploymentFile, timeout)
+
+
+@click.command()
+@click.option('--type', type=click.Choice(['operator', 'deployment']), required=False, default="deployment", help='Type of how to deploy operator')
+@click.argument('product', type=click.STRING)
+@click.option('--version', type=click.STRING, help="product version", required=False)
+@click.option('--yes', '-y', is_flag=True, help='Automatically answer "yes" to all prompts and proceed.')
+@click.option('--wait', is_flag=True, help='Wait until the product is rolled out and its load balancer has an address.')
+@click.option('--timeout', type=click.INT, default=const.ROLLOUT_TIMEOUT, show_default=True, help='Seconds to wait with --wait.')
+def add(type, product, version, yes, wait, timeout):
+    """
+    Adds a product in the current cluster.
+
+    :param type: the installation type of the product to be added
+    :param product: the cloud native product to be added
+    :param version: the desired version of the product to be added
+    :param yes: flag to automatically answer "yes" to all prompts and proceed
+    :param wait: flag to return only when the product is ready
+    :param timeout: seconds to wait for the product to be ready
+    """
+    entry = catalog_product(product)
+    if entry is None:
+        return
+    if entry.installed_type == "deployment":
+        type = 'operator'
+        deploy = product_deploy(entry, type)
+        if yes:
+            deploy.switch_operator(productName=product, autoApprove='yes')
+        else:
+            deploy.switch_operator(productName=product, autoApprove='no')
+    if entry.installed_type == "operator":
+        type = 'deployment'
+        deploy = product_deploy(entry, type)
+        if yes:
+            deploy.switch_deployment(productName=product, autoApprove='yes')
+        else:
+            deploy.switch_deployment(productName=product, autoApprove='no')
+    if not entry.supports(type):
+        print(f"{product} can not be installed as {type}. Available types: {', '.join(entry.available_types)}")
+        return
+    if type == 'operator':
+        deploy = product_deploy(entry, type)
+        installed = deploy.operator(productName=product, operatorRepo=entry.operatorRepo)
+    if type == 'deployment':
+        deploy = product_deploy(entry, type, image_version=version)
+        installed = deploy.deployment(productName=product, imageVersion=version or entry.imageVersion)
+    if wait and not (installed and wait_ready(entry, type, timeout)):
+        click.get_current_context().exit(1)
+
+
+@click.command()
+@click.option('--type', type=click.Choice(['operator', 'deployment']), help='Type of how to deploy operator')
+@click.argument('product', type=click.STRING)
+@click.option('--version', type=click.STRING, default='1.4.1', help="Operator version", required=False)
+@click.option('--wait', is_flag=True, help='Wait until the new version is rolled out.')
+@click.option('--timeout', type=click.INT, default=const.ROLLOUT_TIMEOUT, show_default=True, help='Seconds to wait with --wait.')
+def update(type, product, version, wait, timeout):
+    """
+    Updates a product in the current cluster.
+
+    :param type: the installation type of the product to be updated
+    :param product: the cloud native product to be updated
+    :param version: the new desired version of the product to be updated
+    :param wait: flag to return only when the new version is rolled out
+    :param timeout: seconds to wait for the rollout
+    """
+    entry = catalog_product(product)
+    if entry is None:
+        return
+    if type == 'operator':
+        print(f'Upadating {product} with latest version ({version})')
+        # Update the Operator, from the bundle cache when this version was rendered before
+        deploy = product_deploy(entry, type, op_version=version)
+        if not deploy.operator(productName=product, operatorRepo=entry.operatorRepo):
+            click.get_current_context().exit(1)
+        subprocess.run(['kubectl', 'get', 'deployments', '-n', entry.operatorNamespace])
+
+        print(f'{product} operator updated successfully with {version} version')
+        if wait and not wait_ready(entry, type, timeout):
+            click.get_current_context().exit(1)
+    elif type == 'deployment':
+        if not entry.installed:
+            print("Deployment is not installed")
+        print(f"Updating the deployment to version: {version}")
+        deploy = product_deploy(entry, type, image_version=version, op_version=version)
+        updated = deploy.deployment(productName=product, imageVersion=version)
+
+        print(f"Deployment is updated to {version}")
+        if wait and not (updated and wait_ready(entry, type, timeout)):
+            click.get_current_context().exit(1)
+
+    else:
+        print('Invalid configuration.')
+
+
+@click.command()
+@click.option('--type', 'install_type', type=click.Choice(['operator', 'deployment']), help='Installation type of the product')
+@click.argument('product', type=click.STRING)
+def remove(install_type, product):
+    """
+    Deletes a product in the current cluster.
+
+    :param install_type: the installation type of the product to be deleted
+    :param product: the product to be deleted
+    """
+    entry = catalog_product(product)
+    if entry is None:
+        return
+    if install_type == 'operator':
+        print(f'Deleting {product} with {entry.imageVersion} version')
+        # Delete the deployed operator, the objects of the bundle it was installed from
+        if product_deploy(entry, install_type, op_version=entry.installed_version).undeploy_operator(product):
+            catalog.set_installed(product, None, None)
+            print(f'{product} operator deleted successfully with {entry.imageVersion} version')
+    elif install_type == 'deployment':
+        deploy_file = entry.deploymentFile
+        deploy_version = entry.imageVersion
+        print(f"Deleting {product} deployment with {deploy_version} image version")
+        if kubeapply.delete_manifest(deploy_file):
+            catalog.set_installed(product, None, None)
+    else:
+        print('Invalid configuration.')
@@ -0,0 +1,256 @@
+import ctypes
+import json
+import os
+import re
+import select
+import sys
+import time
+from datetime import datetime, timedelta
+import constants as const
+
+# Timestamp at the start of a log line: the JSON lines ({"ts": "2024-05-01T10:00:00.123", ...) and the older
+# plain ones ([2024-05-01 10:00:00] ...)
+TIMESTAMP = re.compile(rb'^(?:\{"ts": "|\[)(\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2})')
+DURATION = re.compile(r'^(\d+)([smhd])$')
+DURATION_UNITS = {'s': 'seconds', 'm': 'minutes', 'h': 'hours', 'd': 'days'}
+
+# inotify(7) events of the log directory that can mean new lines: a write, or a new file after a rotation
+IN_MODIFY = 0x2
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+
+
+def line_time(line: bytes):
+    # 'YYYY-MM-DD HH:MM:SS' of a line, None when it does not start with a timestamp
+    match = TIMESTAMP.match(line)
+    return match.group(1).decode().replace('T', ' ') if match else None
+
+
+def parse_since(value: str, now=None) -> str:
+    """
+    Converts the value of --since into the timestamp the lines are compared with.
+
+    :param value: a duration back from now (30s, 10m, 2h, 1d) or a date and time (2024-05-01, 2024-05-01 10:00)
+    :param now: the current time, for the durations
+    :return: 'YYYY-MM-DD HH:MM:SS'
+    """
+    match = DURATION.match(value.strip())
+    if match:
+        since = (now or datetime.now()) - timedelta(**{DURATION_UNITS[match.group(2)]: int(match.group(1))})
+    else:
+        try:
+            since = datetime.fromisoformat(value.strip())
+        except ValueError:
+            raise ValueError(f"'{value}' is neither a duration (e.g. 10m, 2h) nor a date and time (e.g. 2024-05-01 10:00)")
+    return since.isoformat(sep=' ', timespec='seconds')
+
+
+def next_timestamp(log_file, offset: int) -> tuple:
+    # Start and timestamp of the first timestamped line beginning at or after offset, (end of file, None) if there is none
+    if offset > 0:
+        # Finishes the line offset falls into, unless offset is already the start of a line
+        log_file.seek(offset - 1)
+        log_file.readline()
+    else:
+        log_file.seek(0)
+    while True:
+        position = log_file.tell()
+        line = log_file.readline()
+        if not line:
+            return position, None
+        timestamp = line_time(line)
+        if timestamp:
+            return position, timestamp
+
+
+def seek_since(log_file, since: str) -> int:
+    """
+    Moves a log file opened in binary mode to its first line written at or after since.
+
+    The lines are in time order, so the line is found by bisecting the byte offsets: a few dozen reads even for a
+    log of hundreds of MB.
+
+    :param log_file: the open log file
+    :param since: 'YYYY-MM-DD HH:MM:SS', see parse_since
+    :return: the offset of the line, the size of the file if every line is older
+    """
+    low, high = 0, os.fstat(log_file.fileno()).st_size
+    while low < high:
+        middle = (low + high) // 2
+        position, timestamp = next_timestamp(log_file, middle)
+        if timestamp is None or timestamp >= since:
+            high = middle
+        else:
+            low = position + 1
+    position = next_timestamp(log_file, low)[0]
+    log_file.seek(position)
+    return position
+
+
+def last_lines(log_file, count: int, keep=None) -> list:
+    """
+    Reads the last lines of a log file opened in binary mode, block by block from the end.
+
+    :param log_file: the open log file
+    :param count: how many lines
+    :param keep: only the lines for which keep(line) is true are counted, e.g. the ones of a cluster
+    :return: the lines, oldest first
+    """
+    end = os.fstat(log_file.fileno()).st_size
+    position = end
+    lines = []
+    rest = b''
+    while position > 0 and len(lines) < count:
+        step = min(const.LOG_TAIL_BLOCK, position)
+        position -= step
+        log_file.seek(position)
+        block = log_file.read(step) + rest
+        parts = block.split(b'\n')
+        # The first part can be the end of a line that starts in the previous block
+        rest = parts.pop(0) if position > 0 else b''
+        for line in reversed(parts):
+            if line and (keep is None or keep(line)):
+                lines.append(line)
+                if len(lines) == count:
+                    break
+    log_file.seek(end)
+    return [line.decode('utf-8', errors='replace') for line in reversed(lines)]
+
+
+class PollingWatcher:
+    # Checks the file again after a fixed interval
+    def __init__(self, interval=const.LOG_FOLLOW_INTERVAL):
+        self.interval = interval
+
+    def wait(self):
+        time.sleep(self.interval)
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    # Sleeps until a file of the directory changes (Linux only), new lines show up without polling
+    def __init__(self, directory: str, timeout=const.LOG_FOLLOW_INTERVAL):
+        self.timeout = timeout
+        libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), IN_MODIFY | IN_MOVED_TO | IN_CREATE) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f'cannot watch {directory}')
+
+    def wait(self):
+        # The timeout still wakes it up regularly, e.g. for the files on network filesystems that send no events
+        ready, _, _ = select.select([self.fd], [], [], self.timeout)
+        if ready:
+            try:
+                # The events are not looked at, the file is simply read again
+                while os.read(self.fd, 64 * 1024):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        os.close(self.fd)
+
+
+def get_watcher(directory: str):
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(directory)
+        except (OSError, AttributeError):
+            # e.g. the inotify watches of the user are exhausted
+            pass
+    return PollingWatcher()
+
+
+def follow(path: str, offset=None, stop=None, watcher=None):
+    """
+    Yields the lines appended to a log file, like tail -f.
+
+    It keeps going when the file is rotated (it reads what is left of the old file, then the new one from the start)
+    and waits for the file when it does not exist yet.
+
+    :param path: the log file
+    :param offset: where to start, None for the current end of the file
+    :param stop: threading.Event that ends the generator
+    :param watcher: what waits for changes, get_watcher(<dir of path>) by default
+    """
+    watcher = watcher or get_watcher(os.path.dirname(os.path.abspath(path)))
+    log_file = None
+    partial = b''
+    try:
+        while stop is None or not stop.is_set():
+            if log_file is None:
+                try:
+                    log_file = open(path, 'rb')
+                except FileNotFoundError:
+                    # Everything written once it shows up is new
+                    offset = 0
+                    watcher.wait()
+                    continue
+                if offset is None:
+                    log_file.seek(0, os.SEEK_END)
+                else:
+                    log_file.seek(offset)
+                # A file reopened after a rotation is read from the start
+                offset = 0
+            chunk = log_file.readline()
+            if chunk:
+                partial += chunk
+                if partial.endswith(b'\n'):
+                    yield partial.rstrip(b'\n').decode('utf-8', errors='replace')
+                    partial = b''
+                continue
+            if rotated(path, log_file):
+                log_file.close()
+                log_file = None
+                continue
+            watcher.wait()
+    finally:
+        if log_file is not None:
+            log_file.close()
+        watcher.close()
+
+
+def rotated(path: str, log_file) -> bool:
+    # The path is now another file (renamed away by the rotation) or the file was truncated
+    try:
+        current = os.stat(path)
+    except FileNotFoundError:
+        return False
+    return current.st_ino != os.fstat(log_file.fileno()).st_ino or current.st_size < log_file.tell()
+
+
+def format_line(line: str) -> str:
+    # '[2024-05-01 10:00:00] [cluster] command: message', the lines that are not JSON are shown as they are
+    try:
+        record = json.loads(line)
+        text = f"[{record['ts'][:19].replace('T', ' ')}] "
+    except (ValueError, TypeError, KeyError):
+        return line
+    if record.get('level', 'INFO') != 'INFO':
+        text += f"{record['level']} "
+    if record.get('cluster'):
+        text += f"[{record['cluster']}] "
+    if record.get('command'):
+        text += f"{record['command']}: "
+    return text + str(record.get('message', ''))
+
+
+def cluster_filter(cluster: str):
+    # keep() of the lines of one cluster, a cheap substring test first so most lines are never parsed
+    needle = json.dumps(cluster).encode()
+
+    def keep(line) -> bool:
+        if isinstance(line, str):
+            line = line.encode()
+        if needle not in line:
+            return False
+        try:
+            return json.loads(line).get('cluster') == cluster
+        except ValueError:
+            return False
+    return keep
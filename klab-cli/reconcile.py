@@ -0,0 +1,221 @@
+import contextvars
+import functools
+import hashlib
+import json
+import time
+import scheduler
+import utils as utils
+import yamlio
+import constants as const
+
+# Kinds of action of a plan, the cluster is created before any product is touched
+CREATE = 'create'
+ADD = 'add'
+UPDATE = 'update'
+REMOVE = 'remove'
+
+# The fields of a product set by the spec, a change to any of them updates the product
+PRODUCT_FIELDS = ('name', 'type', 'version', 'replicas', 'port')
+PROVIDERS = (const.AWS_PROVIDER, const.AZURE_PROVIDER, const.GCP_PROVIDER)
+
+
+class Action:
+    # One step of a plan: the cluster to create, or a product of the spec to add, update or remove
+    def __init__(self, kind: str, product=None, current=None):
+        self.kind = kind
+        # The product as the spec wants it (as it is recorded for a removal)
+        self.product = product
+        # The product as it is recorded, for an update
+        self.current = current
+
+    @property
+    def name(self) -> str:
+        return self.product['name'] if self.product else None
+
+    def describe(self) -> str:
+        if self.kind == CREATE:
+            return "create cluster"
+        details = ' '.join(str(self.product[field]) for field in ('type', 'version') if self.product.get(field))
+        return f"{self.kind} {self.name}" + (f" ({details})" if details else '')
+
+    def __repr__(self) -> str:
+        return f"Action({self.kind!r}, {self.name!r})"
+
+
+def product_spec(product) -> dict:
+    # The fields of a product entry that matter. Versions are strings, an unquoted 1.20 in the spec is the number 1.2
+    if not isinstance(product, dict) or not product.get('name'):
+        raise ValueError(f"Every product needs a name, got {product!r}.")
+    spec = {'name': str(product['name']), 'type': product.get('type')}
+    spec['version'] = None if product.get('version') is None else str(product['version'])
+    for field in ('replicas', 'port'):
+        try:
+            spec[field] = None if product.get(field) is None else int(product[field])
+        except (TypeError, ValueError):
+            raise ValueError(f"The {field} of product {spec['name']} must be a number, got {product[field]!r}.")
+    return spec
+
+
+def parse_spec(data) -> dict:
+    """
+    Validates a cluster spec, the shape of clusters/cluster_sample.yaml.
+
+    :param data: the parsed spec file
+    :return: the spec with every field set (None when missing) and its products in a list
+    :raises ValueError: when a required field is missing or has the wrong type
+    """
+    if not isinstance(data, dict):
+        raise ValueError("The spec must be a mapping with at least name, provider and region.")
+    for field in ('name', 'provider', 'region'):
+        if not data.get(field):
+            raise ValueError(f"The spec has no {field}.")
+    # Providers are matched regardless of case, e.g. aws is AWS
+    provider = next((provider for provider in PROVIDERS if provider.lower() == str(data['provider']).lower()), None)
+    if provider is None:
+        raise ValueError(f"Unsupported provider {data['provider']}, it must be one of {', '.join(PROVIDERS)}.")
+    products = [product_spec(product) for product in data.get('products') or []]
+    names = [product['name'] for product in products]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Products listed more than once: {', '.join(duplicates)}.")
+    spec = {field: data.get(field) for field in ('name', 'provider', 'region', 'resource_group', 'project', 'credential_file')}
+    spec['provider'] = provider
+    spec['products'] = products
+    return spec
+
+
+def load_spec(path: str) -> dict:
+    return parse_spec(yamlio.load(path))
+
+
+def fingerprint(spec: dict) -> str:
+    # Stored in the registry state of the cluster once the spec is applied, the same spec again has nothing to do
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()
+
+
+def up_to_date(spec: dict, state: dict) -> bool:
+    return state.get('spec') == fingerprint(spec)
+
+
+def plan(spec: dict, cluster_info, exists=True) -> list:
+    """
+    The minimal list of actions that brings the recorded cluster to the spec.
+
+    :param spec: the desired cluster, see parse_spec
+    :param cluster_info: the cluster as it is recorded in the registry, None if it is not
+    :param exists: False when the cluster is recorded but gone from the cloud, it is created again with all its products
+    :return: the actions, the cluster creation (if any) first and then the products in the order of the spec
+    :raises ValueError: when the recorded cluster lives in another provider or region, clusters are never moved
+    """
+    actions = []
+    recorded = {}
+    if cluster_info:
+        for field in ('provider', 'region'):
+            if cluster_info.get(field) != spec[field]:
+                raise ValueError(f"Cluster {spec['name']} already exists in {cluster_info.get('provider')} {cluster_info.get('region')}, "
+                                 f"the spec asks for {spec['provider']} {spec['region']}. Clusters cannot be moved.")
+        if exists:
+            recorded = {product['name']: product_spec(product) for product in cluster_info.get('products') or []}
+    if not cluster_info or not exists:
+        actions.append(Action(CREATE))
+    for product in spec['products']:
+        current = recorded.pop(product['name'], None)
+        if current is None:
+            actions.append(Action(ADD, product))
+        elif any(current.get(field) != product.get(field) for field in PRODUCT_FIELDS):
+            actions.append(Action(UPDATE, product, current))
+    actions += [Action(REMOVE, product) for product in recorded.values()]
+    return actions
+
+
+def check_catalog(spec: dict, names) -> None:
+    # Every product of the spec has to be in the catalog, checked before the cluster or any product is touched
+    unknown = [product['name'] for product in spec['products'] if product['name'] not in names]
+    if unknown:
+        raise ValueError(f"Products not in the catalog: {', '.join(unknown)}. Add them to {const.CATALOG_FILE} or remove them from the spec.")
+
+
+def check_dependencies(spec: dict, depends_on: dict):
+    # Every product the spec installs needs the products it depends on in the same spec
+    names = {product['name'] for product in spec['products']}
+    for product in spec['products']:
+        missing = sorted(set(depends_on.get(product['name'], ())) - names)
+        if missing:
+            raise ValueError(f"{product['name']} depends on {', '.join(missing)}, add it to the spec.")
+
+
+def action_dependencies(actions: list, depends_on: dict) -> dict:
+    # The product actions each one waits for: a product is installed after its dependencies, and removed before them
+    planned = {action.name: action for action in actions if action.kind != CREATE}
+    dependencies = {}
+    for name, action in planned.items():
+        if action.kind == REMOVE:
+            dependencies[name] = {other for other, other_action in planned.items()
+                                  if other_action.kind == REMOVE and name in depends_on.get(other, ())}
+        else:
+            dependencies[name] = {dependency for dependency in depends_on.get(name, ())
+                                  if dependency in planned and planned[dependency].kind != REMOVE}
+    return dependencies
+
+
+def run_action(run, action: Action, context: contextvars.Context) -> bool:
+    # A failing action is reported as failed instead of aborting the others
+    try:
+        return bool(context.run(run, action))
+    except Exception as e:
+        utils.log(f"Could not {action.describe()}. {e}")
+        return False
+
+
+def execute(actions: list, run, workers=const.APPLY_WORKERS, ready=None, on_status=None, depends_on=None) -> dict:
+    """
+    Runs a plan: the cluster creation first, then the product actions on a worker pool, each one once its dependencies are done.
+
+    :param actions: the plan, see plan
+    :param run: called with each action, returns True when it succeeded
+    :param workers: number of product actions run at once
+    :param ready: called once the cluster exists and before the product actions, returns False when they cannot run
+    :param on_status: called with each action, its new status (see scheduler) and the seconds it took
+    :param depends_on: the products each product depends on, from the catalog
+    :return: the outcome of every action that ran, the ones skipped because the cluster or a dependency failed are left out
+    :raises ValueError: when the dependencies of the products form a cycle, nothing is run then
+    """
+    results = {}
+    products = {action.name: action for action in actions if action.kind != CREATE}
+    dependencies = action_dependencies(actions, depends_on or {})
+    scheduler.order(dependencies)
+    for action in actions:
+        if action.kind == CREATE:
+            if on_status:
+                on_status(action, scheduler.RUNNING, 0.0)
+            start = time.monotonic()
+            results[action] = run_action(run, action, contextvars.copy_context())
+            if on_status:
+                on_status(action, scheduler.SUCCEEDED if results[action] else scheduler.FAILED, time.monotonic() - start)
+            if not results[action]:
+                return results
+    if not products or (ready is not None and not ready()):
+        return results
+    statuses = scheduler.run(
+        {name: functools.partial(run, action) for name, action in products.items()},
+        dependencies,
+        workers,
+        on_status=(lambda name, status, elapsed: on_status(products[name], status, elapsed)) if on_status else None
+    )
+    results.update((products[name], status == scheduler.SUCCEEDED) for name, status in statuses.items() if status != scheduler.SKIPPED)
+    return results
+
+
+def applied_products(spec: dict, cluster_info, actions: list, results: dict) -> list:
+    # The products to record once a plan ran: the spec ones that are in place, and the recorded ones whose action failed or did not run
+    recorded = {product['name']: product for product in (cluster_info or {}).get('products') or []}
+    outcome = {action.name: (action.kind, results.get(action, False)) for action in actions if action.kind != CREATE}
+    products = []
+    for product in spec['products']:
+        kind, ok = outcome.get(product['name'], (None, True))
+        if ok:
+            products.append(product)
+        elif kind == UPDATE:
+            products.append(recorded[product['name']])
+    products += [recorded[name] for name, (kind, ok) in outcome.items() if kind == REMOVE and not ok]
+    return products
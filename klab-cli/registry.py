@@ -0,0 +1,203 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import yamlio
+import constants as const
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS clusters (
+    name TEXT PRIMARY KEY,
+    provider TEXT,
+    region TEXT,
+    file TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    info TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS clusters_by_provider ON clusters (provider, region);
+CREATE INDEX IF NOT EXISTS clusters_by_region ON clusters (region);
+CREATE UNIQUE INDEX IF NOT EXISTS clusters_by_file ON clusters (file);
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    cluster TEXT,
+    argv TEXT NOT NULL,
+    pid INTEGER,
+    log_file TEXT,
+    started REAL NOT NULL,
+    finished REAL,
+    status TEXT NOT NULL,
+    exit_code INTEGER
+);
+"""
+
+registries = {}
+registries_lock = threading.Lock()
+
+
+def cluster_file_name(name: str) -> str:
+    return f"{name}{const.CLUSTER_FILE_SUFFIX}"
+
+
+class ClusterRegistry:
+    """
+    Index of the clusters managed by the kubelab cli, kept in a single SQLite file next to the cluster files.
+
+    The <name>_cluster.yaml files stay the documents users read and edit, the registry indexes them by name,
+    provider and region and only re-parses a file when its mtime or size changed, so lookups never have to
+    scan and parse the whole clusters directory. It also keeps registry-only state for each cluster
+    (e.g. cached data that does not belong in the cluster file) and the background jobs started by create and destroy.
+    """
+
+    def __init__(self, clusters_dir: str):
+        self.clusters_dir = clusters_dir
+        os.makedirs(clusters_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(clusters_dir, const.REGISTRY_FILE), timeout=30, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self.lock, self.db:
+            self.db.executescript(SCHEMA)
+
+    def load_file(self, file: str, stat: os.stat_result):
+        # Parses a single cluster file and (re)indexes it, existing registry state is preserved
+        info = yamlio.load(os.path.join(self.clusters_dir, file))
+        if not isinstance(info, dict):
+            self.db.execute("DELETE FROM clusters WHERE file = ?", (file,))
+            return None
+        name = info.get('name') or file[:-len(const.CLUSTER_FILE_SUFFIX)]
+        self.db.execute("DELETE FROM clusters WHERE file = ? AND name != ?", (file, name))
+        self.db.execute(
+            """INSERT INTO clusters (name, provider, region, file, mtime_ns, size, info) VALUES (?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT (name) DO UPDATE SET provider = excluded.provider, region = excluded.region, file = excluded.file,
+               mtime_ns = excluded.mtime_ns, size = excluded.size, info = excluded.info""",
+            (name, info.get('provider'), info.get('region'), file, stat.st_mtime_ns, stat.st_size, json.dumps(info))
+        )
+        return info
+
+    def sync(self):
+        # Brings the index up to date with the directory, only changed files are parsed again (stat only for the rest)
+        with self.lock, self.db:
+            indexed = {row['file']: (row['mtime_ns'], row['size']) for row in self.db.execute("SELECT file, mtime_ns, size FROM clusters")}
+            seen = set()
+            for entry in os.scandir(self.clusters_dir):
+                if not entry.name.endswith(const.CLUSTER_FILE_SUFFIX) or not entry.is_file():
+                    continue
+                seen.add(entry.name)
+                stat = entry.stat()
+                if indexed.get(entry.name) != (stat.st_mtime_ns, stat.st_size):
+                    self.load_file(entry.name, stat)
+            for file in indexed.keys() - seen:
+                self.db.execute("DELETE FROM clusters WHERE file = ?", (file,))
+
+    def get(self, name: str):
+        # O(1) lookup: a primary key read plus a stat of the cluster file to check that the entry is still fresh
+        file = cluster_file_name(name)
+        with self.lock, self.db:
+            row = self.db.execute("SELECT file, mtime_ns, size, info FROM clusters WHERE name = ?", (name,)).fetchone()
+            if row is not None:
+                file = row['file']
+            try:
+                stat = os.stat(os.path.join(self.clusters_dir, file))
+            except FileNotFoundError:
+                self.db.execute("DELETE FROM clusters WHERE name = ?", (name,))
+                return None
+            if row is not None and (row['mtime_ns'], row['size']) == (stat.st_mtime_ns, stat.st_size):
+                return json.loads(row['info'])
+            return self.load_file(file, stat)
+
+    def search(self, name=None, provider=None, region=None) -> list:
+        # Every filter is optional, the name accepts glob patterns
+        self.sync()
+        query = "SELECT info FROM clusters WHERE 1 = 1"
+        params = []
+        if name is not None:
+            query += " AND name GLOB ?"
+            params.append(name)
+        if provider is not None:
+            query += " AND provider = ?"
+            params.append(provider)
+        if region is not None:
+            query += " AND region = ?"
+            params.append(region)
+        with self.lock:
+            return [json.loads(row['info']) for row in self.db.execute(query + " ORDER BY name", params)]
+
+    def save(self, info: dict) -> str:
+        # Writes the cluster file and indexes it in the same step
+        file = cluster_file_name(info['name'])
+        path = os.path.join(self.clusters_dir, file)
+        yamlio.dump(info, path, default_flow_style=False)
+        with self.lock, self.db:
+            self.load_file(file, os.stat(path))
+        return path
+
+    def remove(self, name: str) -> bool:
+        with self.lock, self.db:
+            row = self.db.execute("SELECT file FROM clusters WHERE name = ?", (name,)).fetchone()
+            self.db.execute("DELETE FROM clusters WHERE name = ?", (name,))
+        file = row['file'] if row is not None else cluster_file_name(name)
+        try:
+            os.remove(os.path.join(self.clusters_dir, file))
+        except FileNotFoundError:
+            return row is not None
+        return True
+
+    def get_state(self, name: str) -> dict:
+        with self.lock:
+            row = self.db.execute("SELECT state FROM clusters WHERE name = ?", (name,)).fetchone()
+        return json.loads(row['state']) if row is not None else {}
+
+    def update_state(self, name: str, **fields) -> bool:
+        # Merges registry-only fields into the cluster entry, None values are removed
+        if self.get(name) is None:
+            return False
+        with self.lock, self.db:
+            row = self.db.execute("SELECT state FROM clusters WHERE name = ?", (name,)).fetchone()
+            state = json.loads(row['state'])
+            state.update(fields)
+            state = {key: value for key, value in state.items() if value is not None}
+            self.db.execute("UPDATE clusters SET state = ? WHERE name = ?", (json.dumps(state), name))
+        return True
+
+    def add_job(self, kind: str, cluster: str, argv: list, status: str) -> int:
+        with self.lock, self.db:
+            return self.db.execute("INSERT INTO jobs (kind, cluster, argv, started, status) VALUES (?, ?, ?, ?, ?)",
+                                   (kind, cluster, json.dumps(argv), time.time(), status)).lastrowid
+
+    def get_job(self, job_id: int):
+        with self.lock:
+            row = self.db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return job_dict(row) if row is not None else None
+
+    def jobs(self, status=None) -> list:
+        query = "SELECT * FROM jobs" + (" WHERE status = ?" if status else "") + " ORDER BY id"
+        with self.lock:
+            return [job_dict(row) for row in self.db.execute(query, (status,) if status else ())]
+
+    def update_job(self, job_id: int, only_if=None, **fields) -> bool:
+        # only_if is the status the job must still have, so e.g. a job cancelled meanwhile is not marked failed
+        query = f"UPDATE jobs SET {', '.join(f'{key} = ?' for key in fields)} WHERE id = ?"
+        params = [*fields.values(), job_id]
+        if only_if is not None:
+            query += " AND status = ?"
+            params.append(only_if)
+        with self.lock, self.db:
+            return self.db.execute(query, params).rowcount == 1
+
+
+def job_dict(row: sqlite3.Row) -> dict:
+    job = dict(row)
+    job['argv'] = json.loads(job['argv'])
+    return job
+
+
+def get_registry(clusters_dir=const.CLUSTERS_DIR) -> ClusterRegistry:
+    # One registry per clusters directory and process, existing cluster files are indexed lazily on the first get/search
+    key = os.path.abspath(clusters_dir)
+    with registries_lock:
+        if key not in registries:
+            registries[key] = ClusterRegistry(clusters_dir)
+        return registries[key]
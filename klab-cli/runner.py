@@ -0,0 +1,212 @@
+import contextvars
+import logging
+import os
+import signal
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import jsonlog
+import constants as const
+
+# Number of runs, total and slowest seconds per program and subcommand, added up as the commands finish
+stats = {}
+stats_lock = threading.Lock()
+
+
+def command_name(argv: list) -> str:
+    # The program and its subcommand, e.g. "terraform init"
+    return ' '.join(arg for arg in argv[:2] if not arg.startswith('-'))
+
+
+class LogSink:
+    # Log file of one command, every line is queued as a JSON record with the command and the fields of the job
+    def __init__(self, path: str, fields: dict):
+        self.path = os.path.abspath(path)
+        self.fields = fields
+
+    def write(self, line: str, level=logging.INFO):
+        jsonlog.write(self.path, line, level, **self.fields)
+
+
+def get_sink(path, argv: list):
+    if path is None:
+        return None
+    # The output is read by other threads, the job fields (e.g. the cluster) are taken from the thread starting the command
+    return LogSink(path, {**jsonlog.context.get(), 'command': command_name(argv)})
+
+
+class CommandResult:
+    # Outcome of a finished command, with both output streams captured as text
+    def __init__(self, argv: list, returncode: int, stdout: str, stderr: str, elapsed: float, reason='exited'):
+        self.argv = argv
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.elapsed = elapsed
+        # One of 'exited', 'timeout', 'cancelled' or 'not found' (the executable does not exist)
+        self.reason = reason
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0
+
+    @property
+    def command(self) -> str:
+        return subprocess.list2cmdline(self.argv)
+
+    def check(self):
+        # Raises CalledProcessError like subprocess.run(check=True) does, returns the result otherwise
+        if not self.ok:
+            raise subprocess.CalledProcessError(self.returncode, self.argv, self.stdout, self.stderr)
+        return self
+
+    def __bool__(self) -> bool:
+        return self.ok
+
+    def __repr__(self) -> str:
+        return f"CommandResult({self.command!r}, returncode={self.returncode}, elapsed={self.elapsed:.2f}s, {self.reason})"
+
+
+class RunningCommand:
+    """
+    A command started without a shell, whose stdout and stderr are read through pipes.
+
+    Every line is kept in memory and copied to the log file as soon as it is printed, so long commands
+    (e.g. terraform apply) can be followed in the provider log while they run.
+
+    :param argv: the program and its arguments
+    :param log_file: log file the output is copied to, None to only capture it
+    :param cwd: working directory of the command
+    :param env: extra environment variables, merged into the current environment
+    :param timeout: seconds after which the command is killed, None means no limit
+    :param cancel_event: threading.Event that kills the command as soon as it is set
+    """
+
+    def __init__(self, argv: list, log_file=None, cwd=None, env=None, timeout=None, cancel_event=None):
+        self.argv = [str(arg) for arg in argv]
+        self.sink = get_sink(log_file, self.argv)
+        self.timeout = timeout
+        self.cancel_event = cancel_event
+        self.start = time.monotonic()
+        self.stdout = []
+        self.stderr = []
+        self.readers = []
+        self.result = None
+        if self.sink:
+            self.sink.write(f"$ {subprocess.list2cmdline(self.argv)}" + (f" (in {cwd})" if cwd else ''))
+        try:
+            self.process = subprocess.Popen(
+                self.argv,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                cwd=cwd,
+                env={**os.environ, **env} if env else None,
+                # Own process group, so a timeout also stops the children (e.g. the terraform providers)
+                start_new_session=os.name == 'posix'
+            )
+        except (FileNotFoundError, PermissionError) as e:
+            self.process = None
+            self.finish(127, 'not found', str(e))
+            return
+        for stream, lines in ((self.process.stdout, self.stdout), (self.process.stderr, self.stderr)):
+            reader = threading.Thread(target=self.tee, args=(stream, lines), daemon=True)
+            reader.start()
+            self.readers.append(reader)
+
+    def tee(self, stream, lines: list):
+        for line in stream:
+            lines.append(line)
+            if self.sink:
+                self.sink.write(line.rstrip('\n'))
+        stream.close()
+
+    def kill(self):
+        if os.name == 'posix':
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        else:
+            self.process.kill()
+
+    def wait(self) -> CommandResult:
+        # Blocks until the command exited, was killed by the timeout or was cancelled
+        if self.result is not None:
+            return self.result
+        deadline = self.start + self.timeout if self.timeout is not None else None
+        reason = 'exited'
+        while True:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                reason = 'timeout'
+                break
+            # Wake up regularly only when the command can be cancelled from another thread
+            step = remaining if self.cancel_event is None else min(remaining or 0.5, 0.5)
+            try:
+                self.process.wait(step)
+                break
+            except subprocess.TimeoutExpired:
+                if self.cancel_event is not None and self.cancel_event.is_set():
+                    reason = 'cancelled'
+                    break
+        if reason != 'exited':
+            self.kill()
+            self.process.wait()
+        for reader in self.readers:
+            reader.join()
+        return self.finish(self.process.returncode, reason)
+
+    def finish(self, returncode: int, reason: str, error=None) -> CommandResult:
+        stderr = ''.join(self.stderr) if error is None else error
+        self.result = CommandResult(self.argv, returncode, ''.join(self.stdout), stderr, time.monotonic() - self.start, reason)
+        record(self.result)
+        if self.sink:
+            status = f"exit code {returncode}" if reason == 'exited' else reason
+            level = logging.INFO if self.result.ok else logging.WARNING
+            self.sink.write(f"{self.result.command} finished with {status} in {self.result.elapsed:.2f}s", level)
+            if error is not None:
+                self.sink.write(error, level)
+        return self.result
+
+
+def start(argv: list, log_file=None, **kwargs) -> RunningCommand:
+    # Starts the command and returns right away, wait() on the returned object collects the result
+    return RunningCommand(argv, log_file, **kwargs)
+
+
+def run(argv: list, log_file=None, **kwargs) -> CommandResult:
+    # Runs the command to completion, kwargs are the RunningCommand options
+    return RunningCommand(argv, log_file, **kwargs).wait()
+
+
+def run_many(commands: list, log_file=None, max_workers=const.RUNNER_MAX_WORKERS, **kwargs) -> list:
+    """
+    Runs independent commands at the same time, at most max_workers at once.
+
+    :param commands: the argv of every command
+    :param log_file: log file shared by all the commands
+    :return: the CommandResult of every command, in the order of commands
+    """
+    if not commands:
+        return []
+    # Each command runs in a copy of the caller's context, so its log records keep the fields bound by the caller
+    contexts = [contextvars.copy_context() for _ in commands]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(commands))) as executor:
+        return list(executor.map(lambda argv, context: context.run(run, argv, log_file, **kwargs), commands, contexts))
+
+
+def record(result: CommandResult):
+    # Only the totals are kept, a long running job does not hold on to every result it ever got
+    name = command_name(result.argv)
+    with stats_lock:
+        count, total, slowest = stats.get(name, (0, 0.0, 0.0))
+        stats[name] = (count + 1, total + result.elapsed, max(slowest, result.elapsed))
+
+
+def timings() -> dict:
+    # Number of runs, total and slowest seconds per program and subcommand (e.g. "terraform init")
+    with stats_lock:
+        return dict(stats)
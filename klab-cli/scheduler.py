@@ -0,0 +1,119 @@
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import utils as utils
+import constants as const
+
+# Status of a task, the last three are final
+PENDING = 'pending'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+# Not run because a task it depends on (directly or not) failed
+SKIPPED = 'skipped'
+
+
+def order(depends_on: dict) -> list:
+    """
+    Sorts the tasks so that every task comes after the ones it depends on.
+
+    :param depends_on: the names each task depends on, per task name
+    :return: the task names, in an order they can run one after the other
+    :raises ValueError: when a task depends on an unknown one or the dependencies form a cycle
+    """
+    for name, dependencies in depends_on.items():
+        unknown = sorted(set(dependencies) - set(depends_on))
+        if unknown:
+            raise ValueError(f"{name} depends on {', '.join(unknown)}, which is not part of the same run.")
+    waiting = {name: set(dependencies) for name, dependencies in depends_on.items()}
+    sorted_names = []
+    ready = [name for name, dependencies in waiting.items() if not dependencies]
+    while ready:
+        name = ready.pop(0)
+        sorted_names.append(name)
+        for other, dependencies in waiting.items():
+            if name in dependencies:
+                dependencies.discard(name)
+                if not dependencies:
+                    ready.append(other)
+    if len(sorted_names) < len(depends_on):
+        raise ValueError(f"Dependency cycle between {', '.join(sorted(set(depends_on) - set(sorted_names)))}.")
+    return sorted_names
+
+
+def call(name: str, task, context: contextvars.Context) -> tuple:
+    # Runs a task in the caller's context (its log records keep the bound fields), an exception is a failure
+    start = time.monotonic()
+    try:
+        ok = bool(context.run(task))
+    except Exception as e:
+        utils.log(f"{name} failed. {e}")
+        ok = False
+    return ok, time.monotonic() - start
+
+
+class Schedule:
+    # Status of the tasks of one run and the dependencies each one still waits for
+    def __init__(self, tasks: dict, depends_on: dict, on_status=None):
+        self.tasks = tasks
+        self.depends_on = {name: set(depends_on.get(name, ())) for name in tasks}
+        order(self.depends_on)
+        self.dependents = {name: [other for other in tasks if name in self.depends_on[other]] for name in tasks}
+        self.status = {name: PENDING for name in tasks}
+        self.on_status = on_status
+
+    def notify(self, name: str, new_status: str, elapsed=0.0):
+        self.status[name] = new_status
+        if self.on_status:
+            self.on_status(name, new_status, elapsed)
+
+    def skip(self, name: str):
+        for dependent in self.dependents[name]:
+            if self.status[dependent] == PENDING:
+                self.notify(dependent, SKIPPED)
+                self.skip(dependent)
+
+    def submit_ready(self, executor, running: dict):
+        # Starts every pending task whose dependencies all succeeded, running maps their futures to their names
+        for name in self.tasks:
+            if self.status[name] == PENDING and not self.depends_on[name]:
+                self.notify(name, RUNNING)
+                running[executor.submit(call, name, self.tasks[name], contextvars.copy_context())] = name
+
+    def finish(self, name: str, ok: bool, elapsed: float):
+        # A success releases the tasks waiting for it, a failure skips them
+        self.notify(name, SUCCEEDED if ok else FAILED, elapsed)
+        if not ok:
+            self.skip(name)
+            return
+        for dependent in self.dependents[name]:
+            self.depends_on[dependent].discard(name)
+
+
+def run(tasks: dict, depends_on: dict, workers=const.APPLY_WORKERS, on_status=None) -> dict:
+    """
+    Runs tasks on a worker pool, each one as soon as every task it depends on succeeded.
+
+    Independent tasks run at the same time, so the whole run takes as long as its longest chain of dependencies.
+    When a task fails, the tasks that depend on it are skipped and the others go on.
+
+    :param tasks: the callables to run per name, each one returns True when it succeeded
+    :param depends_on: the names each task depends on, per task name (tasks without dependencies can be left out)
+    :param workers: number of tasks run at once
+    :param on_status: called with the name, the new status and the seconds the task took (0 until it is done)
+    :return: the final status of every task
+    :raises ValueError: when the dependencies cannot be satisfied, nothing is run then
+    """
+    schedule = Schedule(tasks, depends_on, on_status)
+    if not tasks:
+        return schedule.status
+    with ThreadPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+        running = {}
+        while True:
+            schedule.submit_ready(executor, running)
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                schedule.finish(running.pop(future), *future.result())
+    return schedule.status
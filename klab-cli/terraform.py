@@ -0,0 +1,312 @@
+import fnmatch
+import hashlib
+import json
+import os
+import re
+import shutil
+from contextlib import ExitStack
+import runner
+import fileio
+import constants as const
+
+# Files terraform reads from a module tree, anything else (logs, state, plans) does not change the plan
+CONFIG_SUFFIXES = ('.tf', '.tf.json', '.tfvars', '.tfvars.json')
+LOCK_FILE = '.terraform.lock.hcl'
+# What belongs to a single stack and is never shared between the module and the workspaces stamped from it
+WORKSPACE_IGNORE = ('.terraform', '*.tfstate', '*.tfstate.backup', '*.tfplan', const.PLAN_CACHE_DIR, 'log')
+
+# Outcomes of plan_and_apply
+UNCHANGED = 'unchanged'
+NO_CHANGES = 'no changes'
+APPLIED = 'applied'
+FAILED = 'failed'
+
+
+def module_files(module_dir: str):
+    # The configuration files of the module and of its local submodules, in a stable order
+    # The lock file is left out: init writes it after the fingerprint is taken, the provider requirements are in the .tf files
+    for root, dirs, files in os.walk(module_dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        for file in sorted(files):
+            if file.endswith(CONFIG_SUFFIXES):
+                yield os.path.join(root, file)
+
+
+def fingerprint(module_dir: str, variables: dict, backend_config: dict) -> str:
+    """
+    Content hash of everything a plan depends on besides the remote state.
+
+    :param module_dir: the root module, e.g. providers/AWS
+    :param variables: the -var values
+    :param backend_config: the -backend-config values
+    :return: hex sha256 digest
+    """
+    digest = hashlib.sha256()
+    for path in module_files(module_dir):
+        digest.update(os.path.relpath(path, module_dir).replace(os.sep, '/').encode() + b'\0')
+        with open(path, 'rb') as config_file:
+            digest.update(hashlib.sha256(config_file.read()).digest())
+    digest.update(json.dumps({'variables': variables, 'backend_config': backend_config}, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def plugin_cache_dir() -> str:
+    # A TF_PLUGIN_CACHE_DIR set by the user wins over the klab one
+    path = os.environ.get('TF_PLUGIN_CACHE_DIR') or os.path.expanduser(const.TF_PLUGIN_CACHE_DIR)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def write_mirror_config(mirror: str) -> str:
+    """
+    Writes the terraform CLI config that installs the providers only from a filesystem mirror.
+
+    The mirror has the layout of terraform providers mirror (packed zips or unpacked directories), no registry is
+    contacted afterwards so init works offline. Removing the file goes back to the registry.
+
+    :param mirror: the mirror directory
+    :return: path of the CLI config file
+    """
+    path = os.path.expanduser(const.TF_CLI_CONFIG_FILE)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as config_file:
+        config_file.write(
+            f'plugin_cache_dir = {json.dumps(plugin_cache_dir())}\n'
+            'provider_installation {\n'
+            '  filesystem_mirror {\n'
+            f'    path = {json.dumps(os.path.abspath(mirror))}\n'
+            '  }\n'
+            '}\n'
+        )
+    return path
+
+
+def init_env() -> dict:
+    # Environment of the terraform commands: the shared plugin cache and the mirror config once init --mirror wrote it
+    env = {'TF_PLUGIN_CACHE_DIR': plugin_cache_dir()}
+    config_file = os.path.expanduser(const.TF_CLI_CONFIG_FILE)
+    if os.path.isfile(config_file) and 'TF_CLI_CONFIG_FILE' not in os.environ:
+        env['TF_CLI_CONFIG_FILE'] = config_file
+    return env
+
+
+def link_mirror(mirror: str, module_dir: str) -> int:
+    """
+    Hardlinks the unpacked providers of a mirror into the .terraform directory of a module.
+
+    Init then finds every provider already installed and only checks it against the lock file.
+    Files are copied when the mirror is on another filesystem.
+
+    :param mirror: the mirror directory, unpacked providers are in <host>/<namespace>/<type>/<version>/<os_arch>/
+    :param module_dir: the root module
+    :return: number of providers linked
+    """
+    mirror = os.path.abspath(mirror)
+    linked = 0
+    for root, dirs, files in os.walk(mirror):
+        relative = os.path.relpath(root, mirror)
+        if len(relative.split(os.sep)) < 5:
+            continue
+        # Do not descend into the provider package itself
+        dirs[:] = []
+        target = os.path.join(module_dir, '.terraform', 'providers', relative)
+        if os.path.exists(target):
+            continue
+        shutil.copytree(root, target, copy_function=link_or_copy)
+        linked += 1
+    return linked
+
+
+def link_or_copy(source: str, target: str):
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def init(module_dir: str, log_file=None, backend_config=None, mirror=None, cancel_event=None):
+    """
+    Runs terraform init with the shared plugin cache.
+
+    :param module_dir: the root module
+    :param log_file: where the terraform output goes
+    :param backend_config: the -backend-config values
+    :param mirror: filesystem mirror whose providers are linked into the module first
+    :param cancel_event: threading.Event that stops the running command
+    :return: the runner.CommandResult of terraform init
+    """
+    if mirror:
+        link_mirror(mirror, module_dir)
+    backend_args = [f'-backend-config={key}={value}' for key, value in (backend_config or {}).items()]
+    env = init_env()
+    # The plugin cache is not safe for concurrent installs of the same plugin: inits that need the same providers
+    # take turns, the others (e.g. the AWS and the GCP modules) run at the same time
+    with ExitStack() as stack:
+        for name in module_providers(module_dir) or ['init']:
+            stack.enter_context(fileio.locked(os.path.join(env['TF_PLUGIN_CACHE_DIR'], f'provider-{name}')))
+        return runner.run(['terraform', 'init', '-input=false', *backend_args], log_file, cwd=module_dir, env=env,
+                          timeout=const.TERRAFORM_TIMEOUT, cancel_event=cancel_event)
+
+
+def module_providers(module_dir: str) -> list:
+    # Names of the providers configured by the module, sorted so that the locks are always taken in the same order
+    names = set()
+    for path in module_files(module_dir):
+        if path.endswith('.tf'):
+            with open(path, 'r') as config_file:
+                names.update(re.findall(r'^\s*provider\s+"([\w-]+)"', config_file.read(), re.MULTILINE))
+    return sorted(names)
+
+
+def ignored(name: str) -> bool:
+    return any(fnmatch.fnmatch(name, pattern) for pattern in WORKSPACE_IGNORE)
+
+
+def link_file(source: str, target: str):
+    try:
+        os.symlink(source, target)
+    except OSError:
+        # e.g. Windows without the symlink privilege
+        shutil.copy2(source, target)
+
+
+def refresh_link(source: str, target: str):
+    # Points target at the module file, the lock file is only copied once since terraform init rewrites it
+    if os.path.basename(source) == LOCK_FILE:
+        if not os.path.exists(target):
+            shutil.copy2(source, target)
+        return
+    if os.path.islink(target):
+        if os.readlink(target) == source:
+            return
+        os.remove(target)
+    elif os.path.exists(target):
+        # A copy made by link_file, refreshed when the module file changed
+        if os.stat(target).st_mtime_ns >= os.stat(source).st_mtime_ns:
+            return
+        os.remove(target)
+    link_file(source, target)
+
+
+def remove_stale_links(workdir: str):
+    # Links to files removed from the module
+    for root, dirs, files in os.walk(workdir):
+        dirs[:] = [d for d in dirs if not ignored(d)]
+        for file in files:
+            path = os.path.join(root, file)
+            if os.path.islink(path) and not os.path.exists(path):
+                os.remove(path)
+
+
+def stamp_workspace(module_dir: str, workdir: str) -> str:
+    """
+    Brings a workspace up to date with a module: the same tree, whose files are symlinks to the module files.
+
+    Every workspace has its own .terraform directory, state and saved plans, so stacks of the same module can be
+    planned and applied at the same time. The lock file is copied, terraform init rewrites it.
+
+    :param module_dir: the root module, e.g. providers/AWS
+    :param workdir: the workspace directory, created if needed
+    :return: the workspace directory
+    """
+    module_dir = os.path.abspath(module_dir)
+    for root, dirs, files in os.walk(module_dir):
+        dirs[:] = [d for d in dirs if not ignored(d)]
+        target_dir = os.path.normpath(os.path.join(workdir, os.path.relpath(root, module_dir)))
+        os.makedirs(target_dir, exist_ok=True)
+        for file in files:
+            if not ignored(file):
+                refresh_link(os.path.join(root, file), os.path.join(target_dir, file))
+    remove_stale_links(workdir)
+    return workdir
+
+
+class PlanCache:
+    # Saved plan and metadata of one stack (e.g. one cluster) of a module, kept in <module>/.klab-plans
+    def __init__(self, module_dir: str, name: str):
+        self.dir = os.path.join(os.path.abspath(module_dir), const.PLAN_CACHE_DIR)
+        self.plan_file = os.path.join(self.dir, f"{name}.tfplan")
+        self.meta_file = os.path.join(self.dir, f"{name}.json")
+
+    def read(self) -> dict:
+        try:
+            with open(self.meta_file, 'r') as meta_file:
+                return json.load(meta_file)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def write(self, digest: str, applied: bool):
+        os.makedirs(self.dir, exist_ok=True)
+        with open(self.meta_file, 'w') as meta_file:
+            json.dump({'fingerprint': digest, 'applied': applied}, meta_file)
+        if applied:
+            # A plan can only be applied once
+            self.drop_plan()
+
+    def drop_plan(self):
+        try:
+            os.remove(self.plan_file)
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        self.drop_plan()
+        try:
+            os.remove(self.meta_file)
+        except FileNotFoundError:
+            pass
+
+
+def plan_and_apply(module_dir: str, name: str, variables: dict, backend_config=None, log_file=None, force=False,
+                   cancel_event=None) -> str:
+    """
+    Brings a stack up to date with as little terraform work as possible.
+
+    Nothing runs when the module, the variables and the backend config are the ones of the last successful apply.
+    A plan saved for the same inputs is applied directly, otherwise the plan is saved with -out and applied only
+    when it has changes.
+
+    :param module_dir: the root module
+    :param name: the stack, e.g. the cluster name, every stack has its own cached plan
+    :param variables: the -var values
+    :param backend_config: the -backend-config values passed to terraform init
+    :param log_file: where the terraform output goes
+    :param force: plan again even if nothing changed (e.g. to fix a drift of the real resources)
+    :param cancel_event: threading.Event that stops the running command
+    :return: one of UNCHANGED, NO_CHANGES, APPLIED or FAILED
+    """
+    backend_config = backend_config or {}
+    cache = PlanCache(module_dir, name)
+    digest = fingerprint(module_dir, variables, backend_config)
+    meta = cache.read()
+    same_inputs = not force and meta.get('fingerprint') == digest
+    if same_inputs and meta.get('applied'):
+        return UNCHANGED
+
+    def terraform(*args):
+        return runner.run(['terraform', *args], log_file, cwd=module_dir, env=init_env(), timeout=const.TERRAFORM_TIMEOUT,
+                          cancel_event=cancel_event)
+
+    if not init(module_dir, log_file, backend_config, cancel_event=cancel_event):
+        return FAILED
+    reuse_plan = same_inputs and os.path.isfile(cache.plan_file)
+    if not reuse_plan:
+        os.makedirs(cache.dir, exist_ok=True)
+        plan = terraform('plan', '-input=false', '-detailed-exitcode', f'-out={cache.plan_file}', *[f'-var={key}={value}' for key, value in variables.items()])
+        # -detailed-exitcode: 0 means no changes, 2 means there are changes to apply
+        if plan.returncode == 0:
+            cache.write(digest, applied=True)
+            return NO_CHANGES
+        if plan.returncode != 2:
+            cache.clear()
+            return FAILED
+        cache.write(digest, applied=False)
+    apply = terraform('apply', '-input=false', '-auto-approve', cache.plan_file)
+    if not apply:
+        cache.clear()
+        if reuse_plan and 'Saved plan is stale' in apply.stderr:
+            # The state moved since the plan was saved, plan again
+            return plan_and_apply(module_dir, name, variables, backend_config, log_file, force=True, cancel_event=cancel_event)
+        return FAILED
+    cache.write(digest, applied=True)
+    return APPLIED
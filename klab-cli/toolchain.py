@@ -0,0 +1,130 @@
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import runner
+import fileio
+import constants as const
+
+# The external tools klab runs: how to read their version and how to tell if the user is logged in.
+# A login check is either a command or the credential files the tool writes, the files are part of the cache key anyway.
+TOOLS = {
+    'aws': {'version': ['--version'], 'files': [const.AWS_PROFILE_FILE]},
+    'az': {'version': ['--version'], 'auth': ['account', 'show'], 'files': [const.AZURE_PROFILE_FILE]},
+    'gcloud': {'version': ['--version'], 'files': [const.GCP_PROFILE_FILE]},
+    'terraform': {'version': ['version']},
+    'kubectl': {'version': ['version', '--client']},
+}
+
+cache_lock = threading.Lock()
+
+
+class Probe:
+    # What is known about one tool, ok and elapsed make it look like a runner.CommandResult to the callers
+    def __init__(self, tool: str, path=None, version=None, installed=False, authenticated=None, checked=None, elapsed=0.0, cached=False):
+        self.tool = tool
+        self.path = path
+        self.version = version
+        self.installed = installed
+        # None when the tool has no notion of login (e.g. terraform)
+        self.authenticated = authenticated
+        self.checked = checked
+        self.elapsed = elapsed
+        self.cached = cached
+
+    @property
+    def ok(self) -> bool:
+        return self.installed
+
+    def to_dict(self) -> dict:
+        return {'path': self.path, 'version': self.version, 'installed': self.installed, 'authenticated': self.authenticated,
+                'checked': self.checked}
+
+    def __repr__(self) -> str:
+        return f"Probe({self.tool!r}, version={self.version!r}, authenticated={self.authenticated!r}, cached={self.cached})"
+
+
+def cache_file() -> str:
+    return os.path.expanduser(const.TOOLCHAIN_CACHE_FILE)
+
+
+def cache_ttl() -> float:
+    try:
+        return float(os.environ.get(const.TOOLCHAIN_TTL_ENV, const.TOOLCHAIN_TTL))
+    except ValueError:
+        return const.TOOLCHAIN_TTL
+
+
+def file_fingerprint(path: str):
+    try:
+        stat = os.stat(os.path.expanduser(path))
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def cache_key(name: str, path: str) -> list:
+    # The resolved binary (upgrades replace it) and the credential files (a login rewrites them)
+    binary = os.path.realpath(path)
+    return [binary, file_fingerprint(binary)] + [file_fingerprint(file) for file in TOOLS[name].get('files', [])]
+
+
+def read_cache() -> dict:
+    try:
+        with open(cache_file(), 'r') as cached:
+            return json.load(cached)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def write_cache(name: str, key: list, probe: Probe):
+    path = cache_file()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with cache_lock, fileio.locked(path):
+        entries = read_cache()
+        entries[name] = {'key': key, 'probe': probe.to_dict()}
+        fileio.atomic_write(path, json.dumps(entries, indent=2, sort_keys=True))
+
+
+def first_line(text: str):
+    return next((line.strip() for line in text.splitlines() if line.strip()), None)
+
+
+def probe(name: str, refresh=False) -> Probe:
+    """
+    Finds a tool, its version and whether the user is logged in, without running it when a fresh probe is cached.
+
+    :param name: one of TOOLS
+    :param refresh: ignore the cache and run the tool again
+    :return: the Probe of the tool
+    """
+    spec = TOOLS[name]
+    path = shutil.which(name)
+    if path is None:
+        return Probe(name)
+    key = cache_key(name, path)
+    entry = read_cache().get(name)
+    if not refresh and entry and entry.get('key') == key and time.time() - entry['probe']['checked'] < cache_ttl():
+        return Probe(name, cached=True, **entry['probe'])
+    start = time.monotonic()
+    result = runner.run([path, *spec['version']], timeout=const.CLI_TIMEOUT)
+    authenticated = None
+    if result.ok and 'auth' in spec:
+        authenticated = runner.run([path, *spec['auth']], timeout=const.CLI_TIMEOUT).ok
+    elif result.ok and 'files' in spec:
+        authenticated = all(os.path.isfile(os.path.expanduser(file)) for file in spec['files'])
+    found = Probe(name, path, first_line(result.stdout) or first_line(result.stderr), result.ok, authenticated, time.time(),
+                  time.monotonic() - start)
+    # A timed out or cancelled probe says nothing about the tool
+    if result.reason == 'exited':
+        write_cache(name, key, found)
+    return found
+
+
+def probe_all(names=None, refresh=False) -> list:
+    # Probes several tools at the same time, in the order of names
+    names = list(names or TOOLS)
+    with ThreadPoolExecutor(max_workers=len(names)) as executor:
+        return list(executor.map(lambda name: probe(name, refresh), names))
@@ -0,0 +1,119 @@
+import random
+import threading
+import time
+import constants as const
+
+
+class WaitResult:
+    # Outcome of a wait, it keeps the last value returned by the predicate and how much the wait cost
+    def __init__(self, description: str, done: bool, value, polls: int, elapsed: float, reason: str):
+        self.description = description
+        self.done = done
+        self.value = value
+        self.polls = polls
+        self.elapsed = elapsed
+        # One of 'done', 'timeout' or 'cancelled'
+        self.reason = reason
+
+    def __bool__(self) -> bool:
+        return self.done
+
+    def __repr__(self) -> str:
+        return f"WaitResult({self.description!r}, {self.reason}, polls={self.polls}, elapsed={self.elapsed:.1f}s)"
+
+
+class Waiter:
+    """
+    Polls a predicate until it is satisfied, sleeping with exponential backoff and jitter between polls.
+
+    :param description: what is being waited for, used in the logs
+    :param timeout: overall deadline in seconds, None means no deadline
+    :param initial_delay: seconds to sleep after the first unsuccessful poll
+    :param max_delay: upper bound of the sleep between two polls
+    :param multiplier: growth factor of the sleep after every unsuccessful poll
+    :param jitter: fraction of the sleep that is randomized, so concurrent waiters do not poll in lockstep
+    :param cancel_event: threading.Event that aborts the wait as soon as it is set
+    :param retry_on: exception types raised by the predicate that count as a "not done yet" poll
+    """
+
+    def __init__(self, description: str, timeout=const.WAIT_TIMEOUT, initial_delay=const.WAIT_INITIAL_DELAY,
+                 max_delay=const.WAIT_MAX_DELAY, multiplier=2.0, jitter=0.2, cancel_event=None, retry_on=()):
+        self.description = description
+        self.timeout = timeout
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.cancel_event = cancel_event if cancel_event is not None else threading.Event()
+        self.retry_on = tuple(retry_on)
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def delays(self):
+        # Infinite sequence of jittered, exponentially growing sleeps capped at max_delay
+        delay = self.initial_delay
+        while True:
+            yield delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+            delay = min(delay * self.multiplier, self.max_delay)
+
+    def wait(self, predicate) -> WaitResult:
+        # The predicate is called with no arguments and its return value is considered done when truthy
+        start = time.monotonic()
+        deadline = start + self.timeout if self.timeout is not None else None
+        polls = 0
+        value = None
+        for delay in self.delays():
+            if self.cancel_event.is_set():
+                return self.result(False, value, polls, start, 'cancelled')
+            polls += 1
+            try:
+                value = predicate()
+            except self.retry_on:
+                value = None
+            if value:
+                return self.result(True, value, polls, start, 'done')
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return self.result(False, value, polls, start, 'timeout')
+                delay = min(delay, remaining)
+            # Event.wait sleeps without burning CPU and wakes up immediately on cancellation
+            if self.cancel_event.wait(delay):
+                return self.result(False, value, polls, start, 'cancelled')
+
+    def result(self, done: bool, value, polls: int, start: float, reason: str) -> WaitResult:
+        return WaitResult(self.description, done, value, polls, time.monotonic() - start, reason)
+
+
+def wait_until(predicate, description: str, **kwargs) -> WaitResult:
+    # Shortcut for a one-off wait, kwargs are the Waiter options
+    return Waiter(description, **kwargs).wait(predicate)
+
+
+def wait_all(keys, poll, description: str, **kwargs) -> dict:
+    """
+    Waits for several resources with a single polling loop, e.g. all the node groups of a cluster.
+
+    :param keys: the resources to wait for
+    :param poll: called with the set of still pending keys, returns the keys that are done
+    :param description: what is being waited for, each key is appended to it in the results
+    :return: a WaitResult per key, whose polls and elapsed are taken when that key was done
+    """
+    start = time.monotonic()
+    pending = set(keys)
+    finished = {}
+    polls = 0
+
+    def predicate():
+        nonlocal polls
+        polls += 1
+        for key in set(poll(set(pending))) & pending:
+            finished[key] = WaitResult(f"{description} {key}", True, key, polls, time.monotonic() - start, 'done')
+            pending.discard(key)
+        return not pending
+
+    overall = Waiter(description, **kwargs).wait(predicate)
+    for key in pending:
+        finished[key] = WaitResult(f"{description} {key}", False, None, overall.polls, overall.elapsed, overall.reason)
+    return finished
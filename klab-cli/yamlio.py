@@ -0,0 +1,66 @@
+import copy
+import os
+import threading
+import yaml
+
+# The libyaml bindings are an order of magnitude faster than the pure Python loader/dumper, use them when PyYAML was built with them
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+SafeDumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+LIBYAML = SafeLoader is not yaml.SafeLoader
+
+YAMLError = yaml.YAMLError
+
+# Parsed documents per path, only valid as long as the file keeps the same mtime and size
+cache = {}
+cache_lock = threading.Lock()
+
+
+def loads(text: str):
+    return yaml.load(text, Loader=SafeLoader)
+
+
+def loads_all(text: str) -> list:
+    # Every document of a multi-document stream, empty documents are skipped
+    return [data for data in yaml.load_all(text, Loader=SafeLoader) if data is not None]
+
+
+def dumps(data, **kwargs) -> str:
+    return yaml.dump(data, Dumper=SafeDumper, **kwargs)
+
+
+def load(path: str, default=None):
+    """
+    Loads a YAML file, parsing it only once per process as long as it does not change on disk.
+
+    :param path: the file to be loaded
+    :param default: returned when the file does not exist or is empty
+    :return: a copy of the parsed document, callers are free to modify it
+    """
+    key = os.path.abspath(path)
+    try:
+        stat = os.stat(key)
+    except FileNotFoundError:
+        return default
+    fingerprint = (stat.st_mtime_ns, stat.st_size)
+    with cache_lock:
+        cached = cache.get(key)
+    if cached is None or cached[0] != fingerprint:
+        with open(key, 'r') as yaml_file:
+            data = yaml.load(yaml_file, Loader=SafeLoader)
+        cached = (fingerprint, data)
+        with cache_lock:
+            cache[key] = cached
+    data = cached[1]
+    return default if data is None else copy.deepcopy(data)
+
+
+def dump(data, path: str, **kwargs):
+    # Writes the document and forgets the cached one, the next load parses the new content
+    with open(path, 'w') as yaml_file:
+        yaml_file.write(dumps(data, **kwargs))
+    invalidate(path)
+
+
+def invalidate(path: str):
+    with cache_lock:
+        cache.pop(os.path.abspath(path), None)
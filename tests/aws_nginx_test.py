@@ -32,8 +32,7 @@ class TestAWSNginx:
     def test_aws_install_nginx_deployment(self):
         print("Running test for add command in AWS")
         os.chdir(os.path.join(os.path.dirname(__file__), '..'))
-        result = subprocess.run(['python3', 'lab.py', 'add', 'nginx', '--version=1.24.0', '--yes'], capture_output=True, text=True)
-        time.sleep(90)
+        result = subprocess.run(['python3', 'lab.py', 'add', 'nginx', '--version=1.24.0', '--yes', '--wait'], capture_output=True, text=True)
         print("AWS add command result:", result.stdout)
         config.load_kube_config()
 
@@ -68,7 +67,7 @@ class TestAWSNginx:
     def test_aws_update_nginx_deployment(self):
         print("Running test for update command in AWS")
         os.chdir(os.path.join(os.path.dirname(__file__), '..'))
-        result = subprocess.run(['python3', 'lab.py', 'update', 'nginx', '--type=deployment', '--version=latest'], capture_output=True, text=True)
+        result = subprocess.run(['python3', 'lab.py', 'update', 'nginx', '--type=deployment', '--version=latest', '--wait'], capture_output=True, text=True)
         print("AWS update command result:", result.stdout)
         config.load_kube_config()
 
@@ -35,11 +35,9 @@ class TestAzureNginx:
     def test_azure_install_nginx_deployment(self):
         print("Running test for add command in Azure")
         os.chdir(os.path.join(os.path.dirname(__file__), '..'))
-        result = subprocess.run(['python3', 'lab.py', 'add', 'nginx', '--yes'], capture_output=True, text=True)
+        result = subprocess.run(['python3', 'lab.py', 'add', 'nginx', '--yes', '--wait'], capture_output=True, text=True)
         print("Azure add command result:", result.stdout)
-        time.sleep(60)
         config.load_kube_config()
-        time.sleep(30)
 
         # Create Kubernetes API client
         api = client.AppsV1Api()
@@ -73,10 +71,8 @@ class TestAzureNginx:
     def test_azure_update_nginx_deployment(self):
         print("Running test for update command in Azure")
         os.chdir(os.path.join(os.path.dirname(__file__), '..'))
-        result = subprocess.run(['python3', 'lab.py', 'update', 'nginx', '--type=deployment', '--version=latest'], capture_output=True, text=True)
-        time.sleep(60)
+        result = subprocess.run(['python3', 'lab.py', 'update', 'nginx', '--type=deployment', '--version=latest', '--wait'], capture_output=True, text=True)
         config.load_kube_config()
-        time.sleep(30)
 
         # Create Kubernetes API client
         api = client.AppsV1Api()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The cli modules import each other as top level modules (e.g. `import utils`), so the source dir has to be on the path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'klab-cli'))
@@ -32,8 +32,7 @@ class TestGCPNginx:
     def test_gcp_install_nginx_deployment(self):
         print("Running test for add command in GCP")
         os.chdir(os.path.join(os.path.dirname(__file__), '..'))
-        result = subprocess.run(['python3', 'lab.py', 'add', 'nginx', '--version=1.24.0', '--yes'], capture_output=True, text=True)
-        time.sleep(150)
+        result = subprocess.run(['python3', 'lab.py', 'add', 'nginx', '--version=1.24.0', '--yes', '--wait'], capture_output=True, text=True)
         print("GCP add command result:", result.stdout)
         config.load_kube_config()
 
@@ -73,10 +72,9 @@ class TestGCPNginx:
     def test_gcp_update_nginx_deployment(self):
         print("Running test for update command in GCP")
         os.chdir(os.path.join(os.path.dirname(__file__), '..'))
-        result = subprocess.run(['python3', 'lab.py', 'update', 'nginx', '--type', 'deployment', '--version', 'latest'], capture_output=True, text=True)
+        result = subprocess.run(['python3', 'lab.py', 'update', 'nginx', '--type', 'deployment', '--version', 'latest', '--wait'], capture_output=True, text=True)
         print("GCP update command result:", result.stdout)
         config.load_kube_config()
-        time.sleep(120)
 
         # Create Kubernetes API client
         api = client.AppsV1Api()
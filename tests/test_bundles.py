@@ -0,0 +1,87 @@
+import os
+
+import pytest
+import bundles
+import catalog
+import runner
+from deploy import Deploy
+
+REPO = 'https://github.com/nginxinc/nginx-ingress-helm-operator/'
+RENDERED = """apiVersion: v1
+kind: Namespace
+metadata:
+  name: nginx-ingress-operator-system
+---
+apiVersion: apps/v1
+kind: Deployment
+metadata:
+  name: nginx-ingress-operator-controller-manager
+  namespace: nginx-ingress-operator-system
+spec:
+  template:
+    spec:
+      containers:
+      - name: kube-rbac-proxy
+        image: gcr.io/kubebuilder/kube-rbac-proxy:v0.13.1
+      - name: manager
+        image: controller:latest
+"""
+
+
+@pytest.fixture
+def commands(tmp_path, monkeypatch):
+    # git and kustomize answer instantly, the operator sources are never really cloned
+    monkeypatch.chdir(tmp_path)
+    calls = []
+
+    def run(argv, log_file=None, **kwargs):
+        calls.append(argv)
+        if argv[:2] == ['git', 'clone']:
+            os.makedirs(argv[3])
+        stdout = RENDERED if 'kustomize' in argv else ''
+        return runner.CommandResult(argv, 0, stdout, '', 0.1)
+    monkeypatch.setattr(bundles.runner, 'run', run)
+    return calls
+
+
+class TestBundles:
+    def test_rendered_once(self, commands):
+        path = bundles.get_bundle(REPO, '1.5.0', 'nginx/nginx-ingress-operator:1.5.0', 'catalog/nginx/operator-src')
+        assert [argv[:2] for argv in commands] == [['git', 'clone'], commands[1][:2]]
+        assert commands[1][-1] == os.path.join('catalog/nginx/operator-src', 'config/default')
+        manifests = bundles.yamlio.loads_all(open(path).read())
+        containers = manifests[1]['spec']['template']['spec']['containers']
+        # Only the manager runs the requested controller image
+        assert [container['image'] for container in containers] == ['gcr.io/kubebuilder/kube-rbac-proxy:v0.13.1',
+                                                                     'nginx/nginx-ingress-operator:1.5.0']
+        commands.clear()
+        assert bundles.get_bundle(REPO, '1.5.0', 'nginx/nginx-ingress-operator:1.5.0', 'catalog/nginx/operator-src') == path
+        assert commands == []
+
+    def test_content_addressed(self, commands):
+        first = bundles.get_bundle(REPO, '1.5.0', 'nginx/nginx-ingress-operator:1.5.0', 'src')
+        other_image = bundles.get_bundle(REPO, '1.5.0', 'mirror/nginx-ingress-operator:1.5.0', 'src')
+        assert first != other_image
+        # A new version with the same manifests shares the object, the sources are only checked out again
+        commands.clear()
+        assert bundles.get_bundle(REPO, '1.5.1', 'nginx/nginx-ingress-operator:1.5.0', 'src') == first
+        assert commands[0] == ['git', 'checkout', 'v1.5.1']
+        assert os.path.basename(first) == bundles.hashlib.sha256(open(first).read().encode()).hexdigest() + '.yaml'
+        assert len(bundles.read_index()) == 3
+
+    def test_install_applies_the_bundle_offline(self, commands, monkeypatch):
+        applied = []
+        monkeypatch.setattr(catalog, 'set_installed', lambda *args: True)
+        monkeypatch.setattr('deploy.kubeapply.apply_manifest', lambda path, namespace=None, context=None: applied.append(path) or True)
+        deploy = Deploy('nginx', '1.5.0', 'operator', operatorImage='nginx/nginx-ingress-operator', operatorRepo=REPO, operatorDir='src')
+        assert deploy.operator('nginx', REPO)
+        commands.clear()
+        # The network is gone: no git, no kustomize, no make
+        monkeypatch.setattr(bundles.runner, 'run', lambda argv, *args, **kwargs: pytest.fail(f'{argv} was run'))
+        assert deploy.operator('nginx', REPO)
+        assert applied[0] == applied[1] and applied[0].startswith(os.path.join('catalog', 'bundles', 'objects'))
+
+    def test_render_failure(self, commands, monkeypatch):
+        monkeypatch.setattr(bundles.runner, 'run', lambda argv, *args, **kwargs: runner.CommandResult(argv, 128, '', 'fatal: unable to access\n', 0.1))
+        assert bundles.get_bundle(REPO, '1.5.0', 'nginx/nginx-ingress-operator:1.5.0', 'src') is None
+        assert bundles.read_index() == {}
@@ -0,0 +1,129 @@
+import time
+
+import pytest
+import catalog
+
+CATALOG = """
+- product: nginx
+  default_version: latest
+  default_type: deployment
+  available_types:
+    - deployment
+    - operator
+  installed_version: 
+  installed_type: 
+  operatorRepo: https://github.com/nginxinc/nginx-ingress-helm-operator/
+  operatorVersion: 1.5.0
+  operatorImage: nginx/nginx-ingress-operator
+  operatorDir: catalog/nginx/nginx-ingress-helm-operator
+  deploymentFile: catalog/nginx/nginx_deployment/deployment.yaml
+  imageVersion: latest
+
+- product: istio
+  default_version: 1.20.0
+  default_type: operator
+  available_types:
+    - operator
+  installed_version: 1.20.0
+  installation_type: operator
+  operatorRepo: https://github.com/istio/istio
+  depends_on: []
+
+- product: karpenter
+  default_version: 0.32.1
+  default_type: deployment
+  available_types:
+    - deployment
+"""
+
+
+@pytest.fixture
+def catalog_file(tmp_path):
+    path = tmp_path / 'catalog.yaml'
+    path.write_text(CATALOG)
+    return str(path)
+
+
+class TestCatalog:
+    def test_parses_every_product(self, catalog_file):
+        products = catalog.load_catalog(catalog_file)
+        assert products.names() == ['nginx', 'istio', 'karpenter']
+        nginx = products.get('nginx')
+        # Values containing colons are kept whole
+        assert nginx.operatorRepo == 'https://github.com/nginxinc/nginx-ingress-helm-operator/'
+        assert nginx.operatorVersion == '1.5.0'
+        assert nginx.installed_version is None
+        assert not nginx.installed
+        assert 'nginx' in products and 'linkerd' not in products
+        assert products.get('linkerd') is None
+
+    def test_indexes_by_type(self, catalog_file):
+        products = catalog.load_catalog(catalog_file)
+        assert [p.product for p in products.with_type('operator')] == ['nginx', 'istio']
+        assert [p.product for p in products.with_type('deployment')] == ['nginx', 'karpenter']
+        assert products.with_type('helm') == []
+
+    def test_legacy_and_unknown_fields(self, catalog_file):
+        istio = catalog.load_catalog(catalog_file).get('istio')
+        assert istio.installed_type == 'operator'
+        assert istio.installed
+        assert istio.extra == {'depends_on': []}
+        assert istio.to_dict()['depends_on'] == []
+        with pytest.raises(AttributeError):
+            istio.unknown = True
+
+    def test_parsed_once_until_the_file_changes(self, catalog_file):
+        first = catalog.load_catalog(catalog_file)
+        assert catalog.load_catalog(catalog_file) is first
+        time.sleep(0.01)
+        with open(catalog_file, 'a') as f:
+            f.write('\n- product: linkerd\n  available_types: [deployment]\n')
+        reloaded = catalog.load_catalog(catalog_file)
+        assert reloaded is not first
+        assert reloaded.get('linkerd').available_types == ['deployment']
+
+    def test_missing_catalog(self, tmp_path):
+        assert len(catalog.load_catalog(str(tmp_path / 'missing.yaml'))) == 0
+
+
+class TestCatalogWrites:
+    def test_only_the_changed_product_is_rewritten(self, catalog_file):
+        assert catalog.set_installed('nginx', '1.25.3', 'deployment', path=catalog_file)
+        with open(catalog_file) as f:
+            text = f.read()
+        # Every line but the two installed fields of nginx is kept byte for byte
+        expected = CATALOG.replace('  installed_version: \n  installed_type: \n',
+                                   '  installed_version: 1.25.3\n  installed_type: deployment\n', 1)
+        assert text == expected
+        nginx = catalog.load_catalog(catalog_file).get('nginx')
+        assert (nginx.installed_version, nginx.installed_type) == ('1.25.3', 'deployment')
+
+    def test_clear_and_legacy_key(self, catalog_file):
+        assert catalog.set_installed('istio', None, None, path=catalog_file)
+        with open(catalog_file) as f:
+            text = f.read()
+        assert 'installation_type' not in text
+        istio = catalog.load_catalog(catalog_file).get('istio')
+        assert not istio.installed and istio.installed_version is None
+        assert catalog.load_catalog(catalog_file).get('nginx').operatorVersion == '1.5.0'
+
+    def test_missing_fields_are_added(self, catalog_file):
+        assert catalog.set_installed('karpenter', '1.0', 'deployment', path=catalog_file)
+        karpenter = catalog.load_catalog(catalog_file).get('karpenter')
+        # Versions that look like numbers stay strings
+        assert (karpenter.installed_version, karpenter.installed_type) == ('1.0', 'deployment')
+        assert karpenter.available_types == ['deployment']
+
+    def test_unknown_product(self, catalog_file):
+        assert not catalog.set_installed('linkerd', '2.14', 'operator', path=catalog_file)
+
+    def test_flow_style_catalog(self, tmp_path):
+        path = str(tmp_path / 'catalog.yaml')
+        with open(path, 'w') as f:
+            f.write('[{product: nginx, available_types: [deployment]}]\n')
+        assert catalog.set_installed('nginx', 'latest', 'deployment', path=path)
+        assert catalog.load_catalog(path).get('nginx').installed_type == 'deployment'
+
+    def test_no_temporary_files_left(self, catalog_file, tmp_path):
+        catalog.set_installed('nginx', 'latest', 'deployment', path=catalog_file)
+        assert sorted(p.name for p in tmp_path.iterdir() if p.name.startswith('.catalog-')) == []
@@ -0,0 +1,44 @@
+import os
+import shutil
+
+import pytest
+import yamlio
+from deploy import Deploy
+
+MANIFEST = os.path.join(os.path.dirname(__file__), '..', 'catalog', 'nginx', 'deployment', 'deployment.yaml')
+
+
+@pytest.fixture
+def applied(tmp_path, monkeypatch):
+    # The rendered manifest as kubeapply gets it, the cluster is never reached
+    documents = []
+    monkeypatch.setattr('deploy.kubeapply.apply_manifest', lambda path, namespace=None, context=None: documents.append(
+        yamlio.loads_all(open(path).read())) or True)
+    monkeypatch.setattr('deploy.catalog.set_installed', lambda *args: True)
+    manifest = tmp_path / 'deployment.yaml'
+    shutil.copy(MANIFEST, manifest)
+    return documents, manifest
+
+
+class TestDeployment:
+    def test_spec_values_are_rendered_in_a_copy(self, applied):
+        documents, manifest = applied
+        original = manifest.read_text()
+        deploy = Deploy('nginx', None, 'deployment', deployment_type=str(manifest))
+        assert deploy.deployment('nginx', '1.25', replicas=3, port=8080)
+        deployment, service = documents[0]
+        assert deployment['spec']['replicas'] == 3
+        container = deployment['spec']['template']['spec']['containers'][0]
+        assert container['image'] == 'nginx:1.25'
+        # The service exposes the spec port, the container keeps listening on its own
+        assert container['ports'] == [{'containerPort': 80}]
+        assert service['spec']['ports'] == [{'port': 8080, 'targetPort': 80}]
+        assert manifest.read_text() == original
+        assert os.listdir(manifest.parent) == ['deployment.yaml']
+
+    def test_unset_values_keep_the_manifest_ones(self, applied):
+        documents, manifest = applied
+        Deploy('nginx', None, 'deployment', deployment_type=str(manifest)).deployment('nginx', 'latest')
+        deployment, service = documents[0]
+        assert deployment['spec']['replicas'] == 2
+        assert service['spec']['ports'] == [{'port': 80, 'targetPort': 80}]
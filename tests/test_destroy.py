@@ -0,0 +1,88 @@
+import os
+import stat
+import threading
+import time
+
+import pytest
+import lab
+import lab2
+import registry
+import terraform
+import yamlio
+from click.testing import CliRunner
+
+
+CLUSTERS = [
+    {'name': 'nightly-1', 'provider': 'AWS', 'region': 'eu-west-2'},
+    {'name': 'nightly-2', 'provider': 'Azure', 'region': 'eastus', 'resource_group': 'rg'},
+    {'name': 'nightly-3', 'provider': 'GCP', 'region': 'europe-west1', 'project': 'p'},
+    {'name': 'keep-me', 'provider': 'AWS', 'region': 'eu-west-2'},
+]
+
+# az aks show finds the cluster, every other az and terraform call succeeds
+FAKE_AZ = """#!/bin/sh
+[ "$2" = show ] && echo Succeeded
+exit 0
+"""
+
+
+class TestBulkDestroy:
+    @pytest.fixture(autouse=True)
+    def clusters_dir(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        for cluster in CLUSTERS:
+            registry.get_registry().save(cluster)
+    def test_destroy_match_runs_concurrently(self, monkeypatch):
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def fake_destroy(cluster_info):
+            with lock:
+                running.append(cluster_info['name'])
+                peak.append(len(running))
+            time.sleep(0.2)
+            with lock:
+                running.remove(cluster_info['name'])
+            return True
+
+        monkeypatch.setattr(lab2, 'destroy_cluster', fake_destroy)
+        result = CliRunner().invoke(lab2.cli, ['destroy', 'cluster', '--match', 'nightly-*', '--workers', '3', '-y'])
+        assert result.exit_code == 0, result.output
+        assert max(peak) == 3
+        assert 'keep-me' not in result.output
+
+    def test_destroy_all_aggregates_failures(self, monkeypatch):
+        def fake_destroy(cluster_info):
+            if cluster_info['name'] == 'nightly-2':
+                raise RuntimeError('boom')
+            return True
+
+        monkeypatch.setattr(lab2, 'destroy_cluster', fake_destroy)
+        result = CliRunner().invoke(lab2.cli, ['destroy', 'cluster', '--all', '-y'])
+        assert result.exit_code == 1
+        assert 'nightly-2' in result.output
+        assert '1 of 4 clusters could not be destroyed' in result.output
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='the fake az and terraform are scripts')
+class TestLabDestroy:
+    def test_destroy_forgets_the_plan(self, tmp_path, monkeypatch):
+        bin_dir = tmp_path / 'bin'
+        bin_dir.mkdir()
+        for tool, script in (('az', FAKE_AZ), ('terraform', '#!/bin/sh\nexit 0\n')):
+            (bin_dir / tool).write_text(script)
+            (bin_dir / tool).chmod((bin_dir / tool).stat().st_mode | stat.S_IEXEC)
+        monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+        (tmp_path / 'klab-cli' / 'cluster_credentials').mkdir(parents=True)
+        (tmp_path / 'providers' / 'Azure').mkdir(parents=True)
+        monkeypatch.chdir(tmp_path / 'klab-cli')
+        yamlio.dump([{'cluster_name': 'aks', 'cluster_region': 'eastus', 'cluster_resource_group': 'rg', 'cluster_provider': 'Azure'}],
+                    'cluster_credentials/clusters.yaml')
+        cache = terraform.PlanCache(str(tmp_path / 'providers' / 'Azure'), 'aks')
+        cache.write('digest', applied=True)
+        result = CliRunner().invoke(lab.cli, ['destroy', 'cluster', '--name', 'aks', '--region', 'eastus', '-y'])
+        assert result.exit_code == 0, result.output
+        assert 'The rest of the resources are destroyed' in result.output
+        # Creating aks again plans and applies instead of finding nothing to do
+        assert cache.read() == {}
@@ -0,0 +1,46 @@
+import os
+import threading
+
+import fileio
+
+
+class TestAtomicWrite:
+    def test_replaces_the_file_and_keeps_its_mode(self, tmp_path):
+        path = tmp_path / 'cache.json'
+        path.write_text('old')
+        path.chmod(0o600)
+        fileio.atomic_write(str(path), 'new')
+        assert path.read_text() == 'new'
+        assert path.stat().st_mode & 0o777 == 0o600
+        # The temporary file is renamed over the target, nothing is left next to it
+        assert os.listdir(tmp_path) == ['cache.json']
+
+    def test_failed_write_leaves_the_old_content(self, tmp_path):
+        path = tmp_path / 'cache.json'
+        path.write_text('old')
+        try:
+            fileio.atomic_write(str(path), None)
+        except TypeError:
+            pass
+        assert path.read_text() == 'old'
+        assert os.listdir(tmp_path) == ['cache.json']
+
+
+class TestLocked:
+    def test_read_modify_write_is_serialized(self, tmp_path):
+        path = str(tmp_path / 'counter')
+        fileio.atomic_write(path, '0')
+
+        def increment():
+            for _ in range(20):
+                with fileio.locked(path):
+                    with open(path) as counter:
+                        value = int(counter.read())
+                    fileio.atomic_write(path, str(value + 1))
+
+        threads = [threading.Thread(target=increment) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert open(path).read() == '80'
@@ -0,0 +1,53 @@
+import threading
+import time
+
+import pytest
+import lab2
+import runner
+from click.testing import CliRunner
+
+
+class TestConcurrentInit:
+    @pytest.fixture
+    def running(self):
+        # Number of providers being initialized, and the most at the same time
+        return {'now': 0, 'peak': 0}
+
+    @pytest.fixture(autouse=True)
+    def providers(self, monkeypatch, running):
+        lock = threading.Lock()
+
+        def slow_init(ok=True):
+            def fake_init(mirror=None, steps=None):
+                with lock:
+                    running['now'] += 1
+                    running['peak'] = max(running['peak'], running['now'])
+                time.sleep(0.3)
+                with lock:
+                    running['now'] -= 1
+                steps.append(('terraform init', 0.3, ok))
+                return ok
+            return fake_init
+
+        monkeypatch.setitem(lab2.PROVIDER_INITS, 'AWS', slow_init())
+        monkeypatch.setitem(lab2.PROVIDER_INITS, 'Azure', slow_init(ok=False))
+        monkeypatch.setitem(lab2.PROVIDER_INITS, 'GCP', slow_init())
+
+    def test_providers_are_initialized_at_the_same_time(self, running):
+        result = CliRunner().invoke(lab2.cli, ['init'])
+        # Azure failed, scripts see it in the exit code
+        assert result.exit_code == 1, result.output
+        assert running['peak'] == 3
+        rows = [line.split() for line in result.output.splitlines() if line.split()[:1] in (['AWS'], ['Azure'], ['GCP'])]
+        assert [(row[0], row[-1]) for row in rows if 'total' in row] == [('AWS', 'ok'), ('Azure', 'FAILED'), ('GCP', 'ok')]
+
+    def test_only_the_selected_providers(self):
+        result = CliRunner().invoke(lab2.cli, ['init', 'GCP'])
+        assert result.exit_code == 0, result.output
+        assert 'GCP' in result.output and 'AWS' not in result.output
+
+    def test_command_timings(self, monkeypatch):
+        monkeypatch.setattr(runner, 'stats', {'terraform init': (3, 4.5, 2.0), 'aws configure': (1, 0.25, 0.25)})
+        result = CliRunner().invoke(lab2.cli, ['init', 'GCP'])
+        rows = [line.split() for line in result.output.split('COMMAND')[1].splitlines()]
+        assert rows[1:] == [['terraform', 'init', '3', '4.50', '2.00'], ['aws', 'configure', '1', '0.25', '0.25']]
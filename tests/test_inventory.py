@@ -0,0 +1,140 @@
+import json
+import threading
+import time
+
+import pytest
+import inventory
+import lab2
+import registry
+import toolchain
+from click.testing import CliRunner
+
+REGIONS = [f'region-{i:02}' for i in range(20)]
+
+
+class FakeClouds:
+    # Answers the list commands of the cloud CLIs, every call takes a while like the real APIs
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+        self.eks = {'region-03': ['eks-a', 'eks-console']}
+        self.failing = set()
+
+    def run(self, argv, log_file=None, **kwargs):
+        with self.lock:
+            self.calls.append(argv)
+        time.sleep(0.2)
+        if argv[:3] == ['aws', 'ec2', 'describe-regions']:
+            output = json.dumps(REGIONS)
+        elif argv[:3] == ['aws', 'eks', 'list-clusters']:
+            region = argv[argv.index('--region') + 1]
+            if region in self.failing:
+                return inventory.runner.CommandResult(argv, 254, '', 'An error occurred (AccessDenied)\n', 0.2)
+            output = json.dumps({'clusters': self.eks.get(region, [])})
+        elif argv[:3] == ['az', 'aks', 'list']:
+            output = json.dumps([{'name': 'aks-a', 'location': 'westeurope', 'resourceGroup': 'rg'}])
+        else:
+            output = json.dumps([{'name': 'gke-a', 'location': 'europe-west1'}])
+        return inventory.runner.CommandResult(argv, 0, output, '', 0.2)
+
+
+@pytest.fixture
+def clouds(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(inventory.const, 'INVENTORY_CACHE_FILE', str(tmp_path / 'inventory.json'))
+    monkeypatch.setattr(inventory.const, 'AWS_CONFIG_FILE', str(tmp_path / 'aws-config'))
+    monkeypatch.setattr(inventory.const, 'GCP_CONFIG_FILE', str(tmp_path / 'gcloud-config'))
+    monkeypatch.delenv(inventory.const.INVENTORY_TTL_ENV, raising=False)
+    monkeypatch.delenv(inventory.const.INVENTORY_AWS_REGIONS_ENV, raising=False)
+    monkeypatch.setattr(inventory.toolchain, 'probe', lambda name, refresh=False: toolchain.Probe(name, installed=True))
+    fake = FakeClouds()
+    monkeypatch.setattr(inventory.runner, 'run', fake.run)
+    store = registry.get_registry()
+    # Created by the cli, imported with lab use, and deleted from the console
+    store.save({'name': 'eks-a', 'provider': 'AWS', 'region': 'region-03'})
+    store.update_state('eks-a', workspace='workspaces/eks-a')
+    store.save({'name': 'gke-a', 'provider': 'GCP', 'region': 'europe-west1', 'project': 'p'})
+    store.save({'name': 'eks-gone', 'provider': 'AWS', 'region': 'region-07'})
+    return fake
+
+
+class TestInventory:
+    def test_live_status_and_concurrency(self, clouds):
+        start = time.monotonic()
+        result = CliRunner().invoke(lab2.cli, ['show', 'cluster', '--live'])
+        assert result.exit_code == 0, result.output
+        # describe-regions, then the 20 regions, Azure and GCP at the same time
+        assert time.monotonic() - start < 1.5
+        rows = [line.split() for line in result.output.splitlines()[1:]]
+        assert rows == [
+            ['eks-a', 'AWS', 'region-03', 'managed'],
+            ['eks-console', 'AWS', 'region-03', 'unmanaged'],
+            ['eks-gone', 'AWS', 'region-07', 'orphaned'],
+            ['aks-a', 'Azure', 'westeurope', 'unmanaged'],
+            ['gke-a', 'GCP', 'europe-west1', 'imported'],
+        ]
+
+    def test_cached_until_the_ttl(self, clouds, monkeypatch):
+        CliRunner().invoke(lab2.cli, ['show', 'cluster', '--live'])
+        assert len(clouds.calls) == 23
+        clouds.calls.clear()
+        start = time.monotonic()
+        result = CliRunner().invoke(lab2.cli, ['show', 'cluster', '--live', '-p', 'AWS', '-n', 'eks-*'])
+        assert clouds.calls == [] and time.monotonic() - start < 0.2
+        assert [line.split()[0] for line in result.output.splitlines()[1:]] == ['eks-a', 'eks-console', 'eks-gone']
+        CliRunner().invoke(lab2.cli, ['show', 'cluster', '--live', '-p', 'GCP', '--refresh'])
+        assert [argv[0] for argv in clouds.calls] == ['gcloud']
+        monkeypatch.setenv(inventory.const.INVENTORY_TTL_ENV, '0')
+        clouds.calls.clear()
+        CliRunner().invoke(lab2.cli, ['show', 'cluster', '--live', '-p', 'Azure'])
+        assert [argv[0] for argv in clouds.calls] == ['az']
+
+    def test_failed_region_is_not_orphaned(self, clouds, monkeypatch):
+        monkeypatch.setenv(inventory.const.INVENTORY_AWS_REGIONS_ENV, 'region-03,region-07')
+        clouds.failing.add('region-07')
+        result = CliRunner().invoke(lab2.cli, ['show', 'cluster', '--live', '-p', 'AWS'])
+        assert 'Could not list the clusters of AWS/region-07: An error occurred (AccessDenied)' in result.output
+        assert ['eks-gone', 'AWS', 'region-07', 'unknown'] in [line.split() for line in result.output.splitlines()]
+        # Only the successful listings are cached
+        assert set(inventory.read_cache()) == {'AWS/region-03'}
+
+
+class TestGkeLocation:
+    @pytest.fixture
+    def gcloud(self, clouds, monkeypatch):
+        answers = {'list': (0, json.dumps([{'name': 'gke-a', 'location': 'europe-west1-c'},
+                                            {'name': 'gke-a', 'location': 'us-east1-b'}]), '')}
+
+        def run(argv, log_file=None, **kwargs):
+            clouds.calls.append(argv)
+            if argv[:3] == ['gcloud', 'container', 'clusters'] and argv[3] == 'list':
+                code, output, error = answers['list']
+            elif argv[:3] == ['gcloud', 'compute', 'zones']:
+                code, output, error = 0, json.dumps([{'name': f'europe-west1-{zone}'} for zone in 'bcd']), ''
+            elif argv[:4] == ['gcloud', 'container', 'clusters', 'describe']:
+                time.sleep(0.3)
+                found = argv[argv.index('--location') + 1] == 'europe-west1-d'
+                code, output, error = (0, 'europe-west1-d', '') if found else (1, '', 'NOT_FOUND')
+            else:
+                code, output, error = 0, '', ''
+            return inventory.runner.CommandResult(argv, code, output, error, 0.1)
+        monkeypatch.setattr(inventory.runner, 'run', run)
+        clouds.calls.clear()
+        return answers
+
+    def test_one_list_call_then_the_registry(self, clouds, gcloud):
+        # The cluster of the same name in another region is ignored
+        assert lab2.gke_location('gke-a', 'europe-west1', 'p') == 'europe-west1-c'
+        assert [argv[3] for argv in clouds.calls] == ['list']
+        assert registry.get_registry().get_state('gke-a')['location'] == 'europe-west1-c'
+        clouds.calls.clear()
+        assert lab2.gke_location('gke-a', 'europe-west1', 'p') == 'europe-west1-c'
+        assert clouds.calls == []
+
+    def test_zones_are_probed_at_the_same_time(self, gcloud):
+        gcloud['list'] = (1, '', 'PERMISSION_DENIED')
+        start = time.monotonic()
+        assert inventory.gke_location('gke-a', 'p', 'europe-west1') == 'europe-west1-d'
+        # The region and its three zones, described at the same time
+        assert time.monotonic() - start < 0.9
+
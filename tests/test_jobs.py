@@ -0,0 +1,105 @@
+import os
+import time
+
+import pytest
+import jobs
+import lab2
+import registry
+from click.testing import CliRunner
+
+
+@pytest.fixture(autouse=True)
+def store(tmp_path, monkeypatch):
+    # The registry is relative to the working directory, the jobs started by the tests inherit it
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(jobs.utils, 'logs_dir', str(tmp_path / 'logs'))
+    monkeypatch.setattr(jobs.const, 'JOB_POLL_INTERVAL', 0.1)
+    return registry.get_registry()
+
+
+class TestJobs:
+    def test_exit_code_is_reaped(self, store):
+        ok = jobs.submit('list', None, ['jobs', 'list'])
+        failed = jobs.submit('logs', None, ['logs', '--since', 'soon'])
+        assert ok['status'] == jobs.RUNNING and ok['pid']
+        done = jobs.wait([ok['id'], failed['id']], timeout=60)
+        assert [(job['status'], job['exit_code']) for job in done] == [(jobs.SUCCEEDED, 0), (jobs.FAILED, 2)]
+        with open(done[1]['log_file']) as log_file:
+            assert '--since' in log_file.read()
+
+    def test_cancel(self, store):
+        job = jobs.submit('logs', None, ['logs', '--follow'])
+        time.sleep(0.5)
+        assert jobs.cancel(job['id'])
+        assert not jobs.cancel(job['id'])
+        job = jobs.get(job['id'])
+        assert job['status'] == jobs.CANCELLED and job['finished']
+        # The supervisor and the command are gone
+        assert jobs.wait([job['id']], timeout=10)[0]['status'] == jobs.CANCELLED
+        for _ in range(50):
+            if not jobs.alive(job['pid']):
+                break
+            time.sleep(0.1)
+        assert not jobs.alive(job['pid'])
+
+    def test_cancel_stops_the_commands(self, store, tmp_path, monkeypatch):
+        # terraform init runs in a process group of its own, out of reach of the signal sent to the job
+        bin_dir = tmp_path / 'bin'
+        bin_dir.mkdir()
+        pid_file = tmp_path / 'terraform.pid'
+        for tool, body in (('aws', 'echo aws-cli/2.15.0'),
+                           ('terraform', f'[ "$1" = version ] && echo Terraform v1.6.0 && exit 0\necho $$ > {pid_file}\nexec sleep 60')):
+            (bin_dir / tool).write_text(f'#!/bin/sh\n{body}\n')
+            (bin_dir / tool).chmod(0o755)
+        (tmp_path / '.aws').mkdir()
+        (tmp_path / '.aws' / 'credentials').write_text('[default]\n')
+        monkeypatch.setenv('HOME', str(tmp_path))
+        monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+        job = jobs.submit('init', None, ['init', 'AWS'])
+        for _ in range(100):
+            if pid_file.exists() and pid_file.read_text().strip():
+                break
+            time.sleep(0.1)
+        terraform_pid = int(pid_file.read_text())
+        assert jobs.cancel(job['id'])
+        for _ in range(50):
+            if not jobs.alive(terraform_pid):
+                break
+            time.sleep(0.1)
+        assert not jobs.alive(terraform_pid)
+
+    def test_lost_supervisor(self, store):
+        job_id = store.add_job('create', 'eks', ['create'], jobs.RUNNING)
+        store.update_job(job_id, pid=2 ** 22 + 1)
+        assert jobs.get(job_id)['status'] == jobs.LOST
+
+
+class TestJobsCommands:
+    def test_create_in_the_background(self, monkeypatch):
+        submitted = []
+        monkeypatch.setattr(jobs, 'submit', lambda kind, cluster, argv: submitted.append((kind, cluster, argv)) or
+                            {'id': 7, 'pid': 42, 'log_file': 'logs/jobs/7.log'})
+        result = CliRunner().invoke(lab2.cli, ['create', 'cluster', '-n', 'eks', '-p', 'AWS', '-r', 'eu-west-1', '--background'])
+        assert result.exit_code == 0, result.output
+        assert 'lab jobs wait 7' in result.output
+        # The job runs the same command in the foreground and waits for the cluster to be ready
+        assert submitted == [('create', 'eks', ['--log-level=INFO', 'create', 'cluster', '--name', 'eks', '--provider', 'AWS',
+                                                '--region', 'eu-west-1', '--wait'])]
+
+    def test_destroy_in_the_background_asks_first(self, monkeypatch):
+        submitted = []
+        monkeypatch.setattr(jobs, 'submit', lambda kind, cluster, argv: submitted.append(argv) or
+                            {'id': 1, 'pid': 42, 'log_file': 'logs/jobs/1.log'})
+        result = CliRunner().invoke(lab2.cli, ['destroy', 'cluster', '--match', 'nightly-*', '-b'], input='n\n')
+        assert result.exit_code == 1 and submitted == []
+        result = CliRunner().invoke(lab2.cli, ['destroy', 'cluster', '--match', 'nightly-*', '-b'], input='y\n')
+        assert result.exit_code == 0, result.output
+        assert submitted == [['--log-level=INFO', 'destroy', 'cluster', '--match', 'nightly-*', '--workers', '4', '--yes']]
+
+    def test_list_and_wait(self, store):
+        job_id = store.add_job('create', 'eks', ['create'], jobs.RUNNING)
+        store.update_job(job_id, only_if=jobs.RUNNING, status=jobs.FAILED, exit_code=1, finished=time.time(), log_file='1.log')
+        result = CliRunner().invoke(lab2.cli, ['jobs', 'list'])
+        assert result.output.splitlines()[1].split()[:5] == [str(job_id), 'create', 'eks', 'failed', '1']
+        assert CliRunner().invoke(lab2.cli, ['jobs', 'wait', str(job_id)]).exit_code == 1
+        assert 'not found' in CliRunner().invoke(lab2.cli, ['jobs', 'wait', '99']).output
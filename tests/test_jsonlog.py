@@ -0,0 +1,67 @@
+import json
+import logging
+
+import pytest
+import jsonlog
+import utils
+
+
+def read(path) -> list:
+    jsonlog.flush()
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+class TestJsonLog:
+    @pytest.fixture(autouse=True)
+    def level(self):
+        yield
+        jsonlog.set_level('INFO')
+
+    def test_records_carry_the_bound_fields(self, tmp_path):
+        log_file = str(tmp_path / 'logs' / 'aws.log')
+        with jsonlog.bind(provider='AWS', cluster='eks'):
+            jsonlog.write(log_file, 'creating')
+            with jsonlog.bind(cluster=None):
+                jsonlog.write(log_file, 'applied', command='terraform apply')
+        jsonlog.write(log_file, 'done', logging.WARNING)
+        lines = read(log_file)
+        # The timestamp comes first, so the lines sort and bisect by their prefix
+        assert all(line.startswith('{"ts": "') for line in open(log_file))
+        assert [(line['level'], line.get('provider'), line.get('cluster'), line.get('command'), line['message']) for line in lines] == [
+            ('INFO', 'AWS', 'eks', None, 'creating'),
+            ('INFO', 'AWS', 'eks', 'terraform apply', 'applied'),
+            ('WARNING', None, None, None, 'done'),
+        ]
+
+    def test_log_level(self, tmp_path, capsys):
+        log_file = str(tmp_path / 'kubelab.log')
+        jsonlog.set_level('warning')
+        jsonlog.write(log_file, 'hidden')
+        jsonlog.write(log_file, 'kept', logging.ERROR)
+        assert [line['message'] for line in read(log_file)] == ['kept']
+        jsonlog.set_level('DEBUG')
+        jsonlog.write(log_file, 'details', logging.DEBUG)
+        assert [line['message'] for line in read(log_file)] == ['kept', 'details']
+
+    def test_terminal_output_stays_readable(self, tmp_path, monkeypatch, capsys):
+        monkeypatch.setattr(utils, 'provider_log_file', lambda provider: str(tmp_path / f'{provider}.log'))
+        utils.log("Cluster eks has been successfully created.", 'AWS', cluster='eks')
+        assert capsys.readouterr().out.endswith("] Cluster eks has been successfully created.\n\n")
+        assert read(tmp_path / 'AWS.log')[0]['cluster'] == 'eks'
+
+    def test_rotation(self, tmp_path, monkeypatch):
+        # The size limit is read when the file is opened, a fresh listener picks up the small one
+        jsonlog.stop()
+        monkeypatch.setattr(jsonlog.const, 'LOG_MAX_BYTES', 1024)
+        monkeypatch.setattr(jsonlog.const, 'LOG_BACKUP_COUNT', 2)
+        log_file = tmp_path / 'gcp.log'
+        try:
+            for i in range(100):
+                jsonlog.write(str(log_file), f'line {i:03}')
+            lines = read(log_file)
+        finally:
+            jsonlog.stop()
+        assert lines[-1]['message'] == 'line 099'
+        assert sorted(p.name for p in tmp_path.iterdir()) == ['gcp.log', 'gcp.log.1', 'gcp.log.2']
+        assert all(p.stat().st_size <= 1024 for p in tmp_path.iterdir())
@@ -0,0 +1,242 @@
+import json
+import tempfile
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import kubeapply
+
+MANIFEST = """
+apiVersion: apps/v1
+kind: Deployment
+metadata:
+  name: nginx
+spec:
+  replicas: 2
+---
+apiVersion: v1
+kind: Service
+metadata:
+  name: nginx
+  namespace: web
+spec:
+  type: LoadBalancer
+---
+"""
+
+DISCOVERY = {
+    '/version': {'major': '1', 'minor': '30', 'gitVersion': 'v1.30.0'},
+    '/api': {'kind': 'APIVersions', 'versions': ['v1']},
+    '/apis': {'kind': 'APIGroupList', 'groups': [
+        {'name': 'apps', 'versions': [{'groupVersion': 'apps/v1', 'version': 'v1'}],
+         'preferredVersion': {'groupVersion': 'apps/v1', 'version': 'v1'}}
+    ]},
+    '/api/v1': {'kind': 'APIResourceList', 'groupVersion': 'v1', 'resources': [
+        {'name': 'services', 'singularName': 'service', 'namespaced': True, 'kind': 'Service', 'verbs': ['get', 'patch', 'delete']}
+    ]},
+    '/apis/apps/v1': {'kind': 'APIResourceList', 'groupVersion': 'apps/v1', 'resources': [
+        {'name': 'deployments', 'singularName': 'deployment', 'namespaced': True, 'kind': 'Deployment', 'verbs': ['get', 'patch', 'delete']}
+    ]},
+}
+
+
+class FakeApiServer(BaseHTTPRequestHandler):
+    # Just enough of the Kubernetes API for discovery, server-side apply and delete
+    protocol_version = 'HTTP/1.1'
+    requests = []
+    # Responses of the list requests per path (the last one is repeated) and the events of each watch request
+    lists = {}
+    watches = []
+
+    def reply(self, code: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.requests.append(('GET', self.path))
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path in DISCOVERY:
+            self.reply(200, DISCOVERY[url.path])
+        elif query.get('watch') == ['True']:
+            events = self.watches.pop(0) if self.watches else []
+            data = ''.join(json.dumps(event) + '\n' for event in events).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        elif url.path in self.lists:
+            responses = self.lists[url.path]
+            self.reply(200, responses.pop(0) if len(responses) > 1 else responses[0])
+        else:
+            self.reply(404, {})
+
+    def do_PATCH(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.requests.append(('PATCH', self.path, self.headers['Content-Type']))
+        self.reply(200, body)
+
+    def do_DELETE(self):
+        self.requests.append(('DELETE', self.path))
+        if 'services' in self.path:
+            self.reply(404, {'kind': 'Status', 'reason': 'NotFound'})
+        else:
+            self.reply(200, {'kind': 'Status', 'status': 'Success'})
+
+    def log_message(self, *args):
+        pass
+
+
+class TestKubeApply:
+    @pytest.fixture
+    def manifest(self, tmp_path):
+        path = tmp_path / 'deployment.yaml'
+        path.write_text(MANIFEST)
+        return str(path)
+
+    @pytest.fixture
+    def api_server(self, tmp_path, monkeypatch):
+        pytest.importorskip('kubernetes')
+        server = ThreadingHTTPServer(('127.0.0.1', 0), FakeApiServer)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        kubeconfig = tmp_path / 'kubeconfig'
+        kubeconfig.write_text(json.dumps({
+            'apiVersion': 'v1',
+            'kind': 'Config',
+            'clusters': [{'name': 'lab', 'cluster': {'server': f'http://127.0.0.1:{server.server_port}'}}],
+            'users': [{'name': 'lab', 'user': {'token': 'token'}}],
+            'contexts': [{'name': 'lab', 'context': {'cluster': 'lab', 'user': 'lab', 'namespace': 'apps'}}],
+            'current-context': 'lab',
+        }))
+        monkeypatch.setenv('KUBECONFIG', str(kubeconfig))
+        monkeypatch.delenv('KLAB_KUBECTL', raising=False)
+        monkeypatch.setattr(kubeapply, 'clients', {})
+        # The client caches its discovery in the temp dir
+        monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+        FakeApiServer.requests = []
+        FakeApiServer.lists = {}
+        FakeApiServer.watches = []
+        yield FakeApiServer.requests
+        server.shutdown()
+
+    def test_load_manifests(self, manifest, tmp_path):
+        assert [m['kind'] for m in kubeapply.load_manifests(manifest)] == ['Deployment', 'Service']
+        listed = tmp_path / 'list.yaml'
+        listed.write_text('apiVersion: v1\nkind: List\nitems:\n- {apiVersion: v1, kind: Service, metadata: {name: a}}\n')
+        assert [m['metadata']['name'] for m in kubeapply.load_manifests(str(listed))] == ['a']
+
+    def test_server_side_apply(self, manifest, api_server):
+        assert kubeapply.apply_manifest(manifest)
+        patches = [r for r in api_server if r[0] == 'PATCH']
+        # Objects without a namespace go to the one of the context
+        assert patches == [
+            ('PATCH', '/apis/apps/v1/namespaces/apps/deployments/nginx?fieldManager=klab&force=True', 'application/apply-patch+yaml'),
+            ('PATCH', '/api/v1/namespaces/web/services/nginx?fieldManager=klab&force=True', 'application/apply-patch+yaml'),
+        ]
+        # The client and its discovery are reused, applying again costs one request per object
+        del api_server[:]
+        assert kubeapply.apply_manifest(manifest, namespace='other')
+        assert [r[1].split('?')[0] for r in api_server] == ['/apis/apps/v1/namespaces/other/deployments/nginx',
+                                                           '/api/v1/namespaces/web/services/nginx']
+
+    def test_delete_ignores_missing_objects(self, manifest, api_server):
+        assert kubeapply.delete_manifest(manifest)
+        deletes = [r[1].split('?')[0] for r in api_server if r[0] == 'DELETE']
+        assert deletes == ['/api/v1/namespaces/web/services/nginx', '/apis/apps/v1/namespaces/apps/deployments/nginx']
+
+    def test_kubectl_fallback(self, manifest, monkeypatch):
+        calls = []
+        monkeypatch.setattr(kubeapply, 'kubectl', lambda action, path, namespace=None: calls.append((action, path)) or True)
+        monkeypatch.setenv('KLAB_KUBECTL', '1')
+        assert kubeapply.apply_manifest(manifest)
+        monkeypatch.delenv('KLAB_KUBECTL')
+        monkeypatch.setenv('KUBECONFIG', str(manifest) + '.missing')
+        assert kubeapply.delete_manifest(manifest)
+        assert calls == [('apply', manifest), ('delete', manifest)]
+
+    def watch_versions(self, api_server) -> list:
+        return [parse_qs(urlparse(r[1]).query).get('resourceVersion') for r in api_server if 'watch=True' in r[1]]
+
+    def test_wait_for_rollout_and_load_balancer(self, manifest, api_server):
+        FakeApiServer.lists = {
+            '/apis/apps/v1/namespaces/apps/deployments': [object_list('10', deployment(ready=0))],
+            '/api/v1/namespaces/web/services': [object_list('11', service())],
+        }
+        FakeApiServer.watches = [
+            [event('MODIFIED', deployment('12', ready=1)), event('MODIFIED', deployment('13', ready=2))],
+            [event('MODIFIED', service('14', ingress=[{'hostname': 'lb.example.com'}]))],
+        ]
+        assert kubeapply.wait_manifest(manifest, timeout=30)
+        # One list and one watch per object, each watch starting from the version of its list
+        assert self.watch_versions(api_server) == [['10'], ['11']]
+
+    def test_watch_resumes_and_lists_again_when_expired(self, manifest, api_server):
+        FakeApiServer.lists = {'/apis/apps/v1/namespaces/apps/deployments': [
+            object_list('10', deployment(ready=0)),
+            object_list('20', deployment(ready=2)),
+        ]}
+        FakeApiServer.watches = [
+            [event('MODIFIED', deployment('12', ready=1))],
+            [{'type': 'ERROR', 'object': {'kind': 'Status', 'code': 410, 'reason': 'Expired', 'message': 'too old'}}],
+        ]
+        result = kubeapply.watch_ready(kubeapply.get_client(), deployment_resource(), 'apps', 'nginx',
+                                       time.monotonic() + 30, name='nginx')
+        assert result.done and result.polls == 1
+        assert self.watch_versions(api_server) == [['10'], ['12']]
+
+    def test_wait_timeout(self, manifest, api_server):
+        FakeApiServer.lists = {'/apis/apps/v1/namespaces/apps/deployments': [object_list('10', deployment(ready=0))]}
+        result = kubeapply.watch_ready(kubeapply.get_client(), deployment_resource(), 'apps', 'nginx',
+                                       time.monotonic() + 1, name='nginx')
+        assert result.reason == 'timeout'
+
+
+def deployment_resource():
+    return kubeapply.get_client().dynamic.resources.get(api_version='apps/v1', kind='Deployment')
+
+
+def deployment(resource_version='1', ready=0):
+    return {
+        'apiVersion': 'apps/v1', 'kind': 'Deployment',
+        'metadata': {'name': 'nginx', 'generation': 2, 'resourceVersion': resource_version},
+        'spec': {'replicas': 2},
+        'status': {'observedGeneration': 2, 'replicas': 2, 'updatedReplicas': ready, 'availableReplicas': ready},
+    }
+
+
+def service(resource_version='1', ingress=None):
+    return {
+        'apiVersion': 'v1', 'kind': 'Service',
+        'metadata': {'name': 'nginx', 'namespace': 'web', 'resourceVersion': resource_version},
+        'spec': {'type': 'LoadBalancer'},
+        'status': {'loadBalancer': {'ingress': ingress} if ingress else {}},
+    }
+
+
+def object_list(resource_version: str, *items) -> dict:
+    return {'kind': 'List', 'apiVersion': 'v1', 'metadata': {'resourceVersion': resource_version}, 'items': list(items)}
+
+
+def event(event_type: str, item: dict) -> dict:
+    return {'type': event_type, 'object': item}
+
+
+class TestReadiness:
+    def test_deployment_ready(self):
+        assert not kubeapply.deployment_ready(deployment(ready=1))
+        assert kubeapply.deployment_ready(deployment(ready=2))
+        stale = deployment(ready=2)
+        stale['metadata']['generation'] = 3
+        assert not kubeapply.deployment_ready(stale)
+
+    def test_service_ready(self):
+        assert not kubeapply.service_ready(service())
+        assert kubeapply.service_ready(service(ingress=[{'ip': '10.0.0.1'}]))
+        assert kubeapply.service_ready({'spec': {'type': 'ClusterIP'}})
@@ -0,0 +1,102 @@
+import os
+
+import pytest
+import yamlio
+import kubeconfig
+import lab2
+import registry
+from click.testing import CliRunner
+
+KUBECONFIG = {
+    'apiVersion': 'v1',
+    'kind': 'Config',
+    'clusters': [{'name': 'arn:eks/one', 'cluster': {'server': 'https://one'}},
+                 {'name': 'gke_two', 'cluster': {'server': 'https://two'}}],
+    'users': [{'name': 'arn:eks/one', 'user': {'exec': {'command': 'aws'}}},
+              {'name': 'gke_two', 'user': {'exec': {'command': 'gke-gcloud-auth-plugin'}}}],
+    'contexts': [{'name': 'arn:eks/one', 'context': {'cluster': 'arn:eks/one', 'user': 'arn:eks/one'}},
+                 {'name': 'gke_two', 'context': {'cluster': 'gke_two', 'user': 'gke_two'}}],
+    'current-context': 'gke_two',
+    'preferences': {},
+}
+
+
+@pytest.fixture
+def kubeconfig_file(tmp_path, monkeypatch):
+    path = tmp_path / '.kube' / 'config'
+    path.parent.mkdir()
+    yamlio.dump(KUBECONFIG, str(path))
+    monkeypatch.setenv('KUBECONFIG', str(path))
+    return path
+
+
+class TestKubeconfig:
+    def test_extract_and_use_context(self, kubeconfig_file):
+        entry = kubeconfig.extract(kubeconfig.load(), 'arn:eks/one')
+        assert entry['cluster']['cluster']['server'] == 'https://one' and entry['user']['user']['exec']['command'] == 'aws'
+        assert kubeconfig.use_context(entry)
+        config = kubeconfig.load()
+        assert config['current-context'] == 'arn:eks/one'
+        # Everything else is untouched
+        assert {key: value for key, value in config.items() if key != 'current-context'} == \
+            {key: value for key, value in KUBECONFIG.items() if key != 'current-context'}
+
+    def test_entry_is_restored_in_a_fresh_kubeconfig(self, kubeconfig_file, tmp_path):
+        entry = kubeconfig.extract(kubeconfig.load())
+        fresh = tmp_path / 'fresh' / 'config'
+        assert kubeconfig.use_context(entry, str(fresh))
+        assert kubeconfig.extract(kubeconfig.load(str(fresh))) == entry
+        assert os.stat(fresh).st_mode & 0o777 == 0o600
+        # kubectl takes <kubeconfig>.lock exclusively, it must not be left behind
+        assert not os.path.exists(f"{fresh}.lock") and not os.path.exists(f"{kubeconfig_file}.lock")
+
+    def test_entry_without_credentials_needs_the_user(self, kubeconfig_file, tmp_path):
+        entry = kubeconfig.without_credentials(kubeconfig.extract(kubeconfig.load(), 'arn:eks/one'))
+        assert 'user' not in entry
+        assert kubeconfig.use_context(entry)
+        fresh = tmp_path / 'fresh' / 'config'
+        assert not kubeconfig.use_context(entry, str(fresh))
+        assert not fresh.exists()
+
+    def test_entries_in_the_file_are_kept(self, kubeconfig_file):
+        # The cached entry is older than the file, e.g. the endpoint and CA were rotated by update-kubeconfig since
+        stale = kubeconfig.extract(kubeconfig.load(), 'arn:eks/one')
+        stale['cluster'] = {'name': 'arn:eks/one', 'cluster': {'server': 'https://old-one', 'certificate-authority-data': 'old'}}
+        assert kubeconfig.use_context(stale)
+        config = kubeconfig.load()
+        assert config['current-context'] == 'arn:eks/one'
+        assert config['clusters'] == KUBECONFIG['clusters']
+
+
+class TestUse:
+    @pytest.fixture(autouse=True)
+    def cluster(self, tmp_path, monkeypatch, kubeconfig_file):
+        monkeypatch.chdir(tmp_path)
+        registry.get_registry().save({'name': 'two', 'provider': 'GCP', 'region': 'europe-west1', 'project': 'p'})
+        # A zonal cluster whose location was resolved before
+        registry.get_registry().update_state('two', location='europe-west1-b')
+
+    def test_credentials_are_fetched_once(self, monkeypatch):
+        calls = []
+        monkeypatch.setattr(lab2.runner, 'run', lambda argv, *args, **kwargs: calls.append(argv) or lab2.runner.CommandResult(argv, 0, '', '', 0.1))
+        for options in ([], [], ['--refresh']):
+            result = CliRunner().invoke(lab2.cli, ['use', 'cluster', '-n', 'two', *options])
+            assert result.exit_code == 0, result.output
+        assert [argv[:4] for argv in calls] == [['gcloud', 'container', 'clusters', 'get-credentials']] * 2
+        assert calls[0][calls[0].index('--location') + 1] == 'europe-west1-b'
+        cached = registry.get_registry().get_state('two')['kubeconfig']
+        assert cached['context']['name'] == 'gke_two' and 'user' not in cached
+
+    def test_cached_switch_edits_the_current_context(self, kubeconfig_file):
+        registry.get_registry().update_state('two', kubeconfig=kubeconfig.extract(kubeconfig.load(), 'arn:eks/one'))
+        result = CliRunner().invoke(lab2.cli, ['use', 'cluster', '-n', 'two'])
+        assert result.exit_code == 0, result.output
+        assert kubeconfig.load()['current-context'] == 'arn:eks/one'
+
+    def test_missing_credentials_are_fetched_again(self, kubeconfig_file, monkeypatch):
+        calls = []
+        monkeypatch.setattr(lab2.runner, 'run', lambda argv, *args, **kwargs: calls.append(argv) or lab2.runner.CommandResult(argv, 0, '', '', 0.1))
+        registry.get_registry().update_state('two', kubeconfig=kubeconfig.without_credentials(kubeconfig.extract(kubeconfig.load())))
+        kubeconfig_file.write_text(yamlio.dumps({**KUBECONFIG, 'users': []}))
+        assert CliRunner().invoke(lab2.cli, ['use', 'cluster', '-n', 'two']).exit_code == 0
+        assert [argv[:4] for argv in calls] == [['gcloud', 'container', 'clusters', 'get-credentials']]
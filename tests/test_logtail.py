@@ -0,0 +1,109 @@
+import json
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+import lab2
+import logtail
+import registry
+from click.testing import CliRunner
+
+START = datetime(2024, 5, 1, 10, 0, 0)
+
+
+def record(i: int, cluster='eks') -> str:
+    ts = (START + timedelta(seconds=i)).isoformat(timespec='milliseconds')
+    return json.dumps({'ts': ts, 'level': 'INFO', 'provider': 'AWS', 'cluster': cluster, 'message': f'line {i}'})
+
+
+@pytest.fixture
+def log_path(tmp_path):
+    path = tmp_path / 'kubelab-aws.log'
+    with open(path, 'w') as f:
+        for i in range(5000):
+            f.write(record(i, 'eks' if i % 2 else 'other') + '\n')
+            if i % 100 == 0:
+                # e.g. a multi-line error of a command, continuation lines have no timestamp
+                f.write('  continued\n')
+    return path
+
+
+class TestLogTail:
+    def test_parse_since(self):
+        assert logtail.parse_since('90s', now=START) == '2024-05-01 09:58:30'
+        assert logtail.parse_since('2h', now=START) == '2024-05-01 08:00:00'
+        assert logtail.parse_since('2024-05-01T10:30') == '2024-05-01 10:30:00'
+        with pytest.raises(ValueError):
+            logtail.parse_since('yesterday')
+
+    def test_seek_since_bisects(self, log_path, monkeypatch):
+        reads = []
+        next_timestamp = logtail.next_timestamp
+        monkeypatch.setattr(logtail, 'next_timestamp', lambda f, offset: reads.append(offset) or next_timestamp(f, offset))
+        with open(log_path, 'rb') as f:
+            logtail.seek_since(f, '2024-05-01 11:00:00')
+            assert json.loads(f.readline())['message'] == 'line 3600'
+            assert len(reads) < 30
+            # Older than every line, and newer than every line
+            assert logtail.seek_since(f, '2024-01-01 00:00:00') == 0
+            assert logtail.seek_since(f, '2025-01-01 00:00:00') == log_path.stat().st_size
+        assert logtail.line_time(b'[2024-05-01 10:00:00] plain line') == '2024-05-01 10:00:00'
+
+    def test_last_lines_reads_from_the_end(self, log_path, monkeypatch):
+        monkeypatch.setattr(logtail.const, 'LOG_TAIL_BLOCK', 100)
+        with open(log_path, 'rb') as f:
+            assert [json.loads(line)['message'] for line in logtail.last_lines(f, 3)] == ['line 4997', 'line 4998', 'line 4999']
+            eks = logtail.last_lines(f, 2, logtail.cluster_filter('eks'))
+            assert [json.loads(line)['message'] for line in eks] == ['line 4997', 'line 4999']
+            assert f.tell() == log_path.stat().st_size
+
+    def test_follow_survives_rotation(self, tmp_path):
+        path = tmp_path / 'kubelab-gcp.log'
+        stop = threading.Event()
+        lines = logtail.follow(str(path), 0, stop=stop, watcher=logtail.PollingWatcher(0.01))
+        path.write_text('first\nsec')
+        assert next(lines) == 'first'
+        with open(path, 'a') as f:
+            f.write('ond\n')
+        # Only complete lines are returned
+        assert next(lines) == 'second'
+        path.rename(tmp_path / 'kubelab-gcp.log.1')
+        path.write_text('third\n')
+        assert next(lines) == 'third'
+        stop.set()
+        assert list(lines) == []
+
+    def test_inotify_watcher_wakes_up_on_writes(self, tmp_path):
+        try:
+            watcher = logtail.InotifyWatcher(str(tmp_path), timeout=5)
+        except (OSError, AttributeError):
+            pytest.skip('inotify is not available')
+        threading.Timer(0.1, (tmp_path / 'kubelab.log').write_text, args=('line\n',)).start()
+        start = datetime.now()
+        watcher.wait()
+        watcher.close()
+        assert datetime.now() - start < timedelta(seconds=4)
+
+
+class TestLogsCommand:
+    @pytest.fixture(autouse=True)
+    def logs(self, tmp_path, monkeypatch, log_path):
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(lab2.utils, 'provider_log_file', lambda provider=None: str(log_path) if provider == 'AWS' else str(tmp_path / 'missing.log'))
+        registry.get_registry().save({'name': 'eks', 'provider': 'AWS', 'region': 'eu-west-1'})
+
+    def test_cluster_lines(self):
+        result = CliRunner().invoke(lab2.cli, ['logs', '--cluster', 'eks', '-n', '2'])
+        assert result.exit_code == 0, result.output
+        assert result.output == '[2024-05-01 11:23:17] [eks] line 4997\n[2024-05-01 11:23:19] [eks] line 4999\n'
+
+    def test_since(self):
+        result = CliRunner().invoke(lab2.cli, ['logs', '--provider', 'AWS', '--since', '2024-05-01 11:23:17'])
+        assert result.output.splitlines() == [f'[2024-05-01 11:23:{s}] [{c}] line {i}' for s, c, i in
+                                              ((17, 'eks', 4997), (18, 'other', 4998), (19, 'eks', 4999))]
+        result = CliRunner().invoke(lab2.cli, ['logs', '--since', 'soon'])
+        assert result.exit_code == 2 and '--since' in result.output
+
+    def test_missing_log(self):
+        result = CliRunner().invoke(lab2.cli, ['logs'])
+        assert 'There is no log' in result.output
@@ -0,0 +1,203 @@
+import threading
+import time
+
+import pytest
+import lab2
+import lab2_products
+import reconcile
+import registry
+from click.testing import CliRunner
+
+SPEC = """
+name: sample
+provider: AWS
+region: us-east-1
+products:
+  - name: nginx
+    type: operator
+    version: 1.0.0
+    replicas: 2
+    port: 80
+  - name: istio
+    type: deployment
+    version: 1.20
+"""
+CATALOG = """
+- product: nginx
+  available_types: [deployment, operator]
+- product: istio
+  available_types: [deployment, operator]
+"""
+
+
+@pytest.fixture
+def products(tmp_path, monkeypatch):
+    # The catalog of the spec products, the clusters are created and the products installed from the temporary directory
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'catalog').mkdir()
+    (tmp_path / 'catalog' / 'catalog.yaml').write_text(CATALOG)
+
+
+@pytest.fixture
+def running():
+    # Number of products being installed or removed, and the most at the same time
+    return {'now': 0, 'peak': 0}
+
+
+@pytest.fixture
+def cluster(tmp_path, monkeypatch, products, running):
+    # Every action is recorded instead of reaching the clouds, installs take a while like the real ones
+    calls = []
+    failing = set()
+    lock = threading.Lock()
+
+    def create_cluster(name, provider, region, resource_group, project, wait, replan=False):
+        calls.append(('create', name))
+        registry.get_registry().save({'name': name, 'provider': provider, 'region': region})
+        return True
+
+    def product(kind):
+        def action(product):
+            with lock:
+                running['now'] += 1
+                running['peak'] = max(running['peak'], running['now'])
+            time.sleep(0.4)
+            with lock:
+                running['now'] -= 1
+                calls.append((kind, product['name']))
+            return product['name'] not in failing
+        return action
+
+    monkeypatch.setattr(lab2, 'create_cluster', create_cluster)
+    monkeypatch.setattr(lab2, 'switch_to_cluster', lambda *args, **kwargs: calls.append(('use',)) or True)
+    monkeypatch.setattr(lab2_products, 'install_product', product('install'))
+    monkeypatch.setattr(lab2_products, 'uninstall_product', product('uninstall'))
+    spec_file = tmp_path / 'cluster.yaml'
+    spec_file.write_text(SPEC)
+    return calls, failing, spec_file
+
+
+class TestPlan:
+    def test_minimal_diff(self):
+        spec = reconcile.parse_spec({'name': 'eks', 'provider': 'AWS', 'region': 'eu-west-1', 'products': [
+            {'name': 'nginx', 'type': 'deployment', 'version': 'latest'},
+            {'name': 'istio', 'version': 1.20},
+            {'name': 'karpenter', 'replicas': 3}]})
+        recorded = {'name': 'eks', 'provider': 'AWS', 'region': 'eu-west-1', 'products': [
+            {'name': 'nginx', 'type': 'deployment', 'version': 'latest'},
+            {'name': 'istio', 'version': '1.19'},
+            {'name': 'falco'}]}
+        actions = reconcile.plan(spec, recorded)
+        assert [(action.kind, action.name) for action in actions] == [('update', 'istio'), ('add', 'karpenter'), ('remove', 'falco')]
+        assert actions[0].product['version'] == '1.2' and actions[0].current['version'] == '1.19'
+        # Gone from the cloud: created again with all its products
+        assert [action.kind for action in reconcile.plan(spec, recorded, exists=False)] == ['create', 'add', 'add', 'add']
+        with pytest.raises(ValueError):
+            reconcile.plan(spec, {**recorded, 'region': 'us-east-1'})
+
+    def test_dependencies(self):
+        spec = reconcile.parse_spec({'name': 'eks', 'provider': 'AWS', 'region': 'eu-west-1', 'products': [{'name': 'gateway'}]})
+        with pytest.raises(ValueError, match='add it to the spec'):
+            reconcile.check_dependencies(spec, {'gateway': ['istio']})
+        actions = [reconcile.Action(reconcile.ADD, {'name': 'gateway'}), reconcile.Action(reconcile.UPDATE, {'name': 'istio'}),
+                   reconcile.Action(reconcile.REMOVE, {'name': 'mesh'}), reconcile.Action(reconcile.REMOVE, {'name': 'crds'})]
+        # Installed after the products they need, removed before them
+        assert reconcile.action_dependencies(actions, {'gateway': ['istio'], 'mesh': ['crds']}) == {
+            'gateway': {'istio'}, 'istio': set(), 'mesh': set(), 'crds': {'mesh'}}
+
+    def test_provider_case(self):
+        # The README example writes the provider in lower case
+        for provider, expected in (('aws', 'AWS'), ('AZURE', 'Azure'), ('gcp', 'GCP')):
+            assert reconcile.parse_spec({'name': 'eks', 'provider': provider, 'region': 'r'})['provider'] == expected
+        with pytest.raises(ValueError, match='Unsupported provider'):
+            reconcile.parse_spec({'name': 'eks', 'provider': 'oracle', 'region': 'r'})
+
+    def test_invalid_spec(self):
+        with pytest.raises(ValueError):
+            reconcile.parse_spec({'name': 'eks', 'provider': 'AWS'})
+        with pytest.raises(ValueError):
+            reconcile.parse_spec({'name': 'eks', 'provider': 'AWS', 'region': 'r', 'products': [{'name': 'a'}, {'name': 'a'}]})
+        with pytest.raises(ValueError):
+            reconcile.parse_spec({'name': 'eks', 'provider': 'AWS', 'region': 'r', 'products': [{'name': 'a', 'port': 'http'}]})
+
+
+class TestApply:
+    def test_apply_then_nothing_to_do(self, cluster, running, monkeypatch):
+        calls, failing, spec_file = cluster
+        result = CliRunner().invoke(lab2.cli, ['apply', '-f', str(spec_file)])
+        assert result.exit_code == 0, result.output
+        # The products are installed at the same time, once the cluster exists and is the current context
+        assert running['peak'] == 2
+        assert calls[:2] == [('create', 'sample'), ('use',)]
+        assert sorted(calls[2:]) == [('install', 'istio'), ('install', 'nginx')]
+        products = registry.get_registry().get('sample')['products']
+        assert products == [{'name': 'nginx', 'type': 'operator', 'version': '1.0.0', 'replicas': 2, 'port': 80},
+                            {'name': 'istio', 'type': 'deployment', 'version': '1.2'}]
+        calls.clear()
+        # The same spec again only reads the registry state
+        monkeypatch.setattr(registry.ClusterRegistry, 'get', lambda self, name: pytest.fail('the cluster file was read'))
+        result = CliRunner().invoke(lab2.cli, ['apply', '-f', str(spec_file)])
+        assert result.exit_code == 0 and calls == []
+        assert 'nothing to do' in result.output
+
+    def test_only_the_changes_run(self, cluster):
+        calls, failing, spec_file = cluster
+        CliRunner().invoke(lab2.cli, ['apply', '-f', str(spec_file)])
+        calls.clear()
+        spec_file.write_text(SPEC.replace('replicas: 2', 'replicas: 3').split('  - name: istio')[0])
+        result = CliRunner().invoke(lab2.cli, ['apply', '-f', str(spec_file), '--dry-run'])
+        assert 'Plan: update nginx (operator 1.0.0)' in result.output and 'Plan: remove istio' in result.output
+        assert calls == []
+        result = CliRunner().invoke(lab2.cli, ['apply', '-f', str(spec_file)])
+        assert result.exit_code == 0, result.output
+        assert sorted(calls) == [('install', 'nginx'), ('uninstall', 'istio'), ('use',)]
+        assert [product['name'] for product in registry.get_registry().get('sample')['products']] == ['nginx']
+
+    def test_failed_action_is_retried(self, cluster):
+        calls, failing, spec_file = cluster
+        failing.add('istio')
+        result = CliRunner().invoke(lab2.cli, ['apply', '-f', str(spec_file)])
+        assert result.exit_code == 1
+        assert 'Add istio (deployment 1.2): failed' in result.output
+        # Only what succeeded is recorded, the next apply retries the rest
+        assert [product['name'] for product in registry.get_registry().get('sample')['products']] == ['nginx']
+        failing.clear()
+        calls.clear()
+        assert CliRunner().invoke(lab2.cli, ['apply', '-f', str(spec_file)]).exit_code == 0
+        assert calls == [('use',), ('install', 'istio')]
+
+    def test_dependents_wait_and_are_skipped(self, cluster, monkeypatch):
+        calls, failing, spec_file = cluster
+        monkeypatch.setattr(lab2_products.catalog.Catalog, 'dependencies', lambda self: {'nginx': ['istio']})
+        result = CliRunner().invoke(lab2.cli, ['apply', '-f', str(spec_file)])
+        assert result.exit_code == 0, result.output
+        assert calls[2:] == [('install', 'istio'), ('install', 'nginx')]
+        spec_file.write_text(SPEC.replace('1.0.0', '1.1.0').replace('1.20', '1.21'))
+        failing.add('istio')
+        result = CliRunner().invoke(lab2.cli, ['apply', '-f', str(spec_file)])
+        assert result.exit_code == 1
+        assert 'Update nginx (operator 1.1.0): skipped.' in result.output
+        # Nothing changed on the cluster, the recorded versions stay
+        assert [product['version'] for product in registry.get_registry().get('sample')['products']] == ['1.0.0', '1.2']
+
+    def test_failed_create_is_not_recorded(self, tmp_path, monkeypatch, products):
+        monkeypatch.setattr(lab2, 'create_eks', lambda *args: False)
+        monkeypatch.setattr(lab2_products, 'install_product', lambda product: pytest.fail('installed on a cluster that does not exist'))
+        spec_file = tmp_path / 'cluster.yaml'
+        spec_file.write_text(SPEC)
+        result = CliRunner().invoke(lab2.cli, ['apply', '-f', str(spec_file)])
+        assert result.exit_code == 1
+        assert 'Create cluster: failed' in result.output
+        assert 'successfully created' not in result.output
+        # The next apply creates it again
+        assert registry.get_registry().get('sample') is None
+        assert registry.get_registry().get_state('sample') == {}
+
+    def test_unknown_product(self, cluster):
+        calls, failing, spec_file = cluster
+        spec_file.write_text(SPEC + '  - name: falco\n')
+        result = CliRunner().invoke(lab2.cli, ['apply', '-f', str(spec_file)])
+        assert result.exit_code == 1
+        # Reported before the cluster is created
+        assert 'Products not in the catalog: falco.' in result.output
+        assert calls == []
@@ -0,0 +1,71 @@
+import os
+import time
+
+import yaml
+import pytest
+import registry
+
+
+def write_cluster(clusters_dir, name, **fields):
+    with open(os.path.join(clusters_dir, f'{name}_cluster.yaml'), 'w') as f:
+        yaml.safe_dump({'name': name, **fields}, f)
+
+
+class TestClusterRegistry:
+    @pytest.fixture
+    def clusters_dir(self, tmp_path):
+        clusters_dir = tmp_path / 'clusters'
+        clusters_dir.mkdir()
+        write_cluster(clusters_dir, 'eks-1', provider='AWS', region='eu-west-2')
+        write_cluster(clusters_dir, 'eks-2', provider='AWS', region='us-east-1')
+        write_cluster(clusters_dir, 'aks-1', provider='Azure', region='eastus', resource_group='rg')
+        # Files that are not cluster files are ignored
+        (clusters_dir / 'cluster_sample.yaml').write_text('name: sample\n')
+        return str(clusters_dir)
+
+    def test_migrates_existing_files(self, clusters_dir):
+        reg = registry.ClusterRegistry(clusters_dir)
+        assert [c['name'] for c in reg.search()] == ['aks-1', 'eks-1', 'eks-2']
+        assert reg.get('aks-1')['resource_group'] == 'rg'
+        assert reg.get('sample') is None
+
+    def test_indexed_filters(self, clusters_dir):
+        reg = registry.ClusterRegistry(clusters_dir)
+        assert [c['name'] for c in reg.search(provider='AWS')] == ['eks-1', 'eks-2']
+        assert [c['name'] for c in reg.search(provider='AWS', region='us-east-1')] == ['eks-2']
+        assert [c['name'] for c in reg.search(name='eks-*')] == ['eks-1', 'eks-2']
+        assert reg.search(name='gke-*') == []
+
+    def test_only_changed_files_are_parsed_again(self, clusters_dir, monkeypatch):
+        reg = registry.ClusterRegistry(clusters_dir)
+        reg.search()
+        parsed = []
+        original = reg.load_file
+        monkeypatch.setattr(reg, 'load_file', lambda file, stat: parsed.append(file) or original(file, stat))
+        reg.search()
+        assert reg.get('eks-1')['region'] == 'eu-west-2'
+        assert parsed == []
+        time.sleep(0.01)
+        write_cluster(clusters_dir, 'eks-1', provider='AWS', region='eu-central-1')
+        assert reg.get('eks-1')['region'] == 'eu-central-1'
+        assert parsed == ['eks-1_cluster.yaml']
+
+    def test_removed_files_leave_the_index(self, clusters_dir):
+        reg = registry.ClusterRegistry(clusters_dir)
+        reg.search()
+        os.remove(os.path.join(clusters_dir, 'eks-2_cluster.yaml'))
+        assert reg.get('eks-2') is None
+        assert [c['name'] for c in reg.search(provider='AWS')] == ['eks-1']
+
+    def test_save_remove_and_state(self, clusters_dir):
+        reg = registry.ClusterRegistry(clusters_dir)
+        reg.save({'name': 'gke-1', 'provider': 'GCP', 'region': 'europe-west1', 'project': 'p'})
+        assert os.path.isfile(os.path.join(clusters_dir, 'gke-1_cluster.yaml'))
+        assert reg.update_state('gke-1', location='europe-west1-b')
+        # Registry-only state survives a change of the cluster file
+        reg.save({'name': 'gke-1', 'provider': 'GCP', 'region': 'europe-west1', 'project': 'p2'})
+        assert reg.get_state('gke-1') == {'location': 'europe-west1-b'}
+        assert reg.remove('gke-1')
+        assert reg.get('gke-1') is None
+        assert not os.path.exists(os.path.join(clusters_dir, 'gke-1_cluster.yaml'))
+        assert not reg.update_state('gke-1', location='x')
@@ -0,0 +1,74 @@
+import json
+import sys
+import threading
+import time
+
+import runner
+
+
+def python(code: str) -> list:
+    return [sys.executable, '-c', code]
+
+
+class TestRunner:
+    def test_captures_both_streams_without_a_shell(self):
+        result = runner.run(python("import sys; print(sys.argv[1]); print('oops', file=sys.stderr)") + ['a b; echo c'])
+        assert result.ok and result.reason == 'exited'
+        # The argument reaches the program as is, nothing is interpreted by a shell
+        assert result.stdout == 'a b; echo c\n'
+        assert result.stderr == 'oops\n'
+
+    def test_failure_and_check(self):
+        result = runner.run(python("raise SystemExit(3)"))
+        assert not result and result.returncode == 3
+        try:
+            result.check()
+        except runner.subprocess.CalledProcessError as e:
+            assert e.returncode == 3
+        else:
+            assert False, "check() did not raise"
+
+    def test_missing_executable(self):
+        result = runner.run(['klab-no-such-command', '--version'])
+        assert result.returncode == 127 and result.reason == 'not found'
+
+    def test_output_is_streamed_to_the_log(self, tmp_path):
+        log_file = str(tmp_path / 'provider.log')
+        runner.run(python("print('first'); print('second')"), log_file, cwd=str(tmp_path))
+        runner.jsonlog.flush()
+        with open(log_file) as f:
+            lines = [json.loads(line) for line in f]
+        assert lines[0]['message'].endswith(f"(in {tmp_path})")
+        assert [line['message'] for line in lines[1:3]] == ['first', 'second']
+        assert all(line['command'] == sys.executable for line in lines)
+        assert 'finished with exit code 0' in lines[3]['message']
+
+    def test_timeout_kills_the_command(self):
+        start = time.monotonic()
+        result = runner.run(python("import time; time.sleep(30)"), timeout=0.5)
+        assert result.reason == 'timeout' and not result.ok
+        assert time.monotonic() - start < 10
+
+    def test_cancel(self):
+        cancel_event = threading.Event()
+        command = runner.start(python("import time; time.sleep(30)"), cancel_event=cancel_event)
+        cancel_event.set()
+        assert command.wait().reason == 'cancelled'
+
+    def test_run_many_runs_at_the_same_time(self, tmp_path):
+        # Every command marks that it started and waits for the others, they only all finish if they run at once
+        wait_for_all = ("import os, sys, time\nopen(os.path.join(sys.argv[1], sys.argv[2]), 'w').close()\n"
+                        "deadline = time.monotonic() + 10\n"
+                        "while len(os.listdir(sys.argv[1])) < 4 and time.monotonic() < deadline:\n    time.sleep(0.05)\n"
+                        "print(sys.argv[2], len(os.listdir(sys.argv[1])))")
+        results = runner.run_many([python(wait_for_all) + [str(tmp_path), str(i)] for i in range(4)], max_workers=4)
+        assert [result.stdout for result in results] == ['0 4\n', '1 4\n', '2 4\n', '3 4\n']
+
+    def test_timings(self, monkeypatch):
+        monkeypatch.setattr(runner, 'stats', {})
+        for _ in range(3):
+            runner.run(python("pass"))
+        count, total, slowest = runner.timings()[sys.executable]
+        assert count == 3 and total >= slowest > 0
+        # Only the totals are kept, not the results
+        assert list(runner.stats) == [sys.executable]
@@ -0,0 +1,56 @@
+import threading
+import time
+
+import pytest
+import scheduler
+
+# CRDs first, then the operator and the webhook that need them, then the custom resources of the operator
+DEPENDS_ON = {'crds': [], 'operator': ['crds'], 'webhook': ['crds'], 'gateway': ['operator'], 'dashboard': []}
+
+
+class TestScheduler:
+    def test_critical_path(self):
+        started = {}
+        lock = threading.Lock()
+
+        def task(name):
+            def install():
+                with lock:
+                    started[name] = time.monotonic()
+                time.sleep(0.2)
+                return True
+            return install
+
+        updates = []
+        start = time.monotonic()
+        status = scheduler.run({name: task(name) for name in DEPENDS_ON}, DEPENDS_ON, workers=4,
+                               on_status=lambda name, new_status, elapsed: updates.append((name, new_status)))
+        # crds -> operator -> gateway is the longest chain, the rest runs next to it
+        assert time.monotonic() - start < 0.75
+        assert set(status.values()) == {scheduler.SUCCEEDED}
+        assert started['operator'] >= started['crds'] + 0.2 and started['gateway'] >= started['operator'] + 0.2
+        assert abs(started['dashboard'] - started['crds']) < 0.1
+        assert [new_status for name, new_status in updates if name == 'gateway'] == [scheduler.RUNNING, scheduler.SUCCEEDED]
+
+    def test_failure_skips_the_dependents(self):
+        ran = []
+
+        def task(name):
+            def install():
+                ran.append(name)
+                if name == 'operator':
+                    raise RuntimeError('make deploy failed')
+                return True
+            return install
+
+        status = scheduler.run({name: task(name) for name in DEPENDS_ON}, DEPENDS_ON, workers=2)
+        assert status == {'crds': scheduler.SUCCEEDED, 'operator': scheduler.FAILED, 'webhook': scheduler.SUCCEEDED,
+                          'gateway': scheduler.SKIPPED, 'dashboard': scheduler.SUCCEEDED}
+        assert 'gateway' not in ran
+
+    def test_order(self):
+        assert scheduler.order(DEPENDS_ON).index('crds') < scheduler.order(DEPENDS_ON).index('gateway')
+        with pytest.raises(ValueError, match='cycle'):
+            scheduler.order({'a': ['b'], 'b': ['a'], 'c': []})
+        with pytest.raises(ValueError, match='not part'):
+            scheduler.run({'a': lambda: True}, {'a': ['b']})
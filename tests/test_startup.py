@@ -0,0 +1,52 @@
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+SOURCE_DIR = os.path.join(os.path.dirname(__file__), '..', 'klab-cli')
+# Cumulative import time of the cli in microseconds, lab is called hundreds of times per pipeline run
+IMPORT_BUDGET_US = 200_000
+
+
+def python(code: str, cwd: str, *flags) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, *flags, '-c', code], cwd=cwd, capture_output=True, text=True, timeout=60)
+
+
+def loaded_modules(module: str, *args) -> set:
+    # The modules loaded to run a command of the cli, e.g. lab create --help
+    code = f"import sys, {module}\ntry:\n    {module}.cli({list(args)!r})\nexcept SystemExit:\n    print(' '.join(sys.modules), file=sys.stderr)"
+    result = python(code, SOURCE_DIR)
+    assert result.returncode == 0, result.stderr
+    return set(result.stderr.split())
+
+
+class TestStartup:
+    def test_import_has_no_side_effects(self, tmp_path):
+        for file in os.listdir(SOURCE_DIR):
+            if file.endswith('.py'):
+                shutil.copy(os.path.join(SOURCE_DIR, file), tmp_path)
+        result = python("import sys, lab2, lab; print('kubernetes' in sys.modules)", str(tmp_path))
+        assert result.returncode == 0, result.stderr
+        # The kubernetes client is only loaded to apply a manifest
+        assert result.stdout.strip() == 'False'
+        assert not (tmp_path / 'logs').exists() and not (tmp_path / 'credentials').exists()
+
+    # lab is what the lab entry point imports, lab2 is what the background jobs run
+    @pytest.mark.parametrize('module', ['lab', 'lab2'])
+    def test_import_time_budget(self, module):
+        result = python(f"import {module}", SOURCE_DIR, '-X', 'importtime')
+        assert result.returncode == 0, result.stderr
+        # "import time: self [us] | cumulative | imported package"
+        cumulative = [int(line.split('|')[1]) for line in result.stderr.splitlines() if line.split('|')[-1].strip() == module]
+        assert cumulative and cumulative[0] < IMPORT_BUDGET_US, f"importing {module} took {cumulative}us"
+
+    @pytest.mark.parametrize('module, product_modules', [
+        ('lab', {'lab_products', 'deploy', 'kubeapply', 'catalog'}),
+        ('lab2', {'lab2_products', 'lab2_jobs', 'lab2_logs', 'deploy', 'reconcile', 'scheduler', 'logtail', 'jobs', 'catalog'}),
+    ])
+    def test_commands_are_loaded_when_run(self, module, product_modules):
+        # A cluster command does not import the modules of the product commands
+        assert not loaded_modules(module, 'create', '--help') & product_modules
+        assert f"{module}_products" in loaded_modules(module, 'add', '--help')
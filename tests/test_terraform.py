@@ -0,0 +1,162 @@
+import os
+import stat
+import sys
+
+import pytest
+import terraform
+
+# Records its arguments and exits with the code of the plan, like terraform plan -detailed-exitcode
+FAKE_TERRAFORM = f"""#!{sys.executable}
+import os, sys
+with open(os.environ['FAKE_TERRAFORM_CALLS'], 'a') as calls:
+    calls.write(' '.join(sys.argv[1:2]) + '\\n')
+if sys.argv[1] == 'init':
+    # Like terraform init, the lock file is created in the module the first time
+    open('.terraform.lock.hcl', 'a').close()
+if sys.argv[1] == 'plan':
+    out = [arg[5:] for arg in sys.argv if arg.startswith('-out=')][0]
+    open(out, 'w').close()
+    sys.exit(int(os.environ.get('FAKE_PLAN_EXIT', '2')))
+"""
+
+
+@pytest.fixture
+def module(tmp_path):
+    module_dir = tmp_path / 'AWS'
+    (module_dir / 'modules' / 'vpc').mkdir(parents=True)
+    (module_dir / 'main.tf').write_text('resource "null_resource" "a" {}\n')
+    (module_dir / 'modules' / 'vpc' / 'main.tf').write_text('variable "cidr" {}\n')
+    return module_dir
+
+
+@pytest.fixture
+def fake_terraform(tmp_path, monkeypatch):
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    executable = bin_dir / 'terraform'
+    executable.write_text(FAKE_TERRAFORM)
+    executable.chmod(executable.stat().st_mode | stat.S_IEXEC)
+    calls = tmp_path / 'calls'
+    calls.write_text('')
+    monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv('FAKE_TERRAFORM_CALLS', str(calls))
+    monkeypatch.setenv('TF_PLUGIN_CACHE_DIR', str(tmp_path / 'plugin-cache'))
+    return lambda: calls.read_text().split()
+
+
+class TestFingerprint:
+    def test_depends_on_configuration_and_inputs(self, module):
+        digest = terraform.fingerprint(str(module), {'region': 'eu-west-2'}, {})
+        assert terraform.fingerprint(str(module), {'region': 'eu-west-2'}, {}) == digest
+        assert terraform.fingerprint(str(module), {'region': 'eu-west-1'}, {}) != digest
+        assert terraform.fingerprint(str(module), {'region': 'eu-west-2'}, {'bucket': 'b'}) != digest
+        (module / 'modules' / 'vpc' / 'main.tf').write_text('variable "cidr" { default = "10.0.0.0/16" }\n')
+        assert terraform.fingerprint(str(module), {'region': 'eu-west-2'}, {}) != digest
+
+    def test_ignores_logs_state_and_plans(self, module):
+        digest = terraform.fingerprint(str(module), {}, {})
+        (module / 'log').mkdir()
+        (module / 'log' / 'kubelab.log').write_text('output')
+        (module / 'terraform.tfstate').write_text('{}')
+        (module / '.terraform').mkdir()
+        (module / '.terraform' / 'providers.tf').write_text('cache')
+        terraform.PlanCache(str(module), 'eks').write(digest, applied=False)
+        (module / terraform.LOCK_FILE).write_text('provider "registry.terraform.io/hashicorp/aws" {}\n')
+        assert terraform.fingerprint(str(module), {}, {}) == digest
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='the fake terraform is a script')
+class TestPlanAndApply:
+    def test_second_run_is_skipped(self, module, fake_terraform):
+        assert terraform.plan_and_apply(str(module), 'eks', {'region': 'eu-west-2'}) == terraform.APPLIED
+        assert fake_terraform() == ['init', 'plan', 'apply']
+        assert terraform.plan_and_apply(str(module), 'eks', {'region': 'eu-west-2'}) == terraform.UNCHANGED
+        assert fake_terraform() == ['init', 'plan', 'apply']
+        # The applied plan is not kept around
+        assert not os.path.exists(terraform.PlanCache(str(module), 'eks').plan_file)
+
+    def test_rerun_after_init_wrote_the_lock_file(self, module, fake_terraform):
+        assert not (module / terraform.LOCK_FILE).exists()
+        assert terraform.plan_and_apply(str(module), 'eks', {'region': 'eu-west-2'}) == terraform.APPLIED
+        assert (module / terraform.LOCK_FILE).exists()
+        # The first re-run already has nothing to do
+        assert terraform.plan_and_apply(str(module), 'eks', {'region': 'eu-west-2'}) == terraform.UNCHANGED
+        assert fake_terraform() == ['init', 'plan', 'apply']
+
+    def test_changed_inputs_and_replan(self, module, fake_terraform, monkeypatch):
+        terraform.plan_and_apply(str(module), 'eks', {'region': 'eu-west-2'})
+        monkeypatch.setenv('FAKE_PLAN_EXIT', '0')
+        assert terraform.plan_and_apply(str(module), 'eks', {'region': 'eu-west-2'}, force=True) == terraform.NO_CHANGES
+        assert terraform.plan_and_apply(str(module), 'eks', {'region': 'eu-west-1'}) == terraform.NO_CHANGES
+        assert fake_terraform() == ['init', 'plan', 'apply', 'init', 'plan', 'init', 'plan']
+
+    def test_saved_plan_is_reused_and_failures_are_not_cached(self, module, fake_terraform, monkeypatch):
+        cache = terraform.PlanCache(str(module), 'eks')
+        digest = terraform.fingerprint(str(module), {}, {})
+        cache.write(digest, applied=False)
+        open(cache.plan_file, 'w').close()
+        assert terraform.plan_and_apply(str(module), 'eks', {}) == terraform.APPLIED
+        assert fake_terraform() == ['init', 'apply']
+        monkeypatch.setenv('FAKE_PLAN_EXIT', '1')
+        assert terraform.plan_and_apply(str(module), 'eks', {}, force=True) == terraform.FAILED
+        assert cache.read() == {}
+
+
+class TestProviderMirror:
+    @pytest.fixture
+    def klab_home(self, tmp_path, monkeypatch):
+        monkeypatch.delenv('TF_PLUGIN_CACHE_DIR', raising=False)
+        monkeypatch.delenv('TF_CLI_CONFIG_FILE', raising=False)
+        monkeypatch.setattr(terraform.const, 'TF_PLUGIN_CACHE_DIR', str(tmp_path / 'home' / 'plugin-cache'))
+        monkeypatch.setattr(terraform.const, 'TF_CLI_CONFIG_FILE', str(tmp_path / 'home' / 'terraformrc'))
+        return tmp_path / 'home'
+
+    def test_shared_plugin_cache_and_mirror_config(self, klab_home, tmp_path):
+        assert terraform.init_env() == {'TF_PLUGIN_CACHE_DIR': str(klab_home / 'plugin-cache')}
+        assert (klab_home / 'plugin-cache').is_dir()
+        config_file = terraform.write_mirror_config(str(tmp_path))
+        assert f'path = "{tmp_path}"' in open(config_file).read()
+        assert terraform.init_env()['TF_CLI_CONFIG_FILE'] == config_file
+
+    def test_providers_are_hardlinked_into_the_module(self, module, tmp_path):
+        provider = tmp_path / 'mirror' / 'registry.terraform.io' / 'hashicorp' / 'aws' / '5.0.0' / 'linux_amd64'
+        provider.mkdir(parents=True)
+        (provider / 'terraform-provider-aws_v5.0.0').write_text('binary')
+        # Packed providers are left to terraform
+        (tmp_path / 'mirror' / 'registry.terraform.io' / 'hashicorp' / 'aws' / 'terraform-provider-aws_5.0.0_linux_amd64.zip').write_text('zip')
+        assert terraform.link_mirror(str(tmp_path / 'mirror'), str(module)) == 1
+        linked = module / '.terraform' / 'providers' / 'registry.terraform.io' / 'hashicorp' / 'aws' / '5.0.0' / 'linux_amd64' / 'terraform-provider-aws_v5.0.0'
+        assert linked.stat().st_ino == (provider / 'terraform-provider-aws_v5.0.0').stat().st_ino
+        assert terraform.link_mirror(str(tmp_path / 'mirror'), str(module)) == 0
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='workspaces are copied instead of linked without symlinks')
+class TestWorkspace:
+    def test_stamped_from_the_module(self, module, tmp_path):
+        (module / 'terraform.tfstate').write_text('{}')
+        (module / '.terraform').mkdir()
+        (module / terraform.LOCK_FILE).write_text('lock')
+        workdir = tmp_path / 'workspaces' / 'eks'
+        terraform.stamp_workspace(str(module), str(workdir))
+        assert os.readlink(workdir / 'modules' / 'vpc' / 'main.tf') == str(module / 'modules' / 'vpc' / 'main.tf')
+        # State, plugins and plans of the module are not shared, the lock file is a copy terraform can rewrite
+        assert not (workdir / 'terraform.tfstate').exists() and not (workdir / '.terraform').exists()
+        assert not os.path.islink(workdir / terraform.LOCK_FILE)
+        assert terraform.fingerprint(str(workdir), {}, {}) == terraform.fingerprint(str(module), {}, {})
+
+    def test_follows_the_module(self, module, tmp_path):
+        workdir = tmp_path / 'workspaces' / 'eks'
+        terraform.stamp_workspace(str(module), str(workdir))
+        (workdir / 'terraform.tfstate').write_text('{"serial": 1}')
+        (module / 'modules' / 'vpc' / 'main.tf').unlink()
+        (module / 'outputs.tf').write_text('output "a" { value = 1 }\n')
+        terraform.stamp_workspace(str(module), str(workdir))
+        assert not os.path.lexists(workdir / 'modules' / 'vpc' / 'main.tf')
+        assert (workdir / 'outputs.tf').read_text() == 'output "a" { value = 1 }\n'
+        assert (workdir / 'terraform.tfstate').read_text() == '{"serial": 1}'
+
+
+class TestInitLocks:
+    def test_module_providers(self, module):
+        (module / 'modules' / 'vpc' / 'providers.tf').write_text('provider "aws" {\n}\n  provider "random" {}\n# provider "google"\n')
+        assert terraform.module_providers(str(module)) == ['aws', 'random']
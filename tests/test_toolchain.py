@@ -0,0 +1,67 @@
+import os
+import stat
+import sys
+
+import pytest
+import toolchain
+
+# Counts its runs, prints a version and fails "account show" unless logged in
+FAKE_CLI = f"""#!{sys.executable}
+import os, sys
+with open(os.environ['FAKE_CLI_CALLS'], 'a') as calls:
+    calls.write(' '.join(sys.argv[1:]) + '\\n')
+if sys.argv[1:] == ['account', 'show']:
+    sys.exit(0 if os.environ.get('FAKE_CLI_LOGGED_IN') else 1)
+print('azure-cli 2.60.0')
+"""
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='the fake cli is a script')
+class TestToolchain:
+    @pytest.fixture
+    def az(self, tmp_path, monkeypatch):
+        bin_dir = tmp_path / 'bin'
+        bin_dir.mkdir()
+        executable = bin_dir / 'az'
+        executable.write_text(FAKE_CLI)
+        executable.chmod(executable.stat().st_mode | stat.S_IEXEC)
+        calls = tmp_path / 'calls'
+        calls.write_text('')
+        monkeypatch.setenv('PATH', str(bin_dir))
+        monkeypatch.setenv('FAKE_CLI_CALLS', str(calls))
+        monkeypatch.setenv('FAKE_CLI_LOGGED_IN', '1')
+        monkeypatch.delenv(toolchain.const.TOOLCHAIN_TTL_ENV, raising=False)
+        monkeypatch.setattr(toolchain.const, 'TOOLCHAIN_CACHE_FILE', str(tmp_path / 'toolchain.json'))
+        profile = tmp_path / 'azureProfile.json'
+        monkeypatch.setitem(toolchain.TOOLS['az'], 'files', [str(profile)])
+        return executable, profile, lambda: calls.read_text().splitlines()
+
+    def test_probe_is_cached(self, az):
+        executable, profile, calls = az
+        first = toolchain.probe('az')
+        assert first.installed and first.authenticated and first.version == 'azure-cli 2.60.0' and not first.cached
+        second = toolchain.probe('az')
+        assert second.cached and second.version == first.version and second.path == str(executable)
+        assert calls() == ['--version', 'account show']
+
+    def test_binary_or_login_changes_invalidate_the_cache(self, az, monkeypatch):
+        executable, profile, calls = az
+        monkeypatch.delenv('FAKE_CLI_LOGGED_IN')
+        assert toolchain.probe('az').authenticated is False
+        monkeypatch.setenv('FAKE_CLI_LOGGED_IN', '1')
+        # az login writes the profile
+        profile.write_text('{}')
+        assert toolchain.probe('az').authenticated
+        executable.write_text(executable.read_text() + '\n')
+        assert not toolchain.probe('az').cached
+        assert len(calls()) == 6
+
+    def test_ttl_and_refresh(self, az, monkeypatch):
+        toolchain.probe('az')
+        assert not toolchain.probe('az', refresh=True).cached
+        monkeypatch.setenv(toolchain.const.TOOLCHAIN_TTL_ENV, '0')
+        assert not toolchain.probe('az').cached
+
+    def test_missing_tool(self, az):
+        missing = toolchain.probe('gcloud')
+        assert not missing.ok and missing.path is None
@@ -0,0 +1,79 @@
+import threading
+import subprocess
+
+import waiter
+
+
+class TestWaiter:
+    def test_waits_until_predicate_is_done(self):
+        calls = []
+
+        def predicate():
+            calls.append(1)
+            return len(calls) == 3 and 'ACTIVE'
+
+        result = waiter.wait_until(predicate, 'cluster', initial_delay=0.01, max_delay=0.02)
+        assert result.done
+        assert result.value == 'ACTIVE'
+        assert result.polls == 3
+        assert result.reason == 'done'
+
+    def test_backoff_grows_and_is_capped(self):
+        delays = waiter.Waiter('x', initial_delay=1, max_delay=8, multiplier=2, jitter=0).delays()
+        assert [next(delays) for _ in range(6)] == [1, 2, 4, 8, 8, 8]
+
+    def test_jitter_stays_in_bounds(self):
+        delays = waiter.Waiter('x', initial_delay=10, max_delay=10, jitter=0.2).delays()
+        assert all(8 <= next(delays) <= 12 for _ in range(100))
+
+    def test_timeout(self):
+        result = waiter.wait_until(lambda: False, 'never', timeout=0.05, initial_delay=0.01, max_delay=0.01)
+        assert not result
+        assert result.reason == 'timeout'
+        assert result.polls > 1
+        assert result.elapsed >= 0.05
+
+    def test_cancel_interrupts_the_sleep(self):
+        event = threading.Event()
+        threading.Timer(0.05, event.set).start()
+        result = waiter.wait_until(lambda: False, 'cancelled', initial_delay=30, cancel_event=event)
+        assert result.reason == 'cancelled'
+        assert result.elapsed < 5
+
+    def test_retry_on_exceptions(self):
+        calls = []
+
+        def predicate():
+            calls.append(1)
+            if len(calls) < 2:
+                raise subprocess.CalledProcessError(1, 'aws')
+            return True
+
+        result = waiter.wait_until(predicate, 'flaky', initial_delay=0.01, retry_on=(subprocess.CalledProcessError,))
+        assert result.done
+        assert result.polls == 2
+
+
+class TestWaitAll:
+    def test_tracks_every_key_with_one_poll_loop(self):
+        # Each group disappears from the listing after a different number of polls
+        gone_after = {'ng-1': 1, 'ng-2': 3, 'ng-3': 2}
+        listings = []
+
+        def poll(pending):
+            listings.append(set(pending))
+            return {group for group in pending if len(listings) >= gone_after[group]}
+
+        results = waiter.wait_all(gone_after, poll, 'node group', initial_delay=0.01, max_delay=0.01)
+        assert all(results.values())
+        assert len(listings) == 3
+        assert [results[group].polls for group in ('ng-1', 'ng-3', 'ng-2')] == [1, 2, 3]
+        assert results['ng-1'].elapsed <= results['ng-3'].elapsed <= results['ng-2'].elapsed
+        # Groups already gone are not asked about anymore
+        assert listings[-1] == {'ng-2'}
+
+    def test_reports_the_groups_left_behind(self):
+        results = waiter.wait_all(['a', 'b'], lambda pending: {'a'}, 'pool', timeout=0.05, initial_delay=0.01, max_delay=0.01)
+        assert results['a'].done
+        assert not results['b'].done
+        assert results['b'].reason == 'timeout'
@@ -0,0 +1,44 @@
+import os
+import time
+
+import yaml
+import yamlio
+import yaml_benchmark
+
+
+class TestYamlIO:
+    def test_uses_libyaml_when_available(self):
+        assert yamlio.LIBYAML == getattr(yaml, '__with_libyaml__', False)
+        if yamlio.LIBYAML:
+            assert yamlio.SafeLoader is yaml.CSafeLoader
+            assert yamlio.SafeDumper is yaml.CSafeDumper
+
+    def test_load_is_cached_until_the_file_changes(self, tmp_path, monkeypatch):
+        path = str(tmp_path / 'clusters.yaml')
+        yamlio.dump([{'cluster_name': 'eks'}], path)
+        parses = []
+        original = yaml.load
+        monkeypatch.setattr(yaml, 'load', lambda *args, **kwargs: parses.append(1) or original(*args, **kwargs))
+        assert yamlio.load(path) == [{'cluster_name': 'eks'}]
+        assert yamlio.load(path) == [{'cluster_name': 'eks'}]
+        assert len(parses) == 1
+        time.sleep(0.01)
+        with open(path, 'w') as f:
+            f.write('- cluster_name: aks\n')
+        assert yamlio.load(path) == [{'cluster_name': 'aks'}]
+        assert len(parses) == 2
+
+    def test_load_returns_copies(self, tmp_path):
+        path = str(tmp_path / 'clusters.yaml')
+        yamlio.dump([{'cluster_name': 'eks'}], path)
+        yamlio.load(path).append('garbage')
+        assert yamlio.load(path) == [{'cluster_name': 'eks'}]
+
+    def test_defaults(self, tmp_path):
+        assert yamlio.load(str(tmp_path / 'missing.yaml'), default=[]) == []
+        (tmp_path / 'empty.yaml').write_text('')
+        assert yamlio.load(str(tmp_path / 'empty.yaml'), default=[]) == []
+
+    def test_benchmark_runs(self):
+        results = yaml_benchmark.run(30)
+        assert results['registry get by name'] < results['pure python scan']
@@ -0,0 +1,70 @@
+import os
+import sys
+import tempfile
+import time
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'klab-cli'))
+import registry  # noqa: E402
+import yamlio  # noqa: E402
+
+
+def make_clusters(clusters_dir: str, count: int):
+    os.makedirs(clusters_dir, exist_ok=True)
+    for i in range(count):
+        cluster = {
+            'name': f'cluster-{i}',
+            'provider': ('AWS', 'Azure', 'GCP')[i % 3],
+            'region': ('eu-west-2', 'eastus', 'europe-west1')[i % 3],
+            'credential_file': 'credentials/AWS_kube_credential',
+            'resource_group': None,
+            'project': None,
+            'products': [{'name': 'nginx', 'type': 'deployment', 'version': '1.25.0', 'replicas': 2, 'port': 80}],
+        }
+        with open(os.path.join(clusters_dir, f'cluster-{i}_cluster.yaml'), 'w') as f:
+            yaml.safe_dump(cluster, f)
+
+
+def timed(function, repeat: int = 3) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def scan(clusters_dir: str, loader):
+    # What search_clusters used to do on every call: list the directory and parse every file
+    for file in os.listdir(clusters_dir):
+        if file.endswith('_cluster.yaml'):
+            with open(os.path.join(clusters_dir, file)) as f:
+                yaml.load(f, Loader=loader)
+
+
+def run(count: int = 1000) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        clusters_dir = os.path.join(tmp, 'clusters')
+        make_clusters(clusters_dir, count)
+        results = {'pure python scan': timed(lambda: scan(clusters_dir, yaml.SafeLoader))}
+        if yamlio.LIBYAML:
+            results['libyaml scan'] = timed(lambda: scan(clusters_dir, yamlio.SafeLoader))
+        paths = [os.path.join(clusters_dir, f'cluster-{i}_cluster.yaml') for i in range(count)]
+        [yamlio.load(path) for path in paths]
+        results['cached yamlio.load'] = timed(lambda: [yamlio.load(path) for path in paths])
+        reg = registry.ClusterRegistry(clusters_dir)
+        results['registry first sync'] = timed(reg.sync, repeat=1)
+        results['registry search provider=AWS'] = timed(lambda: reg.search(provider='AWS'))
+        results['registry get by name'] = timed(lambda: reg.get(f'cluster-{count // 2}'))
+        return results
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    results = run(count)
+    baseline = results['pure python scan']
+    print(f"{count} clusters, libyaml available: {yamlio.LIBYAML}")
+    for name, elapsed in results.items():
+        print(f"{name:<32} {elapsed * 1000:10.2f} ms  {baseline / elapsed:8.1f}x")